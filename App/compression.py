@@ -0,0 +1,122 @@
+import gzip, threading
+from collections import OrderedDict
+from flask import request
+
+from App.metrics import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses above COMPRESS_MIN_SIZE are compressed with the best encoding the client
+# accepts. GET responses get a content hash ETag, and their compressed bodies are cached
+# under (ETag, encoding), so an unchanged leaderboard is compressed once, not per request.
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/')
+
+class CompressedCache:
+    """Compressed bodies by (etag, encoding), least recently used evicted past max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+def accepted_encodings(header):
+    """Encodings of an Accept-Encoding header with their q-values, refused ones (q=0) left out."""
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        if name and quality > 0:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+def choose_encoding(header):
+    accepted = accepted_encodings(header or '')
+    available = (['br'] if brotli else []) + ['gzip']
+    candidates = [encoding for encoding in available if encoding in accepted or '*' in accepted]
+    if not candidates:
+        return None
+    # brotli wins ties, it compresses JSON better
+    return max(candidates, key=lambda encoding: accepted.get(encoding, accepted.get('*')))
+
+def compress(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(level, 11))
+    return gzip.compress(body, compresslevel=min(level, 9), mtime=0)
+
+def setup_compression(app):
+    cache = CompressedCache(app.config.get('COMPRESS_CACHE_BYTES', 32 * 1024 * 1024))
+    app.extensions['compression'] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if not app.config.get('COMPRESS_ENABLED', True):
+            return response
+        if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+                or 'Content-Encoding' in response.headers or not response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+            return response
+
+        body = response.get_data()
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if len(body) < app.config.get('COMPRESS_MIN_SIZE', 1024):
+            encoding = None
+
+        cacheable = request.method == 'GET'
+        if cacheable:
+            response.add_etag()
+            etag = response.get_etag()[0]
+            if encoding:
+                # the compressed representation needs its own validator
+                response.set_etag(f'{etag}-{encoding}')
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+        if encoding is None:
+            return response
+
+        compressed = cache.get((etag, encoding)) if cacheable else None
+        if compressed is None:
+            compressed = compress(body, encoding, app.config.get('COMPRESS_LEVEL', 6))
+            if cacheable:
+                cache.put((etag, encoding), compressed)
+            metrics.increment('compression_compressed', encoding=encoding)
+        else:
+            metrics.increment('compression_cache_hits', encoding=encoding)
+        metrics.increment('compression_bytes_in', len(body))
+        metrics.increment('compression_bytes_out', len(compressed))
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    metrics.register_gauge('compression_cache_bytes', lambda: cache.size)
+    return cache
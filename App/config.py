@@ -24,6 +24,63 @@ def load_config():
     config['PREFERRED_URL_SCHEME'] = 'https'
     config['UPLOADED_PHOTOS_DEST'] = "App/uploads"
     config["JWT_TOKEN_LOCATION"] = ["headers"]
+    # proxies in front of the app whose X-Forwarded-For is trusted for the client address (Render/Heroku add one), 0 for none
+    config['PROXY_FIX_X_FOR'] = int(os.environ.get('PROXY_FIX_X_FOR', 1))
+    # "memory" keeps rate limit buckets per worker, "sqlite:///path" shares them between workers
+    config['RATE_LIMIT_STORAGE'] = os.environ.get('RATE_LIMIT_STORAGE', 'memory')
+    config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    # "memory" fans live leaderboard updates out within a worker, "sqlite:///path" across workers
+    config['PUBSUB_STORAGE'] = os.environ.get('PUBSUB_STORAGE', 'memory')
+    # how competition positions turn into overall points: linear, f1 or percentile
+    config['RANKING_SCORING'] = os.environ.get('RANKING_SCORING', 'linear')
+    # "total" ranks users by all their points, "decayed" halves older points every RANKING_HALF_LIFE_DAYS
+    config['RANKING_MODE'] = os.environ.get('RANKING_MODE', 'total')
+    config['RANKING_HALF_LIFE_DAYS'] = float(os.environ.get('RANKING_HALF_LIFE_DAYS', 90))
+    # memory-mapped results snapshot shared by the workers (defaults to instance/results.snapshot)
+    config['RESULTS_SNAPSHOT_PATH'] = os.environ.get('RESULTS_SNAPSHOT_PATH', '')
+    config['RESULTS_SNAPSHOT_CHECK_INTERVAL'] = float(os.environ.get('RESULTS_SNAPSHOT_CHECK_INTERVAL', 1))
+    # gzip/brotli for responses of at least COMPRESS_MIN_SIZE bytes
+    config['COMPRESS_ENABLED'] = os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true'
+    config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+    config['COMPRESS_CACHE_BYTES'] = int(os.environ.get('COMPRESS_CACHE_BYTES', 32 * 1024 * 1024))
+    # sub-requests allowed in one POST /batch
+    config['BATCH_MAX_REQUESTS'] = int(os.environ.get('BATCH_MAX_REQUESTS', 50))
+    # how often each worker picks up tokens revoked elsewhere and deletes expired revocations, in seconds
+    config['REVOCATION_SYNC_INTERVAL'] = float(os.environ.get('REVOCATION_SYNC_INTERVAL', 5))
+    config['REVOCATION_GC_INTERVAL'] = float(os.environ.get('REVOCATION_GC_INTERVAL', 3600))
+    # buffer live rank updates and write them in batches every SCORE_FLUSH_INTERVAL_MS or SCORE_FLUSH_MAX_ENTRIES updates,
+    # journaled under SCORE_JOURNAL_DIR (defaults to the instance folder)
+    config['SCORE_WRITE_BEHIND'] = os.environ.get('SCORE_WRITE_BEHIND', 'false').lower() == 'true'
+    config['SCORE_FLUSH_INTERVAL_MS'] = int(os.environ.get('SCORE_FLUSH_INTERVAL_MS', 200))
+    config['SCORE_FLUSH_MAX_ENTRIES'] = int(os.environ.get('SCORE_FLUSH_MAX_ENTRIES', 500))
+    config['SCORE_JOURNAL_DIR'] = os.environ.get('SCORE_JOURNAL_DIR', '')
+    # fsync the journal before an update returns, so buffered scores also survive a power loss
+    config['SCORE_JOURNAL_FSYNC'] = os.environ.get('SCORE_JOURNAL_FSYNC', 'false').lower() == 'true'
+    # JSON logs to LOG_FILE (stderr by default), LOG_LEVELS and LOG_SAMPLING take
+    # comma separated pairs like App.controllers.competition=DEBUG and result_added=0.1
+    config['LOG_FILE'] = os.environ.get('LOG_FILE', '')
+    config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+    config['LOG_LEVELS'] = os.environ.get('LOG_LEVELS', '')
+    config['LOG_SAMPLING'] = os.environ.get('LOG_SAMPLING', '')
+    config['LOG_QUEUE_SIZE'] = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+    # profile requests sent with X-Profile: <PROFILE_TOKEN> or a PROFILE_SAMPLE_RATE fraction of all requests,
+    # the last PROFILE_KEEP profiles are kept in PROFILE_DIR (defaults to instance/profiles)
+    config['PROFILE_ENABLED'] = os.environ.get('PROFILE_ENABLED', 'false').lower() == 'true'
+    config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN', '')
+    config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', '')
+    config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 500))
+    # statements slower than SLOW_QUERY_MS (0 turns the log off) go to SLOW_QUERY_LOG, instance/slow_queries.log by default
+    config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 250))
+    config['SLOW_QUERY_LOG'] = os.environ.get('SLOW_QUERY_LOG', '')
+    config['SLOW_QUERY_LOG_BYTES'] = int(os.environ.get('SLOW_QUERY_LOG_BYTES', 5 * 1024 * 1024))
+    # capture PostgreSQL plans with EXPLAIN ANALYZE, which runs the slow SELECT again inside the request
+    config['SLOW_QUERY_ANALYZE'] = os.environ.get('SLOW_QUERY_ANALYZE', 'false').lower() == 'true'
+    # record a sanitised TRAFFIC_CAPTURE_RATE sample of requests to TRAFFIC_CAPTURE_FILE (instance/traffic.jsonl) for flask perf replay
+    config['TRAFFIC_CAPTURE_ENABLED'] = os.environ.get('TRAFFIC_CAPTURE_ENABLED', 'false').lower() == 'true'
+    config['TRAFFIC_CAPTURE_RATE'] = float(os.environ.get('TRAFFIC_CAPTURE_RATE', 0.1))
+    config['TRAFFIC_CAPTURE_FILE'] = os.environ.get('TRAFFIC_CAPTURE_FILE', '')
     return config
 
 config = load_config()
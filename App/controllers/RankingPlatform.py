@@ -1,6 +1,20 @@
+import logging
+from sqlalchemy import and_, or_, bindparam
+from sqlalchemy.orm.exc import StaleDataError
+
 from App.models import User, Competition, UserCompetition
 from App.controllers import add_results
+from App.controllers.stats import count_result_rescored, update_user_stats
+from App.controllers.events import record_result_event, record_result_events
+from App.controllers.leaderboard import add_segment_points
+from App.controllers.live import publish_competition_standings, publish_overall_standings
+from App.controllers.score_buffer import get_score_buffer
+from App.controllers.ranking_engine import recompute_overall_positions, score_competition
+from App.controllers.decay import add_decayed_points, decayed_mode, ranking_column, to_timestamp, get_ranking_epoch, current_decayed_score
 from App.database import db
+from App.singleflight import single_flight
+
+logger = logging.getLogger(__name__)
 
 
    
@@ -16,12 +30,66 @@ def update_user_competition_rank(user_id, comp_id, rank):
     - user_id: ID of the user.
     - comp_id: ID of the competition.
     - rank: New rank to be updated for the user in the competition.
+    The rank is written with a single UPDATE instead of a SELECT followed by a flush.
+    With SCORE_WRITE_BEHIND on it is only buffered, see flush_buffered_ranks.
     """
-    user_comp = UserCompetition.query.filter_by(user_id=user_id, comp_id=comp_id).first()
-    if user_comp:
-        user_comp.rank = rank
-        db.session.commit()
+    buffer = get_score_buffer()
+    if buffer:
+        buffer.put(comp_id, user_id, rank)
+        return
+    updated = UserCompetition.query.filter_by(user_id=user_id, comp_id=comp_id).update(
+        {UserCompetition.rank: rank, UserCompetition.version: UserCompetition.version + 1},
+        synchronize_session=False
+    )
+    if updated:
+        count_result_rescored(comp_id)
+        update_user_stats(user_id)
+        record_result_event('rescored', user_id, comp_id, rank)
+    db.session.commit()
+    if updated:
+        publish_competition_standings(comp_id)
        # manage_top_20_and_notify(comp_id)
+
+def flush_buffered_ranks(buffer=None):
+    """
+    Write the ranks waiting in the score buffer with one batched UPDATE and commit them
+    together with their counters, stats and events. Returns the number of results updated.
+    """
+    buffer = buffer or get_score_buffer()
+    batch = buffer.take() if buffer else {}
+    if not batch:
+        return 0
+    try:
+        user_ids = {user_id for scores in batch.values() for user_id in scores}
+        # updates for results deleted in the meantime are dropped
+        existing = set(db.session.query(UserCompetition.comp_id, UserCompetition.user_id).filter(
+            UserCompetition.comp_id.in_(batch), UserCompetition.user_id.in_(user_ids)))
+        rows = [
+            {'b_comp': comp_id, 'b_user': user_id, 'b_rank': rank}
+            for comp_id, scores in batch.items() for user_id, rank in scores.items()
+            if (comp_id, user_id) in existing
+        ]
+        if rows:
+            table = UserCompetition.__table__
+            db.session.execute(
+                table.update().where(and_(table.c.comp_id == bindparam('b_comp'), table.c.user_id == bindparam('b_user'))).values(
+                    rank=bindparam('b_rank'), version=table.c.version + 1),
+                rows
+            )
+        for comp_id in {row['b_comp'] for row in rows}:
+            count_result_rescored(comp_id)
+        for user_id in {row['b_user'] for row in rows}:
+            update_user_stats(user_id)
+        record_result_events(('rescored', row['b_user'], row['b_comp'], row['b_rank']) for row in rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        buffer.done(committed=False)
+        raise
+    buffer.done(committed=True)
+    for comp_id in {row['b_comp'] for row in rows}:
+        publish_competition_standings(comp_id)
+    return len(rows)
         
 def manage_top_20_and_notify(comp_id):
     """
@@ -46,31 +114,44 @@ def notify_top_20_users(top_20_users):
     """
     for user in top_20_users:
         # Send notification to each user about their placement in the competition
-        send_notification(user.id, f"You've been placed in the top 20 of the competition!")
+        send_notification(user.user_id, f"You've been placed in the top 20 of the competition!")
 
 def update_top20_overall(comp_id):
     """
-    Manage top 20 placement in a competition and notify relevant users.
+    Award a competition's placements their overall points (see score_competition).
     """
-    top_20_users = get_top_20_users_in_competition(comp_id)
-    update_overall_rankings(top_20_users)
+    score_competition(comp_id)
     
 def update_overall_rankings(top_20_users):
     """
-    Update overall rankings for top 20 users based on their position in the competition.
+    Update overall rankings from a competition's top 20 (as returned by get_top_20_users_in_competition).
+    Points come from the configured scoring rule (RANKING_SCORING), awarded by score_competition
+    the same way a rebuild awards them, so calling this again only applies what changed.
     """
-    for position, user in enumerate(top_20_users, start=1):
-        points = 21 - position  # Assign points based on competition position
-        update_user_overall_rank(user.id, points)
+    if top_20_users:
+        score_competition(top_20_users[0].comp_id)
+    else:
+        publish_overall_standings()
 
-def update_user_overall_rank(user_id, points):
+def update_user_overall_rank(user_id, points, placement=None, comp=None):
     """
     Update the overall rank of a user by adding competition rank points.
+    The increment is done by the database (overall_rank = overall_rank + points)
+    so concurrent workers adding points to the same user never lose an update.
+    placement is the user's position in comp, the competition the points came from.
+    Its date weights the decayed score and its location and date pick the leaderboard segments.
     """
-    user = User.query.get(user_id)
-    if user:
-        user.overall_rank += points
-        db.session.commit()
+    updated = User.query.filter_by(id=user_id).update(
+        # the stored positions are stale until the next recompute_overall_positions
+        {User.overall_rank: User.overall_rank + points, User.overall_position: None, User.version: User.version + 1},
+        synchronize_session=False
+    )
+    if updated:
+        add_decayed_points(user_id, points, to_timestamp(comp.date) if comp and comp.date else None)
+        if comp:
+            add_segment_points(user_id, comp, points)
+        update_user_stats(user_id, points=points, placement=placement)
+    db.session.commit()
 
 def get_top_20_users_overall_rank():
     """
@@ -78,7 +159,7 @@ def get_top_20_users_overall_rank():
     
     """
     # Query to fetch top 20 users based on overall rank
-    top_20_users = User.query.order_by(User.overall_rank.desc()).limit(20).all()
+    top_20_users = User.query.order_by(ranking_column().desc(), User.id.asc()).limit(20).all()
     # Create a list of tuples with user_id and their position
     top_20_positions = [(user.id, index + 1) for index, user in enumerate(top_20_users)]
     return top_20_positions
@@ -125,57 +206,88 @@ def notify_user_position_change(user_id, prev_position, new_position):
 def send_notification(user_id, message):
    
    
-    print(f"Sending notification to User ID {user_id}: {message}")
+    logger.info('notification_sent', extra={'user_id': user_id, 'notification': message})
     
 
+def positions_are_current():
+    # every points write clears the mover's stored position, recompute_overall_positions fills them all
+    return not db.session.query(User.query.filter(User.overall_position.is_(None)).exists()).scalar()
+
 def get_user_overall_rank_and_position(user_id):
+    """
+    A user's overall points and leaderboard position. The stored position is used while the
+    positions are current, otherwise the users ranked ahead are counted.
+    """
     user = User.query.get(user_id)
-    if user:
-        overall_rank = user.overall_rank
-        top_20_users = User.query.order_by(User.overall_rank.desc()).limit(20).all()
-        user_position = next((pos + 1 for pos, u in enumerate(top_20_users) if u.id == user_id), None)
-        return overall_rank, user_position
-    else:
+    if not user:
         return None, None
+    if positions_are_current():
+        return user.overall_rank, user.overall_position
+    score = ranking_column()
+    mine = getattr(user, score.key)
+    ahead = User.query.filter(or_(score > mine, and_(score == mine, User.id < user.id))).count()
+    return user.overall_rank, ahead + 1
+
+def get_user_at_position(position):
+    """
+    Get the user at a leaderboard position (indexed lookup on overall_position while the
+    positions are current, an ordered scan otherwise).
+    """
+    if positions_are_current():
+        return User.query.filter_by(overall_position=position).first()
+    return User.query.order_by(ranking_column().desc(), User.id.asc()).offset(position - 1).first()
 
 def arrange_top_20_overall():
     """
-    Arrange top 20 users from 1 to 20 based on overall ranking.
+    Arrange users into leaderboard positions based on overall points.
+    Positions go into overall_position, the points in overall_rank are left untouched.
     """
-    top_20_users = User.query.order_by(User.overall_rank.desc()).limit(20).all()
-    for index, user in enumerate(top_20_users, start=1):
-        user.overall_rank = index
-    db.session.commit()
+    recompute_overall_positions()
 
 
 def print_top_20_users():
     """
     Print the top 20 users in order of their overall ranking.
     """
-    top_20_users = User.query.order_by(User.overall_rank.desc()).limit(20).all()
+    top_20_users = User.query.order_by(ranking_column().desc(), User.id.asc()).limit(20).all()
     for rank, user in enumerate(top_20_users, start=1):
-        print(f"{rank}. {user.username} - Overall Rank: {user.overall_rank}")
+        logger.info('top_20_user', extra={'position': rank, 'username': user.username, 'overall_rank': user.overall_rank})
 
+@single_flight
 def get_top_20_users_api():
     """
     Get the top 20 users in order of their overall ranking.
     Returns:
     - List containing tuples of user details (username, overall rank).
+    With RANKING_MODE=decayed the second value is the decayed score as of now.
     """
-    top_20_users = User.query.order_by(User.overall_rank.desc()).limit(20).all()
+    score = ranking_column()
+    top_20_users = User.query.order_by(score.desc(), User.id.asc()).limit(20).all()
+    if decayed_mode():
+        epoch = get_ranking_epoch()
+        return [(user.username, round(current_decayed_score(user.decayed_score, epoch), 2)) for user in top_20_users]
     user_details = [(user.username, user.overall_rank) for user in top_20_users]
     return user_details
 
-def send_notification_touser(user_id, message):
-    user = User.query.get(user_id)
-    if user:
+def send_notification_touser(user_id, message, retries=3):
+    # Appending needs the current messages, so the write is checked against the
+    # row version and retried if another worker updated the user in between
+    for attempt in range(retries):
+        user = User.query.get(user_id)
+        if not user:
+            return False
         # Append the new message to the existing messages
         if user.message:
             user.message += f"\n{message}"
         else:
             user.message = message
-        
-        db.session.commit()
+
+        try:
+            db.session.commit()
+            return True
+        except StaleDataError:
+            db.session.rollback()
+    return False
 
 def get_user_overall_rank(user_id):
     user = User.query.get(user_id)
@@ -1,14 +1,18 @@
+import logging
+
 from App.models import Competition,User, UserCompetition
 from App.database import db
 
+logger = logging.getLogger(__name__)
+
 def findCompUser(user_id, comp_id):
     user = UserCompetition.query.get(user_id)
 
     if user:
         comp = user.query.get(comp_id)
         if comp:
-            print("yay")
+            logger.debug('result_found', extra={'user_id': user_id, 'comp_id': comp_id})
             return True
     
-    print("no bueno")
+    logger.debug('result_not_found', extra={'user_id': user_id, 'comp_id': comp_id})
     return False
\ No newline at end of file
@@ -1,5 +1,19 @@
+from .stats import *
+from .events import *
+from .importer import *
+from .decay import *
+from .leaderboard import *
+from .score_buffer import *
+from .live import *
 from .user import *
+from .revocation import *
 from .auth import *
 from .competition import * 
+from .competition_stats import *
+from .fieldsets import *
+from .host import *
 from .UserCompetition import *
 from .RankingPlatform import *
+from .scoring import *
+from .ranking_engine import *
+from .results_snapshot import *
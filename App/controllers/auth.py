@@ -2,6 +2,7 @@ from flask_login import login_user, login_manager, logout_user, LoginManager
 from flask_jwt_extended import create_access_token, jwt_required, JWTManager
 
 from App.models import User
+from App.controllers.revocation import RevocationFilter, is_token_revoked
 
 def jwt_authenticate(username, password):
   user = User.query.filter_by(username=username).first()
@@ -9,6 +10,10 @@ def jwt_authenticate(username, password):
     return create_access_token(identity=username)
   return None
 
+def jwt_token_for(user):
+  # a token without the password, for tooling like flask perf replay
+  return create_access_token(identity=user.username)
+
 def login(username, password):
     user = User.query.filter_by(username=username).first()
     if user and user.check_password(password):
@@ -31,13 +36,20 @@ def setup_jwt(app):
     @jwt.user_identity_loader
     def user_identity_lookup(identity):
         user = User.query.filter_by(username=identity).one_or_none()
+        # the subject claim must be a string for PyJWT 2.10+
         if user:
-            return user.id
+            return str(user.id)
         return None
 
+    app.extensions['token_revocation'] = RevocationFilter()
+
+    @jwt.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        return is_token_revoked(jwt_payload["jti"])
+
     @jwt.user_lookup_loader
     def user_lookup_callback(_jwt_header, jwt_data):
         identity = jwt_data["sub"]
-        return User.query.get(identity)
+        return User.query.get(int(identity))
 
     return jwt
\ No newline at end of file
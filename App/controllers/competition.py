@@ -1,5 +1,18 @@
+import logging, time
+from bisect import bisect_left
+from sqlalchemy import select, func, literal_column
+from sqlalchemy.sql import table, column
+
 from App.models import Competition,User, UserCompetition
 from App.database import db
+from App.singleflight import single_flight
+from App.controllers.live import publish_competition_standings
+from App.controllers.stats import count_result_added, count_result_removed, update_user_stats
+from App.controllers.events import record_result_event
+from App.controllers.ranking_engine import withdraw_result_points
+from App.controllers.fieldsets import competition_columns, serialize_competitions
+
+logger = logging.getLogger(__name__)
 
 def create_competition(name, location):
     newcomp = Competition(name = name, location = location)
@@ -11,24 +24,99 @@ def create_competition(name, location):
     except Exception as e:
         db.session.rollback()
         return False
+    invalidate_competition_suggestions()
     return True
 
 def get_all_competitions():
     return Competition.query.all()
 
-def get_all_competitions_json():
-    competition = Competition.query.all()
-
-    if not competition:
-        return []
-    else:
-        return [comp.toDict() for comp in competition]
+def get_all_competitions_json(fields=None, expand=frozenset()):
+    competitions = Competition.query.options(competition_columns(fields)).order_by(Competition.id).all()
+    return serialize_competitions(competitions, fields, expand)
+
+
+competition_fts = table('competition_fts', column('rowid'))
+
+def like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_competitions(q=None, location=None, date_from=None, date_to=None, limit=50):
+    """
+    Search competitions by a substring of their name, filtered by location and date.
+    Name matching goes through the trigram index (FTS5 on SQLite, pg_trgm on PostgreSQL),
+    queries shorter than a trigram fall back to a prefix match. The location matches as a
+    case-insensitive substring too (pg_trgm serves it on PostgreSQL).
+    """
+    query = Competition.query
+    if q:
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'sqlite' and len(q) >= 3:
+            term = '"' + q.replace('"', '""') + '"'
+            matches = select(competition_fts.c.rowid).where(literal_column('competition_fts').op('MATCH')(term))
+            query = query.filter(Competition.id.in_(matches))
+        else:
+            pattern = like_escape(q) + '%' if len(q) < 3 else '%' + like_escape(q) + '%'
+            query = query.filter(Competition.name.ilike(pattern, escape='\\'))
+    if location:
+        query = query.filter(Competition.location.ilike('%' + like_escape(location) + '%', escape='\\'))
+    if date_from:
+        query = query.filter(Competition.date >= date_from)
+    if date_to:
+        query = query.filter(Competition.date <= date_to)
+    return query.order_by(Competition.date.desc(), Competition.id.desc()).limit(limit).all()
+
+def search_competitions_json(q=None, location=None, date_from=None, date_to=None, limit=50):
+    return [comp.get_listing_json() for comp in search_competitions(q, location, date_from, date_to, limit)]
+
+
+# Typeahead is served from a sorted in-process copy of the competition names,
+# a prefix lookup is a binary search instead of a query. The copy is tagged with the
+# competition count and highest id, which every worker compares with the database at
+# most every SUGGEST_CHECK_SECONDS, so a competition created through any worker shows up.
+SUGGEST_CHECK_SECONDS = 1
+suggest_cache = {'checked_at': None, 'version': None, 'index': ([], [])}
+
+def invalidate_competition_suggestions():
+    suggest_cache['checked_at'] = None
+
+def competition_names_version():
+    return tuple(db.session.query(func.count(Competition.id), func.max(Competition.id)).one())
+
+def load_competition_suggestions(version):
+    rows = db.session.query(Competition.id, Competition.name).all()
+    entries = sorted((name.lower(), id, name) for id, name in rows)
+    suggest_cache['index'] = ([entry[0] for entry in entries], entries)
+    suggest_cache['version'] = version
+
+def suggest_competitions(prefix, limit=10):
+    checked_at = suggest_cache['checked_at']
+    if checked_at is None or time.monotonic() - checked_at > SUGGEST_CHECK_SECONDS:
+        version = competition_names_version()
+        if version != suggest_cache['version']:
+            load_competition_suggestions(version)
+        suggest_cache['checked_at'] = time.monotonic()
+
+    prefix = prefix.lower()
+    keys, entries = suggest_cache['index']
+    suggestions = []
+    for key, id, name in entries[bisect_left(keys, prefix):]:
+        if not key.startswith(prefix) or len(suggestions) == limit:
+            break
+        suggestions.append({'id': id, 'name': name})
+    return suggestions
 
 
 def get_competition_by_id(id):
     competition = Competition.query.get(id)
     return competition
 
+@single_flight
+def get_competition_json(id, fields=None, expand=frozenset()):
+    competition = Competition.query.options(competition_columns(fields)).filter_by(id=id).first()
+    if not competition:
+        return None
+    return serialize_competitions([competition], fields, expand)[0]
+
 
 def add_results(user_id, comp_id, rank):
     Comp = Competition.query.get(comp_id)
@@ -42,15 +130,34 @@ def add_results(user_id, comp_id, rank):
 
         try:
             db.session.add(compParticipant)
+            count_result_added(Comp.id, rank)
+            update_user_stats(user.id, entered=1)
+            record_result_event('added', user.id, Comp.id, rank)
             db.session.commit()
-            print("successfully added user to comp")
-            return True
+            logger.info('result_added', extra={'user_id': user.id, 'comp_id': Comp.id, 'rank': rank})
         except Exception as e:
             db.session.rollback()
-            print("error adding to comp")
+            logger.exception('result_add_failed', extra={'user_id': user.id, 'comp_id': Comp.id})
             return False
-        return False
+        publish_competition_standings(Comp.id)
+        return True
+
 
+def delete_result(user_id, comp_id):
+    try:
+        withdraw_result_points(user_id, comp_id)
+        deleted = UserCompetition.query.filter_by(user_id=user_id, comp_id=comp_id).delete(synchronize_session=False)
+        if not deleted:
+            return False
+        count_result_removed(comp_id, deleted)
+        update_user_stats(user_id, entered=-deleted)
+        record_result_event('removed', user_id, comp_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return False
+    publish_competition_standings(comp_id)
+    return True
 
 
 def get_competition_users(comp_id):
@@ -59,5 +166,4 @@ def get_competition_users(comp_id):
 
     if Comp:
         compUsers = Comp.participants
-        Participants = [User.query.get(part.user_id) for part in compUsers]
-        print(Participants)
+        logger.debug('competition_participants', extra={'comp_id': comp_id, 'user_ids': [part.user_id for part in compUsers]})
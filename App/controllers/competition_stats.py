@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import func
+
+from App.models import Competition, UserCompetition
+from App.database import db
+
+# Score distributions are computed with NumPy from the (comp_id, rank) index and cached
+# per competition revision, which every result write bumps, so repeat calls only read
+# the revision. The sorted scores are kept with the summary for the user percentiles.
+STATS_CACHE_SIZE = 256
+stats_cache = OrderedDict()
+stats_cache_lock = threading.Lock()
+
+def load_competition_scores(comp_id, revision):
+    key = (comp_id, revision)
+    with stats_cache_lock:
+        if key in stats_cache:
+            stats_cache.move_to_end(key)
+            return stats_cache[key]
+
+    ranks = [rank for rank, in db.session.query(UserCompetition.rank).filter_by(comp_id=comp_id)]
+    scores = np.sort(np.array(ranks, dtype=np.float64))
+    entry = {'scores': scores, 'summary': summarize_scores(scores), 'histograms': {}}
+    with stats_cache_lock:
+        # older revisions of the same competition can not be asked for again
+        for stale in [cached for cached in stats_cache if cached[0] == comp_id]:
+            del stats_cache[stale]
+        stats_cache[key] = entry
+        while len(stats_cache) > STATS_CACHE_SIZE:
+            stats_cache.popitem(last=False)
+    return entry
+
+def summarize_scores(scores):
+    if not len(scores):
+        return {'count': 0, 'mean': None, 'median': None, 'p90': None, 'p99': None, 'min': None, 'max': None}
+    median, p90, p99 = np.percentile(scores, [50, 90, 99])
+    return {
+        'count': int(len(scores)),
+        'mean': round(float(scores.mean()), 4),
+        'median': float(median),
+        'p90': float(p90),
+        'p99': float(p99),
+        'min': float(scores[0]),
+        'max': float(scores[-1])
+    }
+
+def parse_bins(bins):
+    """
+    Histogram buckets from a query string value: a bucket count ("10") or ascending
+    bucket edges ("0,10,50,100"). Raises ValueError for anything else.
+    """
+    if bins is None or bins == '':
+        return 10
+    if ',' in bins:
+        edges = tuple(float(edge) for edge in bins.split(','))
+        if len(edges) < 2 or any(high <= low for low, high in zip(edges, edges[1:])):
+            raise ValueError('bucket edges must be at least two ascending numbers')
+        return edges
+    count = int(bins)
+    if not 1 <= count <= 100:
+        raise ValueError('the number of buckets must be between 1 and 100')
+    return count
+
+def get_competition_stats(comp_id, bins=10, user_id=None):
+    """
+    Count, mean, median, p90/p99 and a histogram of a competition's scores, plus the
+    percentile of user_id's best score (the share of participants who scored lower).
+    Returns None if the competition does not exist.
+    """
+    revision = db.session.query(Competition.revision).filter_by(id=comp_id).scalar()
+    if revision is None:
+        return None
+    entry = load_competition_scores(comp_id, revision)
+    scores = entry['scores']
+
+    # only bucket counts (at most 100 of them) are cached, client-chosen edges are computed every time
+    histogram = entry['histograms'].get(bins)
+    if histogram is None:
+        counts, edges = np.histogram(scores, bins=bins)
+        histogram = {'edges': edges.tolist(), 'counts': counts.tolist()}
+        if isinstance(bins, int):
+            entry['histograms'][bins] = histogram
+
+    stats = dict(entry['summary'], id=comp_id, revision=revision, histogram=histogram)
+    if user_id is not None:
+        best = db.session.query(func.max(UserCompetition.rank)).filter_by(comp_id=comp_id, user_id=user_id).scalar()
+        stats['user'] = {
+            'user_id': user_id,
+            'score': best,
+            'percentile': None if best is None else round(100 * int(np.searchsorted(scores, best, 'left')) / len(scores), 2)
+        }
+    return stats
@@ -0,0 +1,97 @@
+import time
+from datetime import timezone
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from App.models import User, RankingEpoch
+from App.database import db
+
+# Time-decayed overall ranking. A point earned at time t is worth 2 ** (-(now - t) / half_life)
+# points at time now. Scores are stored relative to a shared reference time (the epoch):
+#
+#     decayed_score = sum(points * 2 ** ((t - epoch) / half_life))
+#
+# so adding points is a single increment, and since every user is scaled by the same
+# 2 ** (-(now - epoch) / half_life) the stored scores can be compared and sorted as they
+# are. renormalize_decayed_scores moves the epoch forward now and then to keep them bounded.
+
+def get_half_life():
+    return current_app.config.get('RANKING_HALF_LIFE_DAYS', 90) * 86400
+
+def decayed_mode():
+    return current_app.config.get('RANKING_MODE', 'total') == 'decayed'
+
+def ranking_column():
+    """
+    The column the overall leaderboards are ordered by for the configured RANKING_MODE.
+    """
+    if decayed_mode():
+        return User.decayed_score
+    return User.overall_rank
+
+def to_timestamp(date):
+    # competition dates are stored as naive UTC
+    return date.replace(tzinfo=timezone.utc).timestamp()
+
+def get_ranking_epoch(lock=False):
+    query = RankingEpoch.query.filter_by(id=1)
+    if lock:
+        query = query.with_for_update(read=True)
+    ranking_epoch = query.first()
+    if ranking_epoch:
+        return ranking_epoch.epoch
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(RankingEpoch(id=1, epoch=time.time()))
+    except IntegrityError:
+        # another worker created it first
+        pass
+    return RankingEpoch.query.filter_by(id=1).first().epoch
+
+def decay_weight(at, epoch):
+    return 2 ** ((at - epoch) / get_half_life())
+
+def current_decayed_score(decayed_score, epoch, now=None):
+    """
+    The decayed score as of now, for display.
+    """
+    now = time.time() if now is None else now
+    return decayed_score * 2 ** (-(now - epoch) / get_half_life())
+
+def add_decayed_points(user_id, points, at=None, retries=3):
+    """
+    Add points earned at time `at` to a user's decayed score, without committing.
+    The increment only applies if the epoch is still the one the weight was computed
+    for, so a concurrent renormalization can not mix up the two scales.
+    """
+    at = time.time() if at is None else at
+    for attempt in range(retries):
+        epoch = get_ranking_epoch(lock=True)
+        epoch_unchanged = select(RankingEpoch.id).where(RankingEpoch.id == 1, RankingEpoch.epoch == epoch).exists()
+        updated = User.query.filter(User.id == user_id, epoch_unchanged).update(
+            {User.decayed_score: User.decayed_score + points * decay_weight(at, epoch)},
+            synchronize_session=False
+        )
+        if updated:
+            return True
+    return False
+
+def renormalize_decayed_scores(now=None):
+    """
+    Rescale every decayed score to a new epoch (now), in one transaction.
+    Rankings and current values do not change, only the stored numbers shrink.
+    """
+    now = time.time() if now is None else now
+    ranking_epoch = RankingEpoch.query.filter_by(id=1).with_for_update().first()
+    if not ranking_epoch:
+        get_ranking_epoch()
+        db.session.commit()
+        return 1.0
+
+    factor = 2 ** (-(now - ranking_epoch.epoch) / get_half_life())
+    User.query.update({User.decayed_score: User.decayed_score * factor}, synchronize_session=False)
+    ranking_epoch.epoch = now
+    db.session.commit()
+    return factor
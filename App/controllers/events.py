@@ -0,0 +1,162 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import func, select, literal
+
+from App.models import Competition, Host, CompetitionHost, UserCompetition, UserStats, ResultEvent, ResultRevision, ProjectionCheckpoint
+from App.database import db
+from App.controllers.stats import top_score_subquery
+
+# Every result write also appends a ResultEvent in the same transaction. The derived
+# projections (results and counters, user stats, overall points) can be rebuilt from the
+# log: replaying events after an offset recomputes only the competitions and users those
+# events touched, from their full history in the log, so replaying twice is harmless.
+# Results the log has no 'added' event for (written before it existed) are left alone
+# until backfill_result_events covers them.
+
+# the projections every live write keeps up to date itself in the write's transaction,
+# they are at the head of the log by definition, so no checkpoint row is touched per write
+LIVE_PROJECTIONS = ('standings', 'stats')
+
+def record_result_event(kind, user_id, comp_id, rank=None):
+    """
+    Append a result event ('added', 'rescored' or 'removed'), without committing.
+    """
+    record_result_events([(kind, user_id, comp_id, rank)])
+
+def record_result_events(events):
+    """
+    Append (kind, user_id, comp_id, rank) events, without committing.
+    """
+    db.session.add_all([ResultEvent(kind=kind, user_id=user_id, comp_id=comp_id, rank=rank) for kind, user_id, comp_id, rank in events])
+
+def get_log_head():
+    return db.session.query(func.coalesce(func.max(ResultEvent.id), 0)).scalar()
+
+def get_results_generation():
+    """
+    A number that grows with every result write: the log head plus the last revision
+    appended by the writes that add no event.
+    """
+    revision = select(func.coalesce(func.max(ResultRevision.id), 0)).scalar_subquery()
+    return db.session.query(func.coalesce(func.max(ResultEvent.id), 0) + revision).scalar()
+
+def get_checkpoint(name):
+    if name in LIVE_PROJECTIONS:
+        return get_log_head()
+    checkpoint = ProjectionCheckpoint.query.get(name)
+    return checkpoint.last_offset if checkpoint else 0
+
+def set_checkpoint(name, offset):
+    db.session.merge(ProjectionCheckpoint(name=name, last_offset=offset, updated_at=datetime.utcnow()))
+
+def get_checkpoints():
+    return {name: get_checkpoint(name) for name in PROJECTIONS}
+
+def backfill_result_events():
+    """
+    Append an 'added' event for every existing result the log knows nothing about, so results
+    written before the log existed are covered by replays. Results of a (competition, user)
+    pair that already has events are skipped, running it again writes nothing.
+    Returns the number of events written.
+    """
+    logged = select(ResultEvent.id).where(ResultEvent.comp_id == UserCompetition.comp_id, ResultEvent.user_id == UserCompetition.user_id).exists()
+    results = select(
+        literal('added'), UserCompetition.comp_id, UserCompetition.user_id, UserCompetition.rank, literal(datetime.utcnow())
+    ).where(~logged).order_by(UserCompetition.id)
+    written = db.session.execute(ResultEvent.__table__.insert().from_select(['kind', 'comp_id', 'user_id', 'rank', 'created_at'], results)).rowcount
+    db.session.commit()
+    return written
+
+def fold_results(comp_ids):
+    """
+    The results of the given competitions according to the log, as {(comp_id, user_id): [rank, ...]}.
+    Only pairs with an 'added' or 'removed' event are included, a removed pair has no ranks.
+    """
+    results = defaultdict(list)
+    events = db.session.query(ResultEvent.kind, ResultEvent.comp_id, ResultEvent.user_id, ResultEvent.rank).filter(
+        ResultEvent.comp_id.in_(comp_ids)).order_by(ResultEvent.id)
+    for kind, comp_id, user_id, rank in events:
+        key = (comp_id, user_id)
+        if kind == 'added':
+            results[key].append(rank)
+        elif kind == 'rescored' and key in results:
+            results[key] = [rank] * len(results[key])
+        elif kind == 'removed':
+            results[key] = []
+    return results
+
+def project_standings(comp_ids, user_ids):
+    """
+    Make the results and counters of the touched competitions match the log.
+    Results of pairs the log does not cover are kept as they are.
+    """
+    expected = fold_results(comp_ids)
+    current = defaultdict(list)
+    for row in UserCompetition.query.filter(UserCompetition.comp_id.in_(comp_ids)).order_by(UserCompetition.id):
+        current[(row.comp_id, row.user_id)].append(row)
+
+    for (comp_id, user_id), ranks in expected.items():
+        rows = current.get((comp_id, user_id), [])
+        for row, rank in zip(rows, ranks):
+            if row.rank != rank:
+                row.rank = rank
+        for row in rows[len(ranks):]:
+            db.session.delete(row)
+        for rank in ranks[len(rows):]:
+            db.session.add(UserCompetition(comp_id=comp_id, user_id=user_id, rank=rank))
+    db.session.flush()
+
+    for comp_id in comp_ids:
+        Competition.query.filter_by(id=comp_id).update({
+            Competition.participant_count: select(func.count(UserCompetition.id)).where(UserCompetition.comp_id == comp_id).scalar_subquery(),
+            Competition.top_score: top_score_subquery(comp_id),
+            Competition.revision: Competition.revision + 1
+        }, synchronize_session=False)
+    entrants = select(func.coalesce(func.sum(Competition.participant_count), 0)).join(
+        CompetitionHost, CompetitionHost.comp_id == Competition.id).where(CompetitionHost.host_id == Host.id).scalar_subquery()
+    hosts = select(CompetitionHost.host_id).where(CompetitionHost.comp_id.in_(comp_ids))
+    Host.query.filter(Host.id.in_(hosts)).update({Host.total_entrants: entrants}, synchronize_session=False)
+    db.session.add(ResultRevision())
+
+def project_stats(comp_ids, user_ids):
+    """
+    Recount the competitions entered by the touched users.
+    """
+    entered = select(func.count(UserCompetition.id)).where(UserCompetition.user_id == UserStats.user_id).scalar_subquery()
+    UserStats.query.filter(UserStats.user_id.in_(user_ids)).update(
+        {UserStats.competitions_entered: entered}, synchronize_session=False)
+
+PROJECTIONS = {'standings': project_standings, 'stats': project_stats}
+
+def register_projection(name, project):
+    """
+    Add a projection, project(comp_ids, user_ids) rebuilds what the events on those
+    competitions and users changed. Projections run in registration order.
+    """
+    PROJECTIONS[name] = project
+
+def replay_events(from_offset=None, projections=None):
+    """
+    Replay the events after from_offset (each projection's own checkpoint by default) into
+    the projections and move their checkpoints to the head of the log.
+    Returns {name: (from_offset, to_offset, events)} for the projections that had events.
+    Raises ValueError for an unknown projection.
+    """
+    names = projections or list(PROJECTIONS)
+    for name in names:
+        if name not in PROJECTIONS:
+            raise ValueError(f"unknown projection '{name}', expected one of {', '.join(PROJECTIONS)}")
+
+    head = get_log_head()
+    replayed = {}
+    for name in [name for name in PROJECTIONS if name in names]:
+        start = get_checkpoint(name) if from_offset is None else from_offset
+        events = ResultEvent.query.filter(ResultEvent.id > start, ResultEvent.id <= head)
+        touched = events.with_entities(ResultEvent.comp_id, ResultEvent.user_id).distinct().all()
+        if touched:
+            PROJECTIONS[name](sorted({comp_id for comp_id, user_id in touched}), sorted({user_id for comp_id, user_id in touched}))
+            replayed[name] = (start, head, events.count())
+        if name not in LIVE_PROJECTIONS:
+            set_checkpoint(name, head)
+        db.session.commit()
+    return replayed
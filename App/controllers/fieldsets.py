@@ -0,0 +1,97 @@
+from collections import defaultdict
+from sqlalchemy.orm import load_only
+
+from App.models import User, Competition, Host, CompetitionHost, UserCompetition
+from App.database import db
+from App.controllers.score_buffer import buffered_scores
+
+# Sparse fieldsets (?fields=name,location) and relationship expansion
+# (?expand=participants.user) for the competition and result endpoints. Requested
+# relationships are loaded for every row at once with one query each, relationships
+# that were not asked for are never loaded.
+
+COMPETITION_FIELDS = ('id', 'name', 'date', 'location', 'hosts', 'participants')
+COMPETITION_EXPANSIONS = ('participants.user',)
+RESULT_FIELDS = ('id', 'comp_id', 'user_id', 'rank')
+RESULT_EXPANSIONS = ('user', 'competition')
+
+def parse_fieldset(value, allowed):
+    """
+    The names in a comma separated query string value, or None when it is empty.
+    Raises ValueError for names that are not allowed.
+    """
+    if not value:
+        return None
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise ValueError(f"unknown {', '.join(sorted(unknown))}, expected any of {', '.join(allowed)}")
+    return frozenset(names)
+
+def competition_columns(fields):
+    names = [name for name in COMPETITION_FIELDS[:4] if fields is None or name in fields or name == 'id']
+    return load_only(*[getattr(Competition, name) for name in names])
+
+def load_users_json(user_ids):
+    users = db.session.query(User.id, User.username).filter(User.id.in_(set(user_ids))).all() if user_ids else []
+    return {id: {'id': id, 'username': username} for id, username in users}
+
+def serialize_results(results, fields=None, expand=frozenset()):
+    """
+    Results as toDict() would return them, trimmed to fields, with the expanded relations inlined.
+    """
+    users = load_users_json([result.user_id for result in results]) if 'user' in expand else {}
+    comps = {}
+    if 'competition' in expand:
+        comp_ids = {result.comp_id for result in results}
+        comps = {comp.id: comp.get_listing_json() for comp in Competition.query.options(competition_columns(None)).filter(Competition.id.in_(comp_ids))}
+    buffered = {comp_id: buffered_scores(comp_id) for comp_id in {result.comp_id for result in results}}
+
+    serialized = []
+    for result in results:
+        entry = result.toDict()
+        if result.user_id in buffered[result.comp_id]:
+            entry['rank'] = buffered[result.comp_id][result.user_id]
+        if fields:
+            entry = {name: value for name, value in entry.items() if name in fields or name == 'id'}
+        if 'user' in expand:
+            entry['user'] = users.get(result.user_id)
+        if 'competition' in expand:
+            entry['competition'] = comps.get(result.comp_id)
+        serialized.append(entry)
+    return serialized
+
+def serialize_competitions(comps, fields=None, expand=frozenset()):
+    """
+    Competitions as toDict() would return them, trimmed to fields.
+    """
+    fields = set(fields or COMPETITION_FIELDS) | {'id'}
+    comp_ids = [comp.id for comp in comps]
+
+    hosts = defaultdict(list)
+    if 'hosts' in fields and comp_ids:
+        rows = db.session.query(CompetitionHost.comp_id, Host).join(Host, Host.id == CompetitionHost.host_id).filter(
+            CompetitionHost.comp_id.in_(comp_ids)).order_by(CompetitionHost.id)
+        for comp_id, host in rows:
+            hosts[comp_id].append(host.toDict())
+
+    participants = defaultdict(list)
+    if 'participants' in fields and comp_ids:
+        results = UserCompetition.query.filter(UserCompetition.comp_id.in_(comp_ids)).order_by(UserCompetition.id).all()
+        for entry in serialize_results(results, expand={'user'} if 'participants.user' in expand else set()):
+            participants[entry['comp_id']].append(entry)
+
+    serialized = []
+    for comp in comps:
+        entry = {}
+        for name in COMPETITION_FIELDS:
+            if name not in fields:
+                continue
+            if name == 'hosts':
+                entry[name] = hosts[comp.id]
+            elif name == 'participants':
+                entry[name] = participants[comp.id]
+            else:
+                entry[name] = getattr(comp, name)
+        serialized.append(entry)
+    return serialized
@@ -0,0 +1,38 @@
+from sqlalchemy import select
+
+from App.models import Host, Competition, CompetitionHost
+from App.database import db
+
+def create_host(name, website=None):
+    newhost = Host(name=name, website=website)
+    try:
+        db.session.add(newhost)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return None
+    return newhost
+
+def get_host(id):
+    return Host.query.get(id)
+
+def add_host_to_competition(host_id, comp_id):
+    host = Host.query.get(host_id)
+    comp = Competition.query.get(comp_id)
+    if not host or not comp:
+        return False
+
+    if CompetitionHost.query.filter_by(host_id=host.id, comp_id=comp.id).first():
+        return False
+
+    try:
+        db.session.add(CompetitionHost(host_id=host.id, comp_id=comp.id))
+        Host.query.filter_by(id=host.id).update({
+            Host.competition_count: Host.competition_count + 1,
+            Host.total_entrants: Host.total_entrants + select(Competition.participant_count).where(Competition.id == comp.id).scalar_subquery()
+        }, synchronize_session=False)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        return False
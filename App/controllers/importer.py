@@ -0,0 +1,141 @@
+import csv, json, os
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import and_, bindparam
+
+from App.models import User, Competition, UserCompetition, ImportCheckpoint
+from App.database import db
+from App.controllers.stats import count_result_added, count_result_rescored, update_user_stats
+from App.controllers.events import record_result_events
+
+# Results files are read line by line from a byte offset, so files of any size stream
+# in constant memory and an import can resume from the offset of its last committed
+# chunk. CSV files need a header with user_id, comp_id and rank columns (quoted
+# newlines are not supported), JSONL files one {"user_id", "comp_id", "rank"} object per line.
+# A user has one result per competition: a row for a result that already exists updates
+# its rank, so importing a file again (or with --restart) adds nothing.
+
+def read_result_lines(path, offset=0):
+    """
+    Yield (offset_after_line, row) for every row of a CSV or JSONL file, starting at a byte offset.
+    row is None for lines that can not be parsed.
+    """
+    jsonl = path.endswith(('.jsonl', '.json', '.ndjson'))
+    with open(path, 'rb') as file:
+        if path.endswith('.json') and file.read(64).lstrip().startswith(b'['):
+            raise ValueError(f'{path} is a JSON array, convert it to JSON Lines (one object per line) to import it')
+        file.seek(0)
+        header = None
+        if not jsonl:
+            header = next(csv.reader([file.readline().decode('utf-8-sig')]))
+            offset = max(offset, file.tell())
+        file.seek(offset)
+        for line in iter(file.readline, b''):
+            offset += len(line)
+            text = line.decode('utf-8').strip()
+            if not text:
+                continue
+            try:
+                row = json.loads(text) if jsonl else dict(zip(header, next(csv.reader([text]))))
+            except (ValueError, StopIteration):
+                row = None
+            yield offset, row
+
+def parse_result(row):
+    try:
+        return int(row['user_id']), int(row['comp_id']), int(row['rank'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def get_import_checkpoint(path):
+    path = os.path.abspath(path)
+    checkpoint = ImportCheckpoint.query.filter_by(path=path).first()
+    if not checkpoint:
+        checkpoint = ImportCheckpoint(path=path, byte_offset=0, rows_imported=0, rows_skipped=0, finished=False)
+        db.session.add(checkpoint)
+        db.session.commit()
+    return checkpoint
+
+def import_results(path, chunk_size=1000, restart=False, progress=None):
+    """
+    Import the results in a CSV or JSONL file in chunks of chunk_size rows. Every chunk is
+    committed together with the checkpoint, so an interrupted import resumes after the last
+    committed chunk. Rows with unknown users or competitions are skipped and counted, rows for
+    results that exist already update their rank. Raises ValueError for a .json file holding
+    a JSON array.
+    progress(checkpoint, total_bytes) is called after every chunk.
+    Returns the checkpoint.
+    """
+    checkpoint = get_import_checkpoint(path)
+    total_bytes = os.path.getsize(path)
+    if restart or checkpoint.byte_offset > total_bytes:
+        # a file that shrank was replaced, start over
+        checkpoint.byte_offset = checkpoint.rows_imported = checkpoint.rows_skipped = 0
+        checkpoint.finished = False
+        db.session.commit()
+
+    chunk = []
+    for offset, row in read_result_lines(path, checkpoint.byte_offset):
+        chunk.append(parse_result(row) if row else None)
+        if len(chunk) >= chunk_size:
+            import_chunk(checkpoint, chunk, offset)
+            chunk = []
+            if progress:
+                progress(checkpoint, total_bytes)
+    import_chunk(checkpoint, chunk, total_bytes, finished=True)
+    if progress:
+        progress(checkpoint, total_bytes)
+    return checkpoint
+
+def import_chunk(checkpoint, chunk, offset, finished=False):
+    results = [result for result in chunk if result]
+    user_ids = {user_id for user_id, comp_id, rank in results}
+    comp_ids = {comp_id for user_id, comp_id, rank in results}
+    known_users = {id for id, in db.session.query(User.id).filter(User.id.in_(user_ids))} if user_ids else set()
+    known_comps = {id for id, in db.session.query(Competition.id).filter(Competition.id.in_(comp_ids))} if comp_ids else set()
+    results = [result for result in results if result[0] in known_users and result[1] in known_comps]
+    # the last row of a (user, competition) pair wins
+    ranks = {(user_id, comp_id): rank for user_id, comp_id, rank in results}
+    existing = {}
+    if ranks:
+        rows = db.session.query(UserCompetition.user_id, UserCompetition.comp_id, UserCompetition.rank).filter(
+            UserCompetition.user_id.in_(known_users), UserCompetition.comp_id.in_(known_comps))
+        existing = {(user_id, comp_id): rank for user_id, comp_id, rank in rows if (user_id, comp_id) in ranks}
+    added = [(user_id, comp_id, rank) for (user_id, comp_id), rank in ranks.items() if (user_id, comp_id) not in existing]
+    rescored = [(user_id, comp_id, rank) for (user_id, comp_id), rank in ranks.items() if existing.get((user_id, comp_id), rank) != rank]
+
+    try:
+        table = UserCompetition.__table__
+        if added:
+            db.session.execute(table.insert(), [{'user_id': user_id, 'comp_id': comp_id, 'rank': rank, 'version': 1} for user_id, comp_id, rank in added])
+            per_comp = defaultdict(list)
+            per_user = defaultdict(int)
+            for user_id, comp_id, rank in added:
+                per_comp[comp_id].append(rank)
+                per_user[user_id] += 1
+            for comp_id, comp_ranks in per_comp.items():
+                count_result_added(comp_id, max(comp_ranks), len(comp_ranks))
+            for user_id, entered in per_user.items():
+                update_user_stats(user_id, entered=entered)
+        if rescored:
+            db.session.execute(
+                table.update().where(and_(table.c.user_id == bindparam('b_user'), table.c.comp_id == bindparam('b_comp'))).values(
+                    rank=bindparam('b_rank'), version=table.c.version + 1),
+                [{'b_user': user_id, 'b_comp': comp_id, 'b_rank': rank} for user_id, comp_id, rank in rescored]
+            )
+            for comp_id in {comp_id for user_id, comp_id, rank in rescored}:
+                count_result_rescored(comp_id)
+            for user_id in {user_id for user_id, comp_id, rank in rescored}:
+                update_user_stats(user_id)
+        record_result_events([('added', user_id, comp_id, rank) for user_id, comp_id, rank in added] +
+                             [('rescored', user_id, comp_id, rank) for user_id, comp_id, rank in rescored])
+
+        checkpoint.byte_offset = offset
+        checkpoint.rows_imported += len(results)
+        checkpoint.rows_skipped += len(chunk) - len(results)
+        checkpoint.finished = finished
+        checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
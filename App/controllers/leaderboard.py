@@ -0,0 +1,109 @@
+import numpy as np
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+from App.models import User, Competition, LeaderboardEntry
+from App.database import db
+
+# Segmented leaderboards: the overall points a user earns are also added to one row per
+# (location, window, bucket) of the competition they came from, so reading the top of a
+# segment is an indexed range scan. Buckets are calendar based: ISO weeks, months and
+# seasons (calendar years). Location '' holds the totals over every location.
+
+WINDOWS = ('week', 'month', 'season', 'all')
+
+def bucket_for(window, date):
+    if window == 'week':
+        year, week, day = date.isocalendar()
+        return f'{year}-W{week:02d}'
+    if window == 'month':
+        return date.strftime('%Y-%m')
+    if window == 'season':
+        return date.strftime('%Y')
+    return 'all'
+
+def segments_of(comp):
+    date = comp.date or datetime.utcnow()
+    locations = ['', comp.location] if comp.location else ['']
+    return [(location, window, bucket_for(window, date)) for location in locations for window in WINDOWS]
+
+def add_segment_points(user_id, comp, points):
+    """
+    Add points a user earned in comp to every leaderboard segment it belongs to, without committing.
+    """
+    for location, window, bucket in segments_of(comp):
+        segment = LeaderboardEntry.query.filter_by(location=location, period=window, bucket=bucket, user_id=user_id)
+        if segment.update({LeaderboardEntry.points: LeaderboardEntry.points + points}, synchronize_session=False):
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(LeaderboardEntry(location=location, period=window, bucket=bucket, user_id=user_id, points=points))
+        except IntegrityError:
+            # another worker inserted the row first
+            segment.update({LeaderboardEntry.points: LeaderboardEntry.points + points}, synchronize_session=False)
+
+def get_leaderboard(location=None, window='all', bucket=None, limit=20):
+    """
+    Top users of a segment, the current bucket of the window unless one is given.
+    Raises ValueError for an unknown window.
+    """
+    if window not in WINDOWS:
+        raise ValueError(f"unknown window '{window}', expected one of {', '.join(WINDOWS)}")
+    bucket = bucket or bucket_for(window, datetime.utcnow())
+    rows = db.session.query(LeaderboardEntry.user_id, User.username, LeaderboardEntry.points).join(
+        User, User.id == LeaderboardEntry.user_id
+    ).filter(
+        LeaderboardEntry.location == (location or ''),
+        LeaderboardEntry.period == window,
+        LeaderboardEntry.bucket == bucket
+    ).order_by(LeaderboardEntry.points.desc(), LeaderboardEntry.user_id.asc()).limit(limit).all()
+
+    return {
+        'location': location,
+        'window': window,
+        'bucket': bucket,
+        'standings': [
+            {'position': position, 'user_id': user_id, 'username': username, 'points': points}
+            for position, (user_id, username, points) in enumerate(rows, start=1)
+        ]
+    }
+
+def rebuild_leaderboards(comp_ids, user_ids, points, only_users=None):
+    """
+    Replace every segment row (or those of only_users) with the totals of the given
+    per-result points, without committing. The totals are summed with NumPy: every
+    result is expanded to the segments of its competition and the (segment, user)
+    pairs are grouped in one pass.
+    """
+    keep = points > 0
+    if only_users is not None:
+        keep &= np.isin(user_ids, list(only_users))
+    comp_ids, user_ids, points = comp_ids[keep], user_ids[keep], points[keep]
+
+    table = LeaderboardEntry.__table__
+    db.session.execute(table.delete() if only_users is None else table.delete().where(table.c.user_id.in_(only_users)))
+    if not len(points):
+        return 0
+
+    # the segment indexes of every competition, -1 pads those without a location
+    comps, comp_index = np.unique(comp_ids, return_inverse=True)
+    comp_segments = np.full((len(comps), 2 * len(WINDOWS)), -1, dtype=np.int64)
+    segment_ids = {}
+    for comp in Competition.query.filter(Competition.id.in_(comps.tolist())):
+        row = np.searchsorted(comps, comp.id)
+        for column, segment in enumerate(segments_of(comp)):
+            comp_segments[row, column] = segment_ids.setdefault(segment, len(segment_ids))
+
+    result_segments = comp_segments[comp_index.ravel()]
+    valid = result_segments >= 0
+    pairs = np.stack([result_segments[valid], np.broadcast_to(user_ids[:, None], result_segments.shape)[valid]], axis=1)
+    pairs, pair_index = np.unique(pairs, axis=0, return_inverse=True)
+    totals = np.bincount(pair_index.ravel(), weights=np.broadcast_to(points[:, None], result_segments.shape)[valid], minlength=len(pairs))
+
+    segments = list(segment_ids)
+    db.session.execute(table.insert(), [
+        {'location': location, 'period': window, 'bucket': bucket, 'user_id': int(user_id), 'points': int(total)}
+        for (segment, user_id), total in zip(pairs.tolist(), totals.tolist())
+        for location, window, bucket in [segments[segment]]
+    ])
+    return len(pairs)
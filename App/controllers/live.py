@@ -0,0 +1,46 @@
+from flask import current_app
+
+from App.models import User, UserCompetition
+from App.database import db
+from App.controllers.decay import ranking_column
+from App.controllers.score_buffer import buffered_scores
+
+def get_broker():
+    return current_app.extensions['pubsub']
+
+def get_competition_standings(comp_id, limit=20):
+    buffered = buffered_scores(comp_id)
+    query = db.session.query(UserCompetition.user_id, UserCompetition.rank, UserCompetition.id).filter_by(comp_id=comp_id)
+    if buffered:
+        query = query.filter(UserCompetition.user_id.notin_(buffered))
+    rows = query.order_by(UserCompetition.rank.desc(), UserCompetition.id.asc()).limit(limit).all()
+    if buffered:
+        # the users with buffered ranks compete with the top of everyone else
+        pending = db.session.query(UserCompetition.user_id, UserCompetition.id).filter(
+            UserCompetition.comp_id == comp_id, UserCompetition.user_id.in_(buffered))
+        rows = sorted(rows + [(user_id, buffered[user_id], id) for user_id, id in pending], key=lambda row: (-row[1], row[2]))[:limit]
+    return [{'user_id': user_id, 'score': rank} for user_id, rank, id in rows]
+
+def get_overall_standings(limit=20):
+    score = ranking_column()
+    rows = db.session.query(User.id, score).order_by(score.desc(), User.id.asc()).limit(limit).all()
+    return [{'user_id': user_id, 'score': value} for user_id, value in rows]
+
+def publish_competition_standings(comp_id):
+    """
+    Push the position changes in a competition's top 20 to its live subscribers.
+    Without subscribers the standings are not even queried.
+    """
+    broker, channel = get_broker(), f'competition:{comp_id}'
+    if not broker.has_subscribers(channel):
+        return []
+    return broker.publish_standings(channel, get_competition_standings(comp_id))
+
+def publish_overall_standings():
+    """
+    Push the position changes in the overall top 20 to its live subscribers.
+    """
+    broker = get_broker()
+    if not broker.has_subscribers('overall'):
+        return []
+    return broker.publish_standings('overall', get_overall_standings())
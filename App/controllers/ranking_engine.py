@@ -0,0 +1,254 @@
+import time
+import numpy as np
+from datetime import datetime
+from sqlalchemy import func, select, bindparam, true
+
+from App.models import User, Competition, UserCompetition, UserStats
+from App.database import db
+from App.controllers.scoring import get_scoring_rule
+from App.controllers.decay import get_ranking_epoch, decay_weight, to_timestamp, ranking_column, add_decayed_points
+from App.controllers.stats import update_user_stats, backfill_user_stats
+from App.controllers.leaderboard import rebuild_leaderboards, add_segment_points
+from App.controllers.events import get_log_head, set_checkpoint, register_projection
+from App.controllers.live import publish_overall_standings
+
+def load_results():
+    """
+    Load every result as int64 arrays (id, comp_id, user_id, rank) in one query.
+    """
+    rows = db.session.execute(select(UserCompetition.id, UserCompetition.comp_id, UserCompetition.user_id, UserCompetition.rank)).all()
+    if not rows:
+        return tuple(np.empty(0, dtype=np.int64) for _ in range(4))
+    return tuple(np.array(rows, dtype=np.int64).T)
+
+def place_results(ids, comp_ids, ranks, rule):
+    """
+    Rank every competition at once and score it with rule.
+    Returns (positions, points), aligned with the input arrays.
+    """
+    # sort by competition, then best rank first, earliest result first on ties
+    order = np.lexsort((ids, -ranks, comp_ids))
+    comps_sorted = comp_ids[order]
+    starts = np.flatnonzero(np.r_[True, comps_sorted[1:] != comps_sorted[:-1]])
+    group_sizes = np.diff(np.r_[starts, len(order)])
+    group_of = np.repeat(np.arange(len(starts)), group_sizes)
+
+    positions = np.empty(len(order), dtype=np.int64)
+    points = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order)) - starts[group_of] + 1
+    points[order] = np.asarray(rule(positions[order], group_sizes[group_of]), dtype=np.int64)
+    return positions, points
+
+def total_by_user(user_ids, positions, points):
+    """
+    Returns (user_ids, points, best_placements) with one entry per user that has results,
+    the best placement only counts positions that earned points.
+    """
+    users, user_index = np.unique(user_ids, return_inverse=True)
+    totals = np.bincount(user_index, weights=points, minlength=len(users)).astype(np.int64)
+    best = np.full(len(users), np.iinfo(np.int64).max)
+    scored = points > 0
+    np.minimum.at(best, user_index[scored], positions[scored])
+    return users, totals, best
+
+def scored_competitions(comp_ids):
+    """
+    Which entries of comp_ids are competitions that have been scored (Competition.scored_at set).
+    """
+    scored = db.session.execute(select(Competition.id).where(Competition.scored_at.is_not(None))).scalars().all()
+    return np.isin(comp_ids, np.array(scored, dtype=np.int64))
+
+def earned_points(ids, comp_ids, ranks, rule):
+    """
+    The points every result earns, the one definition the rebuild and score_competition share:
+    results of scored competitions get what rule gives their placement, all others get nothing.
+    Returns (positions, points), aligned with the input arrays.
+    """
+    positions, points = place_results(ids, comp_ids, ranks, rule)
+    points[~scored_competitions(comp_ids)] = 0
+    return positions, points
+
+def score_results(ids, comp_ids, user_ids, ranks, rule):
+    positions, points = place_results(ids, comp_ids, ranks, rule)
+    return total_by_user(user_ids, positions, points)
+
+def load_competition_weights(comp_ids):
+    """
+    Decay weight of every result, from the date of its competition relative to the ranking epoch.
+    """
+    epoch = get_ranking_epoch()
+    rows = db.session.execute(select(Competition.id, Competition.date)).all()
+    now = time.time()
+    known = np.array([comp_id for comp_id, date in rows], dtype=np.int64)
+    stamps = np.array([to_timestamp(date) if date else now for comp_id, date in rows], dtype=np.float64)
+    order = np.argsort(known)
+    weights = decay_weight(stamps[order], epoch)
+    return weights[np.searchsorted(known[order], comp_ids)]
+
+def recompute_overall_positions(batch_size=500):
+    """
+    Recompute every user's leaderboard position from their overall points
+    (or decayed score, with RANKING_MODE=decayed).
+    Only rows whose position changed are written, in batched UPDATEs of batch_size
+    rows, and the whole recompute is committed as one transaction.
+    Returns the number of users whose position changed.
+    """
+    users = db.session.query(User.id, User.overall_position).order_by(ranking_column().desc(), User.id.asc()).all()
+    changed = [
+        {"b_id": user_id, "b_position": position}
+        for position, (user_id, current_position) in enumerate(users, start=1)
+        if current_position != position
+    ]
+
+    table = User.__table__
+    stmt = table.update().where(table.c.id == bindparam("b_id")).values(overall_position=bindparam("b_position"))
+    for start in range(0, len(changed), batch_size):
+        db.session.execute(stmt, changed[start:start + batch_size])
+    db.session.commit()
+    return len(changed)
+
+def apply_points(user_id, comp, delta, placement=None):
+    """
+    Add delta points a user earned in comp to their overall points, decayed score,
+    leaderboard segments and stats, without committing.
+    """
+    updated = User.query.filter_by(id=user_id).update(
+        {User.overall_rank: User.overall_rank + delta, User.overall_position: None, User.version: User.version + 1},
+        synchronize_session=False
+    )
+    if updated:
+        add_decayed_points(user_id, delta, to_timestamp(comp.date) if comp.date else None)
+        add_segment_points(user_id, comp, delta)
+        update_user_stats(user_id, points=delta, placement=placement)
+
+def withdraw_result_points(user_id, comp_id):
+    """
+    Take back the points a user's results in a competition earned, before they are deleted,
+    without committing.
+    """
+    earned = db.session.query(func.coalesce(func.sum(UserCompetition.points), 0)).filter_by(user_id=user_id, comp_id=comp_id).scalar()
+    if earned:
+        apply_points(user_id, Competition.query.get(comp_id), -earned)
+
+def award_competition_points(comp_ids, scoring=None):
+    """
+    Bring the points stored on the results of comp_ids in line with earned_points and apply
+    the differences to the users' overall points, decayed scores, leaderboard segments and stats,
+    without committing. Awarding the same standings twice changes nothing.
+    Returns the number of results whose points changed.
+    """
+    rule = get_scoring_rule(scoring)
+    rows = db.session.execute(
+        select(UserCompetition.id, UserCompetition.comp_id, UserCompetition.user_id, UserCompetition.rank, UserCompetition.points)
+        .where(UserCompetition.comp_id.in_(comp_ids))
+    ).all()
+    if not rows:
+        return 0
+    ids, result_comps, user_ids, ranks, stored = np.array(rows, dtype=np.int64).T
+    positions, points = earned_points(ids, result_comps, ranks, rule)
+    changed = np.flatnonzero(points != stored)
+    if not len(changed):
+        return 0
+
+    table = UserCompetition.__table__
+    db.session.execute(table.update().where(table.c.id == bindparam('b_id')).values(points=bindparam('b_points')), [
+        {'b_id': int(ids[i]), 'b_points': int(points[i])} for i in changed
+    ])
+    comps = {comp.id: comp for comp in Competition.query.filter(Competition.id.in_(result_comps[changed].tolist()))}
+    for i in changed:
+        apply_points(int(user_ids[i]), comps[int(result_comps[i])], int(points[i] - stored[i]),
+                     int(positions[i]) if points[i] > 0 else None)
+    return len(changed)
+
+def mark_competitions_scored():
+    """
+    Mark every competition with results as scored, without committing. For data from before
+    scored_at existed, when all results counted. Returns the number of competitions marked.
+    """
+    return Competition.query.filter(
+        Competition.scored_at.is_(None), Competition.id.in_(select(UserCompetition.comp_id))
+    ).update({Competition.scored_at: datetime.utcnow()}, synchronize_session=False)
+
+def score_competition(comp_id, scoring=None):
+    """
+    Mark a competition as scored, so its results earn overall points from now on, and award
+    them. Calling it again after results changed only applies the difference.
+    Returns the number of results whose points changed.
+    """
+    Competition.query.filter(Competition.id == comp_id, Competition.scored_at.is_(None)).update(
+        {Competition.scored_at: datetime.utcnow()}, synchronize_session=False)
+    changed = award_competition_points([comp_id], scoring)
+    db.session.commit()
+    if changed:
+        recompute_overall_positions()
+    publish_overall_standings()
+    return changed
+
+def rebuild_overall_rankings(scoring=None, batch_size=5000, only_users=None):
+    """
+    Recompute every user's overall points from the results of all scored competitions
+    (see earned_points) with a pluggable scoring rule, then write them back in bulk and refresh the positions.
+    The decayed scores are rebuilt too, each result weighted by its competition date,
+    and so are the segmented leaderboards. With only_users just those users are rewritten.
+    Returns the number of users with results that were written.
+    """
+    rule = get_scoring_rule(scoring)
+    head = get_log_head()
+    ids, comp_ids, user_ids, ranks = load_results()
+    positions, points = earned_points(ids, comp_ids, ranks, rule)
+    users, totals, best = total_by_user(user_ids, positions, points)
+    decayed = np.bincount(np.searchsorted(users, user_ids), weights=points * load_competition_weights(comp_ids), minlength=len(users))
+    no_placement = best == np.iinfo(np.int64).max
+
+    user_table = User.__table__
+    stats_table = UserStats.__table__
+    result_table = UserCompetition.__table__
+    user_scope = stats_scope = result_scope = true()
+    earning = points != 0
+    if only_users is not None:
+        only_users = sorted(only_users)
+        keep = np.isin(users, only_users)
+        users, totals, best, decayed, no_placement = users[keep], totals[keep], best[keep], decayed[keep], no_placement[keep]
+        user_scope = user_table.c.id.in_(only_users)
+        stats_scope = stats_table.c.user_id.in_(only_users)
+        result_scope = result_table.c.user_id.in_(only_users)
+        earning &= np.isin(user_ids, only_users)
+
+    db.session.execute(user_table.update().where(user_scope).values(overall_rank=0, decayed_score=0, version=user_table.c.version + 1))
+    db.session.execute(stats_table.update().where(stats_scope).values(total_points=0, best_placement=None))
+    db.session.execute(result_table.update().where(result_scope).values(points=0))
+    backfill_user_stats(only_users)
+
+    update_user = user_table.update().where(user_table.c.id == bindparam('b_id')).values(
+        overall_rank=bindparam('b_points'), decayed_score=bindparam('b_decayed'), version=user_table.c.version + 1)
+    update_stats = stats_table.update().where(stats_table.c.user_id == bindparam('b_id')).values(
+        total_points=bindparam('b_points'), best_placement=bindparam('b_best'))
+    for start in range(0, len(users), batch_size):
+        end = start + batch_size
+        rows = [
+            {'b_id': int(user_id), 'b_points': int(points), 'b_decayed': float(score), 'b_best': None if missing else int(placement)}
+            for user_id, points, score, placement, missing in zip(users[start:end], totals[start:end], decayed[start:end], best[start:end], no_placement[start:end])
+        ]
+        db.session.execute(update_user, rows)
+        db.session.execute(update_stats, rows)
+    # the points each result earned, so score_competition can apply differences later
+    awarded = [{'b_id': int(result_id), 'b_points': int(earned)} for result_id, earned in zip(ids[earning], points[earning])]
+    update_result = result_table.update().where(result_table.c.id == bindparam('b_id')).values(points=bindparam('b_points'))
+    for start in range(0, len(awarded), batch_size):
+        db.session.execute(update_result, awarded[start:start + batch_size])
+    rebuild_leaderboards(comp_ids, user_ids, points, None if only_users is None else set(only_users))
+    if only_users is None:
+        set_checkpoint('overall', head)
+    # the positions are committed together with the points, old positions are never served with new points
+    recompute_overall_positions()
+    publish_overall_standings()
+    return len(users)
+
+def project_overall(comp_ids, user_ids):
+    # a changed result moves everyone placed behind it, award_competition_points re-places the
+    # whole competition but only writes the results whose points changed
+    if award_competition_points(comp_ids):
+        recompute_overall_positions()
+        publish_overall_standings()
+
+register_projection('overall', project_overall)
@@ -0,0 +1,93 @@
+import threading, time
+from flask import current_app
+
+from App.snapshot import ResultsSnapshot, write_results_snapshot, try_lock
+from App.metrics import metrics
+from App.controllers.events import get_results_generation
+from App.controllers.ranking_engine import load_results
+
+# The snapshot is tagged with the results generation it was built at. Workers compare it
+# with the current one (at most every RESULTS_SNAPSHOT_CHECK_INTERVAL seconds), and the
+# first one to notice a change rebuilds it in a background thread. Requests keep reading
+# the old mapping meanwhile, only the very first snapshot is built on the request path.
+
+def rebuild_results_snapshot():
+    holder = current_app.extensions['results_snapshot']
+    generation = get_results_generation()
+    write_results_snapshot(holder.path, generation, *load_results())
+    metrics.increment('results_snapshot_rebuilds')
+    return generation
+
+def load_snapshot(path):
+    try:
+        return ResultsSnapshot(path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def rebuild_in_background(holder):
+    """Start rebuilding the snapshot in a thread, unless this worker already is."""
+    if holder.rebuilding and holder.rebuilding.is_alive():
+        return
+    app = current_app._get_current_object()
+
+    def rebuild():
+        with app.app_context(), holder.rebuild_lock() as lock:
+            # another worker holding the lock is rebuilding it already
+            if not try_lock(lock, blocking=False):
+                return
+            try:
+                snapshot = load_snapshot(holder.path)
+                if snapshot is None or snapshot.generation != get_results_generation():
+                    rebuild_results_snapshot()
+            except Exception:
+                app.logger.exception('rebuilding the results snapshot failed')
+
+    holder.rebuilding = threading.Thread(target=rebuild, name='results-snapshot', daemon=True)
+    holder.rebuilding.start()
+
+def get_results_snapshot():
+    """
+    The mapped results snapshot. If results changed since it was written it is rebuilt in the
+    background and the current one is returned until the new one is in place.
+    """
+    holder = current_app.extensions['results_snapshot']
+    now = time.monotonic()
+    with holder.lock:
+        snapshot = holder.snapshot
+        if snapshot and now - holder.checked_at < current_app.config.get('RESULTS_SNAPSHOT_CHECK_INTERVAL', 1):
+            return snapshot
+        holder.checked_at = now
+
+        if snapshot is None or not snapshot.is_current():
+            snapshot = load_snapshot(holder.path)
+        generation = get_results_generation()
+        if snapshot is None:
+            # nothing to fall back on, build it here or wait for the worker that is building it
+            with holder.rebuild_lock() as lock:
+                try_lock(lock, blocking=True)
+                snapshot = load_snapshot(holder.path)
+                if snapshot is None or snapshot.generation != generation:
+                    rebuild_results_snapshot()
+                    snapshot = load_snapshot(holder.path)
+        elif snapshot.generation != generation:
+            rebuild_in_background(holder)
+        holder.snapshot = snapshot
+        return snapshot
+
+def get_snapshot_position(comp_id, user_id):
+    """
+    A user's position in a competition, read from the results snapshot.
+    """
+    snapshot = get_results_snapshot()
+    position, score = snapshot.position(comp_id, user_id)
+    if position is None:
+        return None
+    participants = len(snapshot.competition_scores(comp_id))
+    return {
+        'comp_id': comp_id,
+        'user_id': user_id,
+        'position': position,
+        'score': score,
+        'participants': participants,
+        'percentile': round(100 * (participants - position) / participants, 2)
+    }
@@ -0,0 +1,90 @@
+import threading, time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from App.models import RevokedToken
+from App.database import db
+from App.bloom import BloomFilter
+from App.metrics import metrics
+
+# Every worker keeps a Bloom filter of the revoked token ids, so checking the token of a
+# protected request is a few bit lookups in memory. The table is only asked when the
+# filter reports a possible match, to rule out false positives. The filter reads the rows
+# added by other workers every REVOCATION_SYNC_INTERVAL seconds, and rows of expired
+# tokens are deleted every REVOCATION_GC_INTERVAL seconds, after which it is rebuilt.
+
+class RevocationFilter:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.last_id = 0
+        self.synced_at = 0
+        self.collected_at = 0
+
+def get_revocation_filter():
+    return current_app.extensions['token_revocation']
+
+def rebuild_revocation_filter(revocation):
+    rows = db.session.query(RevokedToken.id, RevokedToken.jti).all()
+    bloom = BloomFilter(max(1024, 2 * len(rows)))
+    for id, jti in rows:
+        bloom.add(jti)
+    revocation.bloom = bloom
+    revocation.last_id = max((id for id, jti in rows), default=0)
+    metrics.increment('revocation_filter_rebuilds')
+
+def sync_revocation_filter(force=False):
+    revocation = get_revocation_filter()
+    now = time.monotonic()
+    if not force and revocation.bloom is not None and now - revocation.synced_at < current_app.config.get('REVOCATION_SYNC_INTERVAL', 5):
+        return revocation.bloom
+
+    with revocation.lock:
+        if now - revocation.collected_at >= current_app.config.get('REVOCATION_GC_INTERVAL', 3600):
+            collect_expired_tokens()
+            revocation.collected_at = now
+            revocation.bloom = None
+        if revocation.bloom is None or revocation.bloom.is_full():
+            rebuild_revocation_filter(revocation)
+        else:
+            for id, jti in db.session.query(RevokedToken.id, RevokedToken.jti).filter(RevokedToken.id > revocation.last_id).order_by(RevokedToken.id):
+                revocation.bloom.add(jti)
+                revocation.last_id = id
+        revocation.synced_at = now
+    return revocation.bloom
+
+def collect_expired_tokens():
+    """
+    Delete the revocations of tokens that expired, they would be rejected anyway.
+    Runs in a transaction of its own, the request's session is left as it is.
+    """
+    table = RevokedToken.__table__
+    with db.engine.begin() as connection:
+        deleted = connection.execute(table.delete().where(table.c.expires_at < datetime.utcnow())).rowcount
+    metrics.increment('revocation_collected', deleted)
+    return deleted
+
+def revoke_token(jti, expires_at=None):
+    """
+    Revoke a token by its jti until expires_at (naive UTC), a year from now if it never expires.
+    """
+    try:
+        db.session.add(RevokedToken(jti=jti, expires_at=expires_at or datetime.utcnow() + timedelta(days=365)))
+        db.session.commit()
+    except IntegrityError:
+        # revoked already
+        db.session.rollback()
+    revocation = get_revocation_filter()
+    # a rebuild running at the same time could otherwise swap in a filter without it
+    with revocation.lock:
+        if revocation.bloom is not None:
+            revocation.bloom.add(jti)
+    return True
+
+def is_token_revoked(jti):
+    if jti not in sync_revocation_filter():
+        return False
+    metrics.increment('revocation_exact_checks')
+    return RevokedToken.query.filter_by(jti=jti).first() is not None
@@ -0,0 +1,15 @@
+from flask import current_app
+
+# With SCORE_WRITE_BEHIND on, rank updates wait in the worker's ScoreBuffer
+# (App/writebehind.py) until the next flush. Reads of a competition's results
+# overlay the buffered ranks so clients see their own updates right away.
+
+def get_score_buffer():
+    return current_app.extensions.get('score_buffer')
+
+def buffered_scores(comp_id):
+    """
+    {user_id: rank} of the updates to a competition not flushed to the database yet.
+    """
+    buffer = get_score_buffer()
+    return buffer.buffered(comp_id) if buffer else {}
@@ -0,0 +1,37 @@
+import numpy as np
+from flask import current_app
+
+# Scoring rules turn competition positions into overall points. Each rule takes two
+# arrays of the same length, the 1-based positions and the number of entrants of the
+# competition each position is in, and returns the points for every position.
+
+F1_POINTS = np.array([25, 18, 15, 12, 10, 8, 6, 4, 2, 1])
+
+def linear_points(positions, sizes):
+    """21 points for first place down to 1 point for 20th."""
+    return np.where(positions <= 20, 21 - positions, 0)
+
+def f1_points(positions, sizes):
+    """25, 18, 15, 12, 10, 8, 6, 4, 2, 1 for the top 10."""
+    table = np.append(F1_POINTS, 0)
+    return table[np.minimum(positions, len(F1_POINTS) + 1) - 1]
+
+def percentile_points(positions, sizes):
+    """100 for first place down to 0 for last, spread by the size of the field."""
+    return np.rint(100 * (sizes - positions) / np.maximum(sizes - 1, 1)).astype(np.int64)
+
+SCORING_RULES = {
+    'linear': linear_points,
+    'f1': f1_points,
+    'percentile': percentile_points
+}
+
+def register_scoring_rule(name, rule):
+    SCORING_RULES[name] = rule
+
+def get_scoring_rule(name=None):
+    if name is None:
+        name = current_app.config.get('RANKING_SCORING', 'linear')
+    if name not in SCORING_RULES:
+        raise ValueError(f"unknown scoring rule {name!r}, expected one of {', '.join(SCORING_RULES)}")
+    return SCORING_RULES[name]
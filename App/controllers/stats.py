@@ -0,0 +1,196 @@
+from datetime import datetime
+from sqlalchemy import case, event, func, select, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+
+from App.models import User, Competition, Host, CompetitionHost, UserCompetition, UserStats, ResultRevision
+from App.database import db
+
+# These helpers only stage the counter updates in the current transaction,
+# the caller commits them together with the result write.
+
+def count_result_added(comp_id, rank, count=1):
+    """
+    Bump the counters of a competition and of its hosts for new results.
+    """
+    Competition.query.filter_by(id=comp_id).update({
+        Competition.participant_count: Competition.participant_count + count,
+        Competition.top_score: case(
+            (Competition.top_score.is_(None), rank),
+            (Competition.top_score < rank, rank),
+            else_=Competition.top_score
+        ),
+        Competition.last_result_at: datetime.utcnow(),
+        Competition.revision: Competition.revision + 1
+    }, synchronize_session=False)
+    update_host_entrants(comp_id, count)
+
+def count_result_removed(comp_id, count=1):
+    """
+    Lower the counters of a competition and of its hosts for deleted results.
+    The top score is recomputed since the deleted result may have been the best one.
+    """
+    Competition.query.filter_by(id=comp_id).update({
+        Competition.participant_count: Competition.participant_count - count,
+        Competition.top_score: top_score_subquery(comp_id),
+        Competition.revision: Competition.revision + 1
+    }, synchronize_session=False)
+    update_host_entrants(comp_id, -count)
+
+def count_result_rescored(comp_id):
+    """
+    Refresh the top score and last result time after a result's rank changed.
+    """
+    Competition.query.filter_by(id=comp_id).update({
+        Competition.top_score: top_score_subquery(comp_id),
+        Competition.last_result_at: datetime.utcnow(),
+        Competition.revision: Competition.revision + 1
+    }, synchronize_session=False)
+
+def top_score_subquery(comp_id):
+    return select(func.max(UserCompetition.rank)).where(UserCompetition.comp_id == comp_id).scalar_subquery()
+
+def update_host_entrants(comp_id, delta):
+    host_ids = select(CompetitionHost.host_id).where(CompetitionHost.comp_id == comp_id)
+    Host.query.filter(Host.id.in_(host_ids)).update(
+        {Host.total_entrants: Host.total_entrants + delta},
+        synchronize_session=False
+    )
+
+def entered_count(user_id):
+    return select(func.count(UserCompetition.id)).where(UserCompetition.user_id == user_id).scalar_subquery()
+
+def overall_points(user_id):
+    return select(User.overall_rank).where(User.id == user_id).scalar_subquery()
+
+def update_user_stats(user_id, entered=0, points=0, placement=None):
+    """
+    Apply an incremental change to a user's profile summary, in one INSERT ... ON CONFLICT
+    statement so two workers never race to create the row. A user without a row yet (created
+    before the summary existed) gets one counted from their results and overall points, the
+    change is already part of those.
+    """
+    now = datetime.utcnow()
+    table = UserStats.__table__
+    values = {
+        'competitions_entered': table.c.competitions_entered + entered,
+        'total_points': table.c.total_points + points,
+        'last_activity': now
+    }
+    if placement is not None:
+        values['best_placement'] = case(
+            (table.c.best_placement.is_(None), placement),
+            (table.c.best_placement > placement, placement),
+            else_=table.c.best_placement
+        )
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(db.session.get_bind().dialect.name)
+    if dialect:
+        db.session.execute(dialect.insert(table).values(
+            user_id=user_id, competitions_entered=entered_count(user_id), total_points=overall_points(user_id),
+            best_placement=placement, last_activity=now
+        ).on_conflict_do_update(index_elements=[table.c.user_id], set_=values))
+        return
+    updated = db.session.execute(table.update().where(table.c.user_id == user_id).values(values)).rowcount
+    if not updated:
+        db.session.execute(table.insert().values(user_id=user_id, competitions_entered=entered_count(user_id),
+                                                 total_points=overall_points(user_id), best_placement=placement, last_activity=now))
+
+def backfill_user_stats(only_users=None):
+    """
+    Create the summary row of every user that has none (created before it existed), counted
+    from their results and overall points, without committing. Returns the number of rows created.
+    """
+    users = select(
+        User.id, select(func.count(UserCompetition.id)).where(UserCompetition.user_id == User.id).scalar_subquery(), User.overall_rank
+    ).where(User.id.not_in(select(UserStats.user_id)))
+    if only_users is not None:
+        users = users.where(User.id.in_(only_users))
+    return db.session.execute(UserStats.__table__.insert().from_select(['user_id', 'competitions_entered', 'total_points'], users)).rowcount
+
+# Rows removed through the ORM (cascades from deleting a competition, host or user, or
+# session.delete) skip the helpers above, so the counters follow them here on the flush
+# connection. Bulk deletes like delete_result's do not fire these and count themselves.
+
+@event.listens_for(UserCompetition, 'after_delete')
+def count_cascaded_result_removal(mapper, connection, result):
+    comp_table = Competition.__table__
+    connection.execute(comp_table.update().where(comp_table.c.id == result.comp_id).values(
+        participant_count=comp_table.c.participant_count - 1,
+        top_score=top_score_subquery(result.comp_id),
+        revision=comp_table.c.revision + 1
+    ))
+    host_table = Host.__table__
+    host_ids = select(CompetitionHost.host_id).where(CompetitionHost.comp_id == result.comp_id)
+    connection.execute(host_table.update().where(host_table.c.id.in_(host_ids)).values(
+        total_entrants=host_table.c.total_entrants - 1))
+    stats_table = UserStats.__table__
+    connection.execute(stats_table.update().where(stats_table.c.user_id == result.user_id).values(
+        competitions_entered=stats_table.c.competitions_entered - 1))
+    connection.execute(ResultRevision.__table__.insert().values(created_at=datetime.utcnow()))
+
+@event.listens_for(CompetitionHost, 'after_delete')
+def count_cascaded_host_link_removal(mapper, connection, link):
+    host_table = Host.__table__
+    entrants = select(Competition.participant_count).where(Competition.id == link.comp_id).scalar_subquery()
+    connection.execute(host_table.update().where(host_table.c.id == link.host_id).values(
+        competition_count=host_table.c.competition_count - 1,
+        total_entrants=host_table.c.total_entrants - func.coalesce(entrants, 0)))
+
+def get_user_summary(user_id):
+    return UserStats.query.get(user_id)
+
+def verify_counters(repair=True):
+    """
+    Compare the cached counters on competitions and hosts against the real tables.
+    Returns a list of (table, id, column, cached, actual) for every counter that
+    drifted, and writes the actual values back when repair is True.
+    last_result_at is not checked since results carry no timestamp of their own.
+    """
+    drift = []
+
+    results = {
+        comp_id: (count, top_score)
+        for comp_id, count, top_score in db.session.query(
+            UserCompetition.comp_id, func.count(UserCompetition.id), func.max(UserCompetition.rank)
+        ).group_by(UserCompetition.comp_id)
+    }
+    comp_fixes = []
+    for comp_id, participant_count, top_score in db.session.query(Competition.id, Competition.participant_count, Competition.top_score):
+        actual_count, actual_top = results.get(comp_id, (0, None))
+        if participant_count != actual_count:
+            drift.append(('competition', comp_id, 'participant_count', participant_count, actual_count))
+        if top_score != actual_top:
+            drift.append(('competition', comp_id, 'top_score', top_score, actual_top))
+        if participant_count != actual_count or top_score != actual_top:
+            comp_fixes.append({'b_id': comp_id, 'b_count': actual_count, 'b_top': actual_top})
+
+    hosted = {}
+    for host_id, comp_id in db.session.query(CompetitionHost.host_id, CompetitionHost.comp_id):
+        comps, entrants = hosted.get(host_id, (0, 0))
+        hosted[host_id] = (comps + 1, entrants + results.get(comp_id, (0, None))[0])
+    host_fixes = []
+    for host_id, competition_count, total_entrants in db.session.query(Host.id, Host.competition_count, Host.total_entrants):
+        actual_comps, actual_entrants = hosted.get(host_id, (0, 0))
+        if competition_count != actual_comps:
+            drift.append(('host', host_id, 'competition_count', competition_count, actual_comps))
+        if total_entrants != actual_entrants:
+            drift.append(('host', host_id, 'total_entrants', total_entrants, actual_entrants))
+        if competition_count != actual_comps or total_entrants != actual_entrants:
+            host_fixes.append({'b_id': host_id, 'b_comps': actual_comps, 'b_entrants': actual_entrants})
+
+    if repair and drift:
+        comp_table = Competition.__table__
+        host_table = Host.__table__
+        if comp_fixes:
+            db.session.execute(
+                comp_table.update().where(comp_table.c.id == bindparam('b_id')).values(
+                    participant_count=bindparam('b_count'), top_score=bindparam('b_top')),
+                comp_fixes
+            )
+        if host_fixes:
+            db.session.execute(
+                host_table.update().where(host_table.c.id == bindparam('b_id')).values(
+                    competition_count=bindparam('b_comps'), total_entrants=bindparam('b_entrants')),
+                host_fixes
+            )
+        db.session.commit()
+    return drift
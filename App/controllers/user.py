@@ -1,10 +1,23 @@
-from App.models import User, Competition, UserCompetition
+import logging
+from sqlalchemy import func
+
+from App.models import User, Competition, UserCompetition, UserStats
 from App.database import db
+from App.controllers.stats import count_result_added, update_user_stats
+from App.controllers.events import record_result_event
+from App.controllers.fieldsets import competition_columns, serialize_competitions, serialize_results
+from App.controllers.live import publish_competition_standings
+
+logger = logging.getLogger(__name__)
 
 def create_user(username, password):
     newuser = User(username=username, password=password)
+    newuser.stats = UserStats()
     try:
         db.session.add(newuser)
+        db.session.flush()
+        # with no points and the highest id a new user is placed last, which keeps the stored positions current
+        newuser.overall_position = db.session.query(func.count(User.id)).scalar()
         db.session.commit()
         return True
     except Exception as e:
@@ -28,6 +41,20 @@ def get_all_users_json():
     users = [user.get_json() for user in users]
     return users
 
+def get_users_after_json(after_id=0, limit=100):
+    """
+    Get the next `limit` users with an id greater than after_id (keyset pagination,
+    every page is an indexed range scan however deep the client has scrolled).
+    """
+    users = db.session.query(User.id, User.username).filter(User.id > after_id).order_by(User.id.asc()).limit(limit).all()
+    return [{'id': id, 'username': username} for id, username in users]
+
+def get_users_count():
+    return db.session.query(func.count(User.id)).scalar()
+
+def get_users_page(page=1, per_page=50):
+    return User.query.order_by(User.id.asc()).paginate(page=page, per_page=per_page, error_out=False)
+
 def update_user(id, username):
     user = get_user(id)
     if user:
@@ -56,32 +83,32 @@ def add_user_to_comp(user_id, comp_id, rank):
         user_comp = UserCompetition(user_id=user.id, comp_id=comp.id, rank = rank)
         try:
             db.session.add(user_comp)
+            count_result_added(comp.id, rank)
+            update_user_stats(user.id, entered=1)
+            record_result_event('added', user.id, comp.id, rank)
             db.session.commit()
-            return True
         except Exception as e:
-            print("FAILURE")
+            logger.exception('result_add_failed', extra={'user_id': user.id, 'comp_id': comp.id})
             db.session.rollback()
             return False
-            
-        print("success")
+        publish_competition_standings(comp.id)
+        return True
+
         
 
     return 'Error adding user to competition'
 
 
-def get_user_competitions(user_id):
+def get_user_competitions(user_id, fields=None, expand=frozenset()):
     user = User.query.get(user_id)
     
     
     if user:
-        userComps = user.competitions
-        competitions = [Competition.query.get(inst.comp_id) for inst in userComps]
-    # print(competitions)
-        if competitions:
-            results =  [c.toDict() for c in competitions] 
-            return results
-        else:
-            return competitions
+        comp_ids = [comp_id for comp_id, in db.session.query(UserCompetition.comp_id).filter_by(user_id=user.id).order_by(UserCompetition.id)]
+        competitions = Competition.query.options(competition_columns(fields)).filter(Competition.id.in_(comp_ids)).all()
+        results = dict(zip([comp.id for comp in competitions], serialize_competitions(competitions, fields, expand)))
+        # one entry per result, like user.competitions
+        return [results[comp_id] for comp_id in comp_ids]
     return ("User not Found")
 
 
@@ -104,10 +131,7 @@ def get_user_competitions(user_id):
 #       send_notification(u, f"Your rank changed from {ranks[u.id]} to {u.rank}")
     
 
-def get_user_rankings(user_id):
-    users = User.query.get(user_id)
-    userComps = users.competitions
-
-    ranks = [UserCompetition.query.get(a.id).toDict() for a in userComps]
-    return ranks
+def get_user_rankings(user_id, fields=None, expand=frozenset()):
+    results = UserCompetition.query.filter_by(user_id=user_id).order_by(UserCompetition.id).all()
+    return serialize_results(results, fields, expand)
     
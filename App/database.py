@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 
+from App.slowqueries import setup_slow_query_log
+
 db = SQLAlchemy()
 
 def get_migrate(app):
@@ -10,4 +12,6 @@ def create_db():
     db.create_all()
     
 def init_db(app):
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
+    with app.app_context():
+        setup_slow_query_log(app, db.engine)
\ No newline at end of file
@@ -0,0 +1,124 @@
+import atexit, copy, json, logging, logging.handlers, queue, random, sys, uuid
+from datetime import datetime, timezone
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+from App.metrics import metrics
+
+# Structured logging for the App.* loggers. Records are put on an in-memory queue by the
+# request threads and written out as JSON lines by a single listener thread, so logging
+# never waits on stdout or a file. Each line carries the id of the request it came from.
+# Log an event name with its fields in extra, e.g. logger.info('result_added', extra={'user_id': 1}).
+
+RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+listener = None
+
+def stop_listener():
+    """Write out the queued records and stop the listener thread, does nothing once it is stopped."""
+    global listener
+    if listener:
+        listener.stop()
+        listener = None
+
+# one hook for the process, however often setup_logging runs
+atexit.register(stop_listener)
+
+def parse_pairs(value):
+    """'App.controllers=DEBUG,result_added=0.1' as {'App.controllers': 'DEBUG', 'result_added': '0.1'}."""
+    pairs = (pair.split('=', 1) for pair in value.split(',') if '=' in pair)
+    return {key.strip(): setting.strip() for key, setting in pairs}
+
+class RequestIdFilter(logging.Filter):
+
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the records of high-frequency events, warnings and errors are always kept."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.msg)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        if random.random() < rate:
+            record.sample_rate = rate
+            return True
+        return False
+
+class JSONFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+            'request_id': record.request_id,
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in RESERVED})
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler on a bounded queue that drops records instead of waiting when the writer falls behind."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment('log_records_dropped')
+
+    def prepare(self, record):
+        # render the message and traceback here, the arguments may change once the request moves on
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging(app):
+    global listener
+    stop_listener()
+
+    target = app.config.get('LOG_FILE')
+    output = logging.FileHandler(target) if target else logging.StreamHandler(sys.stderr)
+    output.setFormatter(JSONFormatter())
+
+    records = queue.Queue(app.config.get('LOG_QUEUE_SIZE', 10000))
+    handler = NonBlockingQueueHandler(records)
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(SamplingFilter({event: float(rate) for event, rate in parse_pairs(app.config.get('LOG_SAMPLING', '')).items()}))
+
+    logger = logging.getLogger('App')
+    for existing in [h for h in logger.handlers if isinstance(h, NonBlockingQueueHandler)]:
+        logger.removeHandler(existing)
+    logger.addHandler(handler)
+    logger.setLevel(app.config.get('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+    for name, level in parse_pairs(app.config.get('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level.upper())
+    app.logger.removeHandler(default_handler)
+
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    metrics.register_gauge('log_queue_size', records.qsize)
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+    @app.after_request
+    def return_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+
+    return listener
@@ -5,14 +5,24 @@ from flask_uploads import DOCUMENTS, IMAGES, TEXT, UploadSet, configure_uploads
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from werkzeug.datastructures import  FileStorage
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import timedelta
 
 from App.database import init_db
 from App.config import config
+from App.logs import setup_logging
+from App.profiling import setup_profiling
+from App.traffic import setup_traffic_capture
+from App.ratelimit import setup_rate_limiter
+from App.pubsub import setup_pubsub
+from App.snapshot import setup_results_snapshot
+from App.compression import setup_compression
+from App.writebehind import setup_write_behind
 
 from App.controllers import (
     setup_jwt,
-    setup_flask_login
+    setup_flask_login,
+    flush_buffered_ranks
 )
 
 from App.views import views
@@ -31,11 +41,17 @@ def configure_app(app, config, overrides):
 def create_app(config_overrides={}):
     app = Flask(__name__, static_url_path='/static')
     configure_app(app, config, config_overrides)
+    if app.config.get('PROXY_FIX_X_FOR'):
+        # behind the platform's proxy remote_addr is the proxy, the client comes from X-Forwarded-For
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['TEMPLATES_AUTO_RELOAD'] = True
     app.config['SEVER_NAME'] = '0.0.0.0'
     app.config['PREFERRED_URL_SCHEME'] = 'https'
     app.config['UPLOADED_PHOTOS_DEST'] = "App/uploads"
+    setup_logging(app)
+    setup_traffic_capture(app)
+    setup_profiling(app)
     CORS(app)
     photos = UploadSet('photos', TEXT + DOCUMENTS + IMAGES)
     configure_uploads(app, photos)
@@ -43,5 +59,10 @@ def create_app(config_overrides={}):
     init_db(app)
     setup_jwt(app)
     setup_flask_login(app)
+    setup_rate_limiter(app)
+    setup_pubsub(app)
+    setup_results_snapshot(app)
+    setup_compression(app)
+    setup_write_behind(app, flush_buffered_ranks)
     app.app_context().push()
     return app
\ No newline at end of file
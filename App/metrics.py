@@ -0,0 +1,33 @@
+import threading
+
+class Metrics:
+    """
+    In-process counters and gauges, served as JSON from /metrics.
+    Counters are labelled like name{route=results}, gauges are callables read on demand.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+
+    def increment(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_gauge(self, name, read):
+        self.gauges[name] = read
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+        gauges = {name: read() for name, read in self.gauges.items()}
+        return {'counters': counters, 'gauges': gauges}
+
+def metric_key(name, labels):
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}={value}' for key, value in sorted(labels.items())) + '}'
+
+metrics = Metrics()
@@ -3,4 +3,10 @@ from .admin import *
 from .host import *
 from .competition import *
 from .competition_host import *
-from .user_competition import *
\ No newline at end of file
+from .user_competition import *
+from .user_stats import *
+from .ranking_epoch import *
+from .leaderboard_entry import *
+from .result_event import *
+from .import_checkpoint import *
+from .revoked_token import *
@@ -1,12 +1,21 @@
 from datetime import datetime
+from sqlalchemy import event, text
 from App.database import db
 
 class Competition(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name =  db.Column(db.String, nullable=False, unique=True)
-    date = db.Column(db.DateTime, default= datetime.utcnow)
+    date = db.Column(db.DateTime, default= datetime.utcnow, index=True)
     rank = db.Column(db.Integer)
-    location = db.Column(db.String(120), nullable=False)
+    location = db.Column(db.String(120), nullable=False, index=True)
+    # counter cache, maintained in the same transaction as the result writes
+    participant_count = db.Column(db.Integer, nullable=False, default=0)
+    top_score = db.Column(db.Integer, nullable=True)
+    last_result_at = db.Column(db.DateTime, nullable=True)
+    # bumped on every result change, cached statistics are keyed by it
+    revision = db.Column(db.Integer, nullable=False, default=0)
+    # set once the results start earning overall points, see score_competition
+    scored_at = db.Column(db.DateTime, nullable=True)
 
     hosts = db.relationship("CompetitionHost", lazy=True, backref=db.backref("hosts"), cascade="all, delete-orphan")
     participants = db.relationship("UserCompetition", lazy=True, backref=db.backref("users"), cascade="all, delete-orphan")
@@ -27,6 +36,14 @@ class Competition(db.Model):
 
 
 
+    def get_listing_json(self):
+        return{
+            'id': self.id,
+            'name': self.name,
+            'date': self.date,
+            'location': self.location
+        }
+
     def toDict(self):
         res = {
             "id": self.id,
@@ -37,3 +54,52 @@ class Competition(db.Model):
             "participants": [participant.toDict() for participant in self.participants]
         } 
         return res
+
+    def get_counts_json(self):
+        return{
+            'id': self.id,
+            'participant_count': self.participant_count,
+            'top_score': self.top_score,
+            'last_result_at': self.last_result_at,
+            'revision': self.revision
+        }
+
+
+# Name search indexes, created together with the competition table.
+# SQLite keeps a trigram FTS5 index in step with the table through triggers,
+# PostgreSQL gets trigram GIN indexes that serve ILIKE '%q%' on the name and location.
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS competition_fts USING fts5(name, content='competition', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS competition_fts_insert AFTER INSERT ON competition BEGIN "
+    "INSERT INTO competition_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS competition_fts_delete AFTER DELETE ON competition BEGIN "
+    "INSERT INTO competition_fts(competition_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS competition_fts_update AFTER UPDATE OF name ON competition BEGIN "
+    "INSERT INTO competition_fts(competition_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO competition_fts(rowid, name) VALUES (new.id, new.name); END",
+]
+
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_competition_name_trgm ON competition USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_competition_location_trgm ON competition USING gin (location gin_trgm_ops)",
+]
+
+def create_search_index(connection, rebuild=False):
+    if connection.dialect.name == 'sqlite':
+        for statement in SQLITE_SEARCH_DDL:
+            connection.execute(text(statement))
+        if rebuild:
+            connection.execute(text("INSERT INTO competition_fts(competition_fts) VALUES ('rebuild')"))
+    elif connection.dialect.name == 'postgresql':
+        for statement in POSTGRES_SEARCH_DDL:
+            connection.execute(text(statement))
+
+@event.listens_for(Competition.__table__, "after_create")
+def competition_after_create(target, connection, **kw):
+    create_search_index(connection)
+
+@event.listens_for(Competition.__table__, "before_drop")
+def competition_before_drop(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text("DROP TABLE IF EXISTS competition_fts"))
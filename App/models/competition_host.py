@@ -2,5 +2,9 @@ from App.database import db
 
 class CompetitionHost(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    comp_id = db.Column(db.Integer, db.ForeignKey('competition.id'), nullable=False)
-    host_id =  db.Column(db.Integer, db.ForeignKey('host.id'), nullable=False)
\ No newline at end of file
+    comp_id = db.Column(db.Integer, db.ForeignKey('competition.id'), nullable=False, index=True)
+    host_id =  db.Column(db.Integer, db.ForeignKey('host.id'), nullable=False, index=True)
+
+    def toDict(self):
+        # the host backref of this link is named competitions
+        return self.competitions.toDict()
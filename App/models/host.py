@@ -4,6 +4,9 @@ class Host(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name =  db.Column(db.String, nullable=False, unique=True)
     website = db.Column(db.String, nullable=True)
+    # counter cache over the hosted competitions
+    competition_count = db.Column(db.Integer, nullable=False, default=0)
+    total_entrants = db.Column(db.Integer, nullable=False, default=0)
     
     competitions = db.relationship("CompetitionHost", lazy=True, backref=db.backref("competitions"), cascade="all, delete-orphan")
 
@@ -14,4 +17,11 @@ class Host(db.Model):
             "website": self.website
         }
         return res
+
+    def get_counts_json(self):
+        return{
+            'id': self.id,
+            'competition_count': self.competition_count,
+            'total_entrants': self.total_entrants
+        }
     
\ No newline at end of file
@@ -0,0 +1,21 @@
+from App.database import db
+
+class ImportCheckpoint(db.Model):
+    # progress of a results file import, committed together with each chunk of rows
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), nullable=False, unique=True)
+    byte_offset = db.Column(db.BigInteger, nullable=False, default=0)
+    rows_imported = db.Column(db.Integer, nullable=False, default=0)
+    rows_skipped = db.Column(db.Integer, nullable=False, default=0)
+    finished = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+    def get_json(self):
+        return{
+            'path': self.path,
+            'byte_offset': self.byte_offset,
+            'rows_imported': self.rows_imported,
+            'rows_skipped': self.rows_skipped,
+            'finished': self.finished,
+            'updated_at': self.updated_at
+        }
@@ -0,0 +1,26 @@
+from App.database import db
+
+class LeaderboardEntry(db.Model):
+    # pre-aggregated overall points of a user per location ('' for every location)
+    # and time bucket, e.g. ('Port of Spain', 'month', '2024-05')
+    id = db.Column(db.Integer, primary_key=True)
+    location = db.Column(db.String(120), nullable=False, default='')
+    period = db.Column(db.String(10), nullable=False)
+    bucket = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+    # the unique index serves the upserts, the second one the top-N reads of a bucket
+    __table_args__ = (
+        db.UniqueConstraint("location", "period", "bucket", "user_id", name="uq_leaderboard_entry_segment_user"),
+        db.Index("ix_leaderboard_entry_segment_points", "location", "period", "bucket", "points"),
+    )
+
+    def get_json(self):
+        return{
+            'location': self.location,
+            'window': self.period,
+            'bucket': self.bucket,
+            'user_id': self.user_id,
+            'points': self.points
+        }
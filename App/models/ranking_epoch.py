@@ -0,0 +1,13 @@
+from App.database import db
+
+class RankingEpoch(db.Model):
+    # single row (id 1): the reference time decayed scores are stored relative to,
+    # moved forward by renormalize_decayed_scores
+    id = db.Column(db.Integer, primary_key=True)
+    epoch = db.Column(db.Float, nullable=False)
+
+    def get_json(self):
+        return{
+            'id': self.id,
+            'epoch': self.epoch
+        }
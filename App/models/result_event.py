@@ -0,0 +1,40 @@
+from datetime import datetime
+from App.database import db
+
+class ResultEvent(db.Model):
+    # append-only log of result writes, the id is the event offset
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    comp_id = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    rank = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def get_json(self):
+        return{
+            'offset': self.id,
+            'kind': self.kind,
+            'comp_id': self.comp_id,
+            'user_id': self.user_id,
+            'rank': self.rank,
+            'created_at': self.created_at
+        }
+
+class ResultRevision(db.Model):
+    # appended by the result writes that add no event (replays, cascaded deletes), so the
+    # log head and the last revision id together change whenever any result does
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class ProjectionCheckpoint(db.Model):
+    # the last event offset a derived projection is known to be consistent with
+    name = db.Column(db.String(20), primary_key=True)
+    last_offset = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+    def get_json(self):
+        return{
+            'name': self.name,
+            'last_offset': self.last_offset,
+            'updated_at': self.updated_at
+        }
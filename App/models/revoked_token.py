@@ -0,0 +1,16 @@
+from datetime import datetime
+from App.database import db
+
+class RevokedToken(db.Model):
+    # JWTs revoked before they expire, rows are removed once the token has expired anyway
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), nullable=False, unique=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def get_json(self):
+        return{
+            'jti': self.jti,
+            'expires_at': self.expires_at,
+            'revoked_at': self.revoked_at
+        }
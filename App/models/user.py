@@ -6,9 +6,19 @@ class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username =  db.Column(db.String, nullable=False, unique=True)
     password = db.Column(db.String(120), nullable=False)
-    overall_rank = db.Column(db.Integer, default=0, nullable=False)
+    # accumulated points from competitions, never overwritten by the leaderboard job
+    overall_rank = db.Column(db.Integer, default=0, nullable=False, index=True)
+    # time-decayed points, stored relative to RankingEpoch.epoch (see controllers/decay.py)
+    decayed_score = db.Column(db.Float, nullable=False, default=0, index=True)
+    # leaderboard position (1 = most points), kept up to date by recompute_overall_positions
+    overall_position = db.Column(db.Integer, nullable=True, index=True)
     message = db.Column(db.String, default=0, nullable=False)
+    # bumped on every write so concurrent read-modify-write updates fail instead of overwriting each other
+    version = db.Column(db.Integer, nullable=False, default=1)
     competitions = db.relationship("UserCompetition", lazy=True, backref=db.backref("competitions"), cascade="all, delete-orphan")
+    stats = db.relationship("UserStats", lazy=True, uselist=False, cascade="all, delete-orphan")
+
+    __mapper_args__ = {"version_id_col": version}
 
     def __init__(self, username, password):
         self.username = username
@@ -3,8 +3,15 @@ from App.database import db
 class UserCompetition(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     comp_id = db.Column(db.Integer, db.ForeignKey('competition.id'), nullable=False)
-    user_id =  db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id =  db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     rank = db.Column(db.Integer, nullable=False)
+    # the overall points this result has earned so far, rescoring applies the difference
+    points = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+    __mapper_args__ = {"version_id_col": version}
+    # serves per-competition counts, MAX(rank) and the top 20 ordered by rank
+    __table_args__ = (db.Index("ix_user_competition_comp_id_rank", "comp_id", "rank"),)
 
     def toDict(self):
         res = {
@@ -0,0 +1,18 @@
+from App.database import db
+
+class UserStats(db.Model):
+    # one row per user, kept up to date by the result-writing controllers
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    competitions_entered = db.Column(db.Integer, nullable=False, default=0)
+    best_placement = db.Column(db.Integer, nullable=True)
+    total_points = db.Column(db.Integer, nullable=False, default=0)
+    last_activity = db.Column(db.DateTime, nullable=True)
+
+    def get_json(self):
+        return{
+            'user_id': self.user_id,
+            'competitions_entered': self.competitions_entered,
+            'best_placement': self.best_placement,
+            'total_points': self.total_points,
+            'last_activity': self.last_activity
+        }
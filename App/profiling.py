@@ -0,0 +1,103 @@
+import cProfile, glob, hmac, os, pstats, random, time, uuid
+from flask import g, request, jsonify, send_from_directory
+
+from App.metrics import metrics
+
+# On-demand profiling of single requests. With PROFILE_ENABLED on, a request carrying
+# X-Profile: <PROFILE_TOKEN>, or picked at PROFILE_SAMPLE_RATE, runs under cProfile and
+# its stats are saved to PROFILE_DIR as <endpoint>--<nanoseconds>--<id>.pstats, downloadable
+# from /profiles/<name> with the same header. With it off no hook is installed at all.
+
+SEPARATOR = '--'
+
+def profile_name(endpoint):
+    return f"{endpoint or 'unmatched'}{SEPARATOR}{time.time_ns()}{SEPARATOR}{uuid.uuid4().hex[:8]}.pstats"
+
+def endpoint_of(path):
+    return os.path.basename(path).split(SEPARATOR)[0]
+
+def profile_files(directory):
+    """The saved profiles, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, f'*{SEPARATOR}*.pstats')), key=lambda path: os.path.basename(path).split(SEPARATOR)[1])
+
+def prune_profiles(directory, keep):
+    for path in profile_files(directory)[:-keep or None]:
+        os.remove(path)
+
+def aggregate_profiles(directory, endpoint=None):
+    """
+    The saved profiles merged per endpoint, as {endpoint: (profile_count, pstats.Stats)}.
+    """
+    merged = {}
+    for path in profile_files(directory):
+        name = endpoint_of(path)
+        if endpoint and name != endpoint:
+            continue
+        if name in merged:
+            count, stats = merged[name]
+            stats.add(path)
+            merged[name] = (count + 1, stats)
+        else:
+            merged[name] = (1, pstats.Stats(path))
+    return merged
+
+def top_functions(stats, limit=10, sort='cumulative'):
+    """
+    The most expensive functions of a Stats as (function, calls, own_seconds, cumulative_seconds).
+    """
+    rows = [
+        (pstats.func_std_string(function), calls, own, cumulative)
+        for function, (primitive_calls, calls, own, cumulative, callers) in stats.stats.items()
+    ]
+    column = 2 if sort == 'tottime' else 3
+    return sorted(rows, key=lambda row: row[column], reverse=True)[:limit]
+
+def authorised(token):
+    header = request.headers.get('X-Profile', '')
+    return bool(token) and hmac.compare_digest(header, token)
+
+def setup_profiling(app):
+    if not app.config.get('PROFILE_ENABLED', False):
+        return None
+    directory = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    app.extensions['profiling'] = directory
+    token = app.config.get('PROFILE_TOKEN', '')
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    keep = app.config.get('PROFILE_KEEP', 500)
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint == 'download_profile':
+            return
+        if authorised(token) or (sample_rate and random.random() < sample_rate):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def save_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.disable()
+        name = profile_name(request.endpoint)
+        profiler.dump_stats(os.path.join(directory, name))
+        prune_profiles(directory, keep)
+        metrics.increment('profiles_saved', endpoint=request.endpoint)
+        response.headers['X-Profile-Id'] = name
+        return response
+
+    @app.teardown_request
+    def stop_profile(error=None):
+        # requests that failed before after_request ran
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+
+    def download_profile(name):
+        if not authorised(token):
+            return jsonify({'error': 'profiling token required'}), 403
+        return send_from_directory(directory, name, mimetype='application/octet-stream', as_attachment=True)
+
+    app.add_url_rule('/profiles/<name>', 'download_profile', download_profile)
+    return directory
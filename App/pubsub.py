@@ -0,0 +1,177 @@
+import json, queue, sqlite3, threading, time, uuid
+
+from App.metrics import metrics
+
+# Live leaderboard fan-out. Every worker keeps its own subscribers (one queue per
+# open SSE stream) and the last published standings of each channel, so only the
+# position changes are pushed. With PUBSUB_STORAGE=sqlite:///path the messages are
+# also passed to the other workers through a shared SQLite file. Every worker polls it
+# from the start, subscribers or not, so the standings it diffs against stay current.
+
+class Broker:
+
+    def __init__(self, shared=None):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.standings = {}
+        self.shared = shared
+        if shared:
+            shared.on_message = self.receive
+            shared.start()
+
+    def subscribe(self, channel, maxsize=100):
+        subscription = queue.Queue(maxsize)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, channel, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscribers.pop(channel, None)
+                # the next subscriber is seeded afresh, other workers may still diff against it
+                if not self.shared:
+                    self.standings.pop(channel, None)
+
+    def has_subscribers(self, channel):
+        """Whether publishing to channel can reach anyone, always so with subscribers in other workers."""
+        with self.lock:
+            return bool(self.shared) or bool(self.subscribers.get(channel))
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+        if self.shared:
+            self.shared.send(channel, message)
+
+    def receive(self, channel, message):
+        # a message published by another worker: keep our standings in step and fan out
+        with self.lock:
+            positions = self.standings.setdefault(channel, {})
+            for change in message.get('changes', []):
+                if change['position'] is None:
+                    positions.pop(change['user_id'], None)
+                else:
+                    positions[change['user_id']] = change['position']
+        self.deliver(channel, message)
+
+    def deliver(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(message)
+            except queue.Full:
+                # a client that stopped reading is dropped instead of buffering forever
+                self.unsubscribe(channel, subscription)
+                drain(subscription)
+                subscription.put_nowait(None)
+                metrics.increment('pubsub_dropped_subscribers')
+        metrics.increment('pubsub_messages', channel=channel.split(':')[0])
+
+    def seed(self, channel, standings):
+        with self.lock:
+            if channel not in self.standings:
+                self.standings[channel] = positions_of(standings)
+
+    def publish_standings(self, channel, standings):
+        """
+        Publish the entries of standings (ordered list of {'user_id', 'score'}) whose
+        position changed since the last call for this channel, plus the users who dropped out.
+        """
+        positions = positions_of(standings)
+        with self.lock:
+            previous = self.standings.get(channel, {})
+            self.standings[channel] = positions
+
+        changes = [
+            {'user_id': entry['user_id'], 'position': position, 'previous_position': previous.get(entry['user_id']), 'score': entry['score']}
+            for position, entry in enumerate(standings, start=1)
+            if previous.get(entry['user_id']) != position
+        ]
+        changes += [
+            {'user_id': user_id, 'position': None, 'previous_position': position, 'score': None}
+            for user_id, position in previous.items()
+            if user_id not in positions
+        ]
+        if changes:
+            self.publish(channel, {'channel': channel, 'changes': changes})
+        return changes
+
+def positions_of(standings):
+    return {entry['user_id']: position for position, entry in enumerate(standings, start=1)}
+
+def drain(subscription):
+    try:
+        while True:
+            subscription.get_nowait()
+    except queue.Empty:
+        pass
+
+class SQLiteChannel:
+    """
+    Cross-worker channel through a local SQLite file, a stand-in for Redis pub/sub.
+    Every worker appends its messages and polls for the ones written by the others.
+    """
+
+    def __init__(self, path, poll_interval=0.25, retention=60):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self.local = threading.local()
+        self.on_message = None
+        self.poller = None
+        self.start_lock = threading.Lock()
+        self.last_id = self.connection().execute("SELECT COALESCE(MAX(id), 0) FROM message").fetchone()[0]
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("CREATE TABLE IF NOT EXISTS message (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, "
+                         "channel TEXT NOT NULL, body TEXT NOT NULL, created REAL NOT NULL)")
+            self.local.conn = conn
+        return conn
+
+    def send(self, channel, message):
+        self.connection().execute(
+            "INSERT INTO message (origin, channel, body, created) VALUES (?, ?, ?, ?)",
+            (self.origin, channel, json.dumps(message, default=str), time.time())
+        )
+
+    def start(self):
+        with self.start_lock:
+            if self.poller is None:
+                self.poller = threading.Thread(target=self.poll_forever, name='pubsub-poller', daemon=True)
+                self.poller.start()
+
+    def poll_forever(self):
+        while True:
+            try:
+                self.poll()
+            except sqlite3.Error:
+                pass
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        conn = self.connection()
+        rows = conn.execute("SELECT id, origin, channel, body FROM message WHERE id > ? ORDER BY id", (self.last_id,)).fetchall()
+        for id, origin, channel, body in rows:
+            self.last_id = id
+            if origin != self.origin and self.on_message:
+                self.on_message(channel, json.loads(body))
+        conn.execute("DELETE FROM message WHERE created < ?", (time.time() - self.retention,))
+
+def setup_pubsub(app):
+    storage = app.config.get('PUBSUB_STORAGE', 'memory')
+    shared = SQLiteChannel(storage[len('sqlite:///'):]) if storage.startswith('sqlite:///') else None
+    broker = Broker(shared)
+    app.extensions['pubsub'] = broker
+    metrics.register_gauge('pubsub_subscribers', broker.subscriber_count)
+    return broker
@@ -0,0 +1,158 @@
+import math, sqlite3, threading, time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, jsonify
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+
+from App.metrics import metrics
+
+# Token buckets: every client gets `burst` tokens that refill at `rate` tokens per
+# second, each request takes one and is rejected with a 429 once the bucket is empty.
+# A bucket that has refilled completely carries no state, the stores drop it from then on.
+
+def refill_and_take(tokens, updated, rate, burst, now):
+    """
+    Refill a bucket for the time passed since it was last updated and try to take a token.
+    Returns (tokens_left, allowed, retry_after_seconds).
+    """
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, True, 0
+    return tokens, False, (1 - tokens) / rate
+
+def full_at(tokens, rate, burst, now):
+    """When a bucket left with tokens is full again, from then on it can be forgotten."""
+    return now + (burst - tokens) / rate
+
+class MemoryBucketStore:
+    """
+    Buckets kept in this process, enough for a single worker. They are kept in least
+    recently used order, past max_buckets the oldest tenth is evicted in one go.
+    """
+
+    max_buckets = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def take(self, key, rate, burst, now):
+        with self.lock:
+            tokens, updated, expires = self.buckets.pop(key, (burst, now, now))
+            tokens, allowed, retry_after = refill_and_take(tokens, updated, rate, burst, now)
+            self.buckets[key] = (tokens, now, full_at(tokens, rate, burst, now))
+            if len(self.buckets) > self.max_buckets:
+                self.evict(len(self.buckets) - self.max_buckets * 9 // 10, now)
+        return allowed, retry_after
+
+    def evict(self, count, now):
+        # at least count of the least recently used buckets, and any expired ones right behind them
+        while self.buckets and (count > 0 or next(iter(self.buckets.values()))[2] <= now):
+            self.buckets.popitem(last=False)
+            count -= 1
+
+    def size(self):
+        return len(self.buckets)
+
+class SQLiteBucketStore:
+    """
+    Buckets shared by all workers on a host through a local SQLite file,
+    a stand-in for a networked store such as Redis. Every bucket expires once it is
+    full again, each worker deletes the expired ones every prune_interval seconds.
+    """
+
+    prune_interval = 60
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.pruned_at = 0
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, expires REAL NOT NULL DEFAULT 0)")
+            try:
+                conn.execute("ALTER TABLE bucket ADD COLUMN expires REAL NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                # the column is there already
+                pass
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_bucket_expires ON bucket (expires)")
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens, allowed, retry_after = refill_and_take(tokens, updated, rate, burst, now)
+            conn.execute("INSERT OR REPLACE INTO bucket (key, tokens, updated, expires) VALUES (?, ?, ?, ?)",
+                         (key, tokens, now, full_at(tokens, rate, burst, now)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if now - self.pruned_at >= self.prune_interval:
+            self.prune(now)
+        return allowed, retry_after
+
+    def prune(self, now):
+        self.pruned_at = now
+        return self.connection().execute("DELETE FROM bucket WHERE expires <= ?", (now,)).rowcount
+
+    def size(self):
+        return self.connection().execute("SELECT COUNT(*) FROM bucket").fetchone()[0]
+
+def setup_rate_limiter(app):
+    storage = app.config.get('RATE_LIMIT_STORAGE', 'memory')
+    if storage.startswith('sqlite:///'):
+        store = SQLiteBucketStore(storage[len('sqlite:///'):])
+    else:
+        store = MemoryBucketStore()
+    app.extensions['rate_limiter'] = store
+    metrics.register_gauge('ratelimit_buckets', store.size)
+    return store
+
+def client_key():
+    # limit logged in clients by their identity, everyone else by address. Behind
+    # jwt_required the token is verified already and is not decoded a second time.
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        try:
+            verify_jwt_in_request(optional=True)
+            identity = get_jwt_identity()
+        except Exception:
+            identity = None
+    if identity is not None:
+        return f'user:{identity}'
+    return f'ip:{request.remote_addr}'
+
+def rate_limit(name, rate, burst):
+    """
+    Allow each client `rate` requests per second on the route, with bursts up to `burst`.
+    The quota can be changed per route through app.config['RATE_LIMITS'][name] = (rate, burst).
+    """
+    def decorator(view):
+        @wraps(view)
+        def limited_view(*args, **kwargs):
+            if not current_app.config.get('RATE_LIMIT_ENABLED', True):
+                return view(*args, **kwargs)
+
+            route_rate, route_burst = current_app.config.get('RATE_LIMITS', {}).get(name, (rate, burst))
+            store = current_app.extensions['rate_limiter']
+            allowed, retry_after = store.take(f'{name}:{client_key()}', route_rate, route_burst, time.time())
+            if not allowed:
+                metrics.increment('ratelimit_rejected', route=name)
+                response = jsonify({'error': 'rate limit exceeded, retry later'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(math.ceil(retry_after))
+                return response
+
+            metrics.increment('ratelimit_allowed', route=name)
+            return view(*args, **kwargs)
+        return limited_view
+    return decorator
@@ -0,0 +1,48 @@
+import threading
+from functools import wraps
+
+from App.metrics import metrics
+
+# While one call for a key is running, identical concurrent calls wait for its
+# result instead of running the same work again (e.g. the same top 20 query at the
+# end of a competition). Results are shared between callers, so decorated functions
+# must return plain data (dicts/lists), never ORM objects bound to a session.
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+flights = {}
+flights_lock = threading.Lock()
+
+def single_flight(fn):
+    @wraps(fn)
+    def coalesced(*args, **kwargs):
+        key = (fn.__module__, fn.__qualname__, args, tuple(sorted(kwargs.items())))
+        with flights_lock:
+            flight = flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = flights[key] = Flight()
+
+        if not leader:
+            metrics.increment('singleflight_coalesced', function=fn.__name__)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        metrics.increment('singleflight_executed', function=fn.__name__)
+        try:
+            flight.result = fn(*args, **kwargs)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with flights_lock:
+                del flights[key]
+            flight.done.set()
+        return flight.result
+    return coalesced
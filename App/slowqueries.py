@@ -0,0 +1,177 @@
+import atexit, glob, hashlib, json, logging, logging.handlers, os, queue, re, sys, threading, time
+from datetime import datetime, timezone
+from sqlalchemy import event
+
+from App.logs import NonBlockingQueueHandler
+
+# Slow-query log. Statements slower than SLOW_QUERY_MS are appended as JSON lines to a
+# rotating file with their parameters and the controller functions they came from, by a
+# background writer so the request never waits on the file. The first time a statement
+# shape shows up its plan is captured too (EXPLAIN QUERY PLAN on SQLite, EXPLAIN on
+# PostgreSQL), so a full table scan is easy to spot. EXPLAIN ANALYZE runs the statement a
+# second time inside the request, so it is only used with SLOW_QUERY_ANALYZE on.
+
+CONTROLLERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'controllers') + os.sep
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete')
+
+def statement_shape(statement):
+    """The statement with whitespace and expanded IN lists collapsed, so repeats group together."""
+    shape = re.sub(r'\s+', ' ', statement).strip()
+    return re.sub(r'\bIN \((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)', 'IN (?...)', shape, flags=re.IGNORECASE)
+
+def shape_id(shape):
+    return hashlib.sha1(shape.encode()).hexdigest()[:12]
+
+def controller_origin():
+    """The controller functions on the stack, outermost first, as 'user.get_user_rankings > fieldsets.serialize_results'."""
+    functions = []
+    frame = sys._getframe(1)
+    while frame:
+        filename = frame.f_code.co_filename
+        if filename.startswith(CONTROLLERS):
+            functions.append(f'{os.path.basename(filename)[:-3]}.{frame.f_code.co_name}')
+        frame = frame.f_back
+    return ' > '.join(reversed(functions)) or None
+
+def loggable_parameters(statement, parameters, limit=100):
+    if 'password' in statement.lower():
+        return '[redacted]'
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple, dict)):
+        # executemany, the first row stands for the rest
+        return {'rows': len(parameters), 'first': loggable_parameters(statement, parameters[0], limit)}
+    if isinstance(parameters, dict):
+        return {key: repr(value)[:limit] for key, value in parameters.items()}
+    return [repr(value)[:limit] for value in parameters or ()]
+
+def explain(cursor, dialect, statement, parameters, analyze=False):
+    """The plan of a statement, run on a separate DBAPI cursor so no engine events fire."""
+    verb = statement.lstrip().split(None, 1)[0].lower()
+    if verb not in EXPLAINABLE:
+        return None
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple, dict)):
+        parameters = parameters[0]
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect == 'postgresql':
+        # ANALYZE runs the statement again, only ever for reads
+        prefix = 'EXPLAIN ANALYZE ' if analyze and verb in ('select', 'with') else 'EXPLAIN '
+    else:
+        prefix = 'EXPLAIN '
+    try:
+        plan_cursor = cursor.connection.cursor()
+        plan_cursor.execute(prefix + statement, parameters or ())
+        rows = plan_cursor.fetchall()
+        plan_cursor.close()
+    except Exception as e:
+        return f'unavailable: {e}'
+    return '\n'.join(str(row[-1]) for row in rows)
+
+class SlowQueryLog:
+
+    def __init__(self, path, threshold_ms=250, max_bytes=5 * 1024 * 1024, backups=3, analyze=False):
+        self.path = path
+        self.threshold = threshold_ms / 1000
+        self.analyze = analyze
+        self.lock = threading.Lock()
+        self.explained = set()
+        self.output = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self.output.setFormatter(logging.Formatter('%(message)s'))
+        records = queue.Queue(10000)
+        # a standalone logger, kept out of the App.* logging setup
+        self.logger = logging.Logger('slow_queries')
+        self.logger.addHandler(NonBlockingQueueHandler(records))
+        self.listener = logging.handlers.QueueListener(records, self.output)
+        self.listener.start()
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info[self] = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop(self, None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        if duration < self.threshold:
+            return
+        shape = statement_shape(statement)
+        key = shape_id(shape)
+        with self.lock:
+            first = key not in self.explained
+            self.explained.add(key)
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'duration_ms': round(duration * 1000, 2),
+            'shape_id': key,
+            'statement': shape,
+            'parameters': loggable_parameters(statement, parameters),
+            'origin': controller_origin(),
+        }
+        if first:
+            entry['plan'] = explain(cursor, conn.dialect.name, statement, parameters, self.analyze)
+        self.logger.info(json.dumps(entry, default=str))
+
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def remove(self, engine):
+        event.remove(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.remove(engine, 'after_cursor_execute', self.after_cursor_execute)
+        self.close()
+
+    def close(self):
+        """Write out the queued entries and stop the writer, does nothing the second time."""
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+            self.output.close()
+
+def read_slow_queries(path):
+    """The entries of a slow-query log and its rotated files, oldest first."""
+    rotated = sorted(glob.glob(path + '.[0-9]*'), key=lambda name: int(name.rsplit('.', 1)[1]), reverse=True)
+    entries = []
+    for name in rotated + ([path] if os.path.exists(path) else []):
+        with open(name) as log:
+            for line in log:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    return entries
+
+def summarize_slow_queries(entries):
+    """
+    Entries grouped by statement shape, slowest total first, as dicts with
+    statement, count, total_ms, max_ms, origins and plan.
+    """
+    shapes = {}
+    for entry in entries:
+        summary = shapes.setdefault(entry['shape_id'], {
+            'shape_id': entry['shape_id'], 'statement': entry['statement'], 'count': 0,
+            'total_ms': 0, 'max_ms': 0, 'origins': set(), 'plan': None
+        })
+        summary['count'] += 1
+        summary['total_ms'] += entry['duration_ms']
+        summary['max_ms'] = max(summary['max_ms'], entry['duration_ms'])
+        if entry.get('origin'):
+            summary['origins'].add(entry['origin'])
+        if entry.get('plan'):
+            summary['plan'] = entry['plan']
+    return sorted(shapes.values(), key=lambda summary: summary['total_ms'], reverse=True)
+
+def full_scans(plan):
+    """The tables a SQLite or PostgreSQL plan reads without an index."""
+    return re.findall(r'(?:^|\n)\s*(?:SCAN(?: TABLE)?|Seq Scan on)\s+(\w+)(?!.*USING (?:COVERING )?INDEX)', plan or '')
+
+def setup_slow_query_log(app, engine):
+    threshold = app.config.get('SLOW_QUERY_MS', 250)
+    if not threshold or threshold < 0:
+        return None
+    path = app.config.get('SLOW_QUERY_LOG') or os.path.join(app.instance_path, 'slow_queries.log')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    log = SlowQueryLog(path, threshold, app.config.get('SLOW_QUERY_LOG_BYTES', 5 * 1024 * 1024),
+                       analyze=app.config.get('SLOW_QUERY_ANALYZE', False))
+    log.install(engine)
+    atexit.register(log.close)
+    app.extensions['slow_query_log'] = log
+    return log
@@ -0,0 +1,102 @@
+import fcntl, os, struct, threading
+import numpy as np
+
+# Columnar results snapshot in one file that every worker maps read-only, so the pages
+# are shared through the page cache instead of copied into each process. Layout: a
+# 32 byte header (magic, generation, row count) followed by int64 columns
+#
+#   comp_ids, user_ids, scores  results sorted by competition, then best score first
+#   user_order, users_sorted    the rows again ordered by user, for per-user lookups
+#
+# A new snapshot is written next to the old one and renamed over it, workers that still
+# map the old file keep reading it until they notice the change and map the new one.
+
+MAGIC = b'RESSNAP2'
+HEADER = struct.Struct('<8sqq8x')
+COLUMNS = ('comp_ids', 'user_ids', 'scores', 'user_order', 'users_sorted')
+
+def write_results_snapshot(path, generation, ids, comp_ids, user_ids, scores):
+    order = np.lexsort((ids, -scores, comp_ids))
+    comp_ids, user_ids, scores = comp_ids[order], user_ids[order], scores[order]
+    user_order = np.argsort(user_ids, kind='stable')
+    columns = (comp_ids, user_ids, scores, user_order, user_ids[user_order])
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, generation, len(order)))
+        for column in columns:
+            file.write(np.ascontiguousarray(column, dtype='<i8').tobytes())
+    os.replace(tmp_path, path)
+
+class ResultsSnapshot:
+
+    def __init__(self, path):
+        self.path = path
+        self.stat = os.stat(path)
+        with open(path, 'rb') as file:
+            magic, self.generation, self.count = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a results snapshot')
+        if self.count:
+            data = np.memmap(path, dtype='<i8', mode='r', offset=HEADER.size, shape=(len(COLUMNS), self.count))
+        else:
+            data = np.empty((len(COLUMNS), 0), dtype='<i8')
+        for name, column in zip(COLUMNS, data):
+            setattr(self, name, column)
+
+    def is_current(self):
+        # a rebuilt snapshot is a new file, so a different inode means ours was replaced
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) == (self.stat.st_ino, self.stat.st_mtime_ns)
+
+    def competition_scores(self, comp_id):
+        """The scores of a competition, best first (a view into the mapped file)."""
+        start, end = np.searchsorted(self.comp_ids, [comp_id, comp_id + 1])
+        return self.scores[start:end]
+
+    def position(self, comp_id, user_id):
+        """
+        The 1-based position of a user's best result in a competition and its score,
+        or (None, None) if the user has no result there.
+        """
+        start, end = np.searchsorted(self.comp_ids, [comp_id, comp_id + 1])
+        rows = np.flatnonzero(self.user_ids[start:end] == user_id)
+        if not len(rows):
+            return None, None
+        return int(rows[0]) + 1, int(self.scores[start + rows[0]])
+
+    def user_results(self, user_id):
+        """(comp_ids, scores) of every result of a user."""
+        start, end = np.searchsorted(self.users_sorted, [user_id, user_id + 1])
+        rows = self.user_order[start:end]
+        return self.comp_ids[rows], self.scores[rows]
+
+class SnapshotHolder:
+    """The snapshot a worker currently maps, when it last checked it was fresh and its rebuild thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0
+        self.rebuilding = None
+
+    def rebuild_lock(self):
+        return open(f'{self.path}.lock', 'w')
+
+def try_lock(file, blocking):
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+def setup_results_snapshot(app):
+    path = app.config.get('RESULTS_SNAPSHOT_PATH') or os.path.join(app.instance_path, 'results.snapshot')
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    holder = SnapshotHolder(path)
+    app.extensions['results_snapshot'] = holder
+    return holder
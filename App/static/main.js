@@ -1,22 +1,84 @@
+const PAGE_SIZE = 500;
+const ROW_HEIGHT = 48;
+const OVERSCAN = 10;
 
-async function getUserData(){
-    const response = await fetch('/api/users');
+// users are fetched one keyset page at a time and only the rows in view are in the DOM
+const state = {
+    users: [],
+    total: 0,
+    nextAfterId: 0,
+    done: false,
+    loading: null,
+    frame: null
+};
+
+async function getUserPage(afterId){
+    const response = await fetch(`/api/users?limit=${PAGE_SIZE}&after_id=${afterId}`);
+    const total = response.headers.get('X-Total-Count');
+    if(total !== null)
+        state.total = parseInt(total, 10);
     return response.json();
 }
 
-function loadTable(users){
-    const table = document.querySelector('#result');
-    for(let user of users){
-        table.innerHTML += `<tr>
-            <td>${user.id}</td>
-            <td>${user.username}</td>
-        </tr>`;
+function loadNextPage(){
+    if(state.done || state.loading)
+        return state.loading;
+
+    state.loading = getUserPage(state.nextAfterId).then(users => {
+        for(let user of users)
+            state.users.push(user);
+        if(users.length < PAGE_SIZE)
+            state.done = true;
+        else
+            state.nextAfterId = users[users.length - 1].id;
+        state.loading = null;
+        renderRows();
+    });
+    return state.loading;
+}
+
+function createRow(user){
+    const row = document.createElement('tr');
+    row.style.height = `${ROW_HEIGHT}px`;
+    for(let value of user ? [user.id, user.username] : ['…', '…']){
+        const cell = document.createElement('td');
+        cell.textContent = value;
+        row.appendChild(cell);
     }
+    return row;
+}
+
+function renderRows(){
+    const viewport = document.querySelector('#viewport');
+    const count = Math.max(state.total, state.users.length);
+    const first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+    const last = Math.min(count, Math.ceil((viewport.scrollTop + viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+
+    const fragment = document.createDocumentFragment();
+    for(let i = first; i < last; i++)
+        fragment.appendChild(createRow(state.users[i]));
+
+    document.querySelector('#spacer').style.height = `${count * ROW_HEIGHT}px`;
+    document.querySelector('#rows').style.transform = `translateY(${first * ROW_HEIGHT}px)`;
+    document.querySelector('#result').replaceChildren(fragment);
+
+    // keep fetching ahead of the scroll position
+    if(last + PAGE_SIZE / 2 > state.users.length)
+        loadNextPage();
+}
+
+function onScroll(){
+    if(state.frame)
+        return;
+    state.frame = requestAnimationFrame(() => {
+        state.frame = null;
+        renderRows();
+    });
 }
 
 async function main(){
-    const users = await getUserData();
-    loadTable(users);
+    document.querySelector('#viewport').addEventListener('scroll', onScroll);
+    await loadNextPage();
 }
 
-main();
\ No newline at end of file
+main();
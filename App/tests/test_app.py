@@ -1,7 +1,11 @@
-import os, tempfile, pytest, logging, unittest
+import os, tempfile, pytest, logging, unittest, threading
+import numpy as np
+from datetime import datetime
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from App.main import create_app
+from App.bloom import BloomFilter
+from App.metrics import metrics
 from App.database import db, create_db
 from App.models import User
 from App.controllers import (
@@ -54,8 +58,12 @@ class UserUnitTests(unittest.TestCase):
 # This fixture creates an empty database for the test and deletes it after the test
 # scope="class" would execute the fixture once and resued for all methods in the class
 @pytest.fixture(autouse=True, scope="module")
-def empty_db():
-    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db'})
+def empty_db(tmp_path_factory):
+    # the database and everything the app writes at runtime stay out of the tree
+    output = tmp_path_factory.mktemp('instance')
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{output / "test.db"}',
+                      'SLOW_QUERY_LOG': str(output / 'slow_queries.log'),
+                      'RESULTS_SNAPSHOT_PATH': str(output / 'results.snapshot')})
     create_db()
     yield app.test_client()
     db.drop_all()
@@ -363,4 +371,218 @@ def test_get_user_overall_rank_and_position():
     # We expect this user's position in the top 20 to be 5 in this simulation
     expected_user_position = 5
 
-   
+
+def test_concurrent_overall_rank_updates_are_exact(empty_db):
+    # Several threads (each with its own app context and session) add points to the
+    # same users at the same time, like multiple gunicorn workers closing competitions
+    app = empty_db.application
+    create_user("stress_a", "stresspass")
+    create_user("stress_b", "stresspass")
+    user_ids = [get_user_by_username("stress_a").id, get_user_by_username("stress_b").id]
+    start = {user_id: get_user(user_id).overall_rank for user_id in user_ids}
+
+    threads_count, rounds, points = 8, 25, 3
+    errors = []
+
+    def worker():
+        with app.app_context():
+            try:
+                for _ in range(rounds):
+                    for user_id in user_ids:
+                        update_user_overall_rank(user_id, points)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    db.session.expire_all()
+    for user_id in user_ids:
+        assert get_user(user_id).overall_rank == start[user_id] + threads_count * rounds * points
+
+
+def test_arrange_top_20_overall_keeps_points():
+    points = {user.id: user.overall_rank for user in get_all_users()}
+
+    arrange_top_20_overall()
+
+    users = get_all_users()
+    assert {user.id: user.overall_rank for user in users} == points
+    ordered = sorted(users, key=lambda user: (-user.overall_rank, user.id))
+    for position, user in enumerate(ordered, start=1):
+        assert user.overall_position == position
+        assert get_user_at_position(position).id == user.id
+        assert get_user_overall_rank_and_position(user.id) == (user.overall_rank, position)
+
+    # a points change leaves the stored positions stale, the lookups count instead
+    last = ordered[-1]
+    update_user_overall_rank(last.id, ordered[0].overall_rank + 1)
+    assert get_user_overall_rank_and_position(last.id)[1] == 1
+    assert get_user_overall_rank_and_position(ordered[0].id)[1] == 2
+    assert get_user_at_position(1).id == last.id
+    recompute_overall_positions()
+    assert get_user_overall_rank_and_position(ordered[0].id)[1] == 2
+
+    # a signup is placed last and keeps the indexed lookups in use
+    create_user("last_signup", "signuppass")
+    newest = get_user_by_username("last_signup")
+    assert positions_are_current()
+    assert newest.overall_position == len(users) + 1
+    assert get_user_at_position(len(users) + 1).id == newest.id
+
+
+def test_user_summary(empty_db):
+    create_user("summary_user", "summarypass")
+    user_id = get_user_by_username("summary_user").id
+
+    assert add_results(user_id, 1, 50)
+    update_user_overall_rank(user_id, 20, placement=1)
+    update_user_overall_rank(user_id, 5, placement=16)
+
+    response = empty_db.get(f"/users/{user_id}/summary")
+    assert response.status_code == 200
+    summary = response.get_json()
+    assert summary["last_activity"] is not None
+    del summary["last_activity"]
+    assert summary == {"user_id": user_id, "competitions_entered": 1, "best_placement": 1, "total_points": 25}
+
+    assert empty_db.get("/users/9999/summary").status_code == 404
+
+
+def test_users_api_pages(empty_db):
+    all_users = get_all_users_json()
+
+    first = empty_db.get("/api/users?limit=2")
+    assert first.get_json() == all_users[:2]
+    assert first.headers["X-Total-Count"] == str(len(all_users))
+
+    after_id = first.headers["X-Next-After-Id"]
+    second = empty_db.get(f"/api/users?limit=2&after_id={after_id}")
+    assert second.get_json() == all_users[2:4]
+    assert "X-Total-Count" not in second.headers
+
+    assert empty_db.get("/api/users?limit=0").get_json() == all_users[:1]
+    assert empty_db.get("/api/users?limit=-5").get_json() == all_users[:1]
+    last_page = empty_db.get(f"/api/users?limit=2&after_id={all_users[-1]['id']}")
+    assert last_page.status_code == 200 and last_page.get_json() == []
+    assert "X-Next-After-Id" not in last_page.headers
+
+    assert empty_db.get("/users?page=1").status_code == 200
+
+
+def test_score_results_rules():
+    ids = np.arange(1, 6)
+    comp_ids = np.array([1, 1, 1, 2, 2])
+    user_ids = np.array([1, 2, 3, 1, 3])
+    ranks = np.array([10, 30, 20, 5, 50])
+    # competition 1 places users 2, 3, 1 and competition 2 places users 3, 1
+
+    users, totals, best = score_results(ids, comp_ids, user_ids, ranks, linear_points)
+    assert users.tolist() == [1, 2, 3]
+    assert totals.tolist() == [18 + 19, 20, 19 + 20]
+    assert best.tolist() == [2, 1, 1]
+
+    users, totals, best = score_results(ids, comp_ids, user_ids, ranks, f1_points)
+    assert totals.tolist() == [15 + 18, 25, 18 + 25]
+
+    users, totals, best = score_results(ids, comp_ids, user_ids, ranks, percentile_points)
+    assert totals.tolist() == [0, 100, 50 + 100]
+    assert best[1:].tolist() == [1, 1]
+
+
+def test_rebuild_overall_rankings():
+    ids, comp_ids, user_ids, ranks = load_results()
+    users, totals, best = total_by_user(user_ids, *earned_points(ids, comp_ids, ranks, linear_points))
+
+    assert rebuild_overall_rankings('linear') == len(users)
+
+    expected = dict(zip(users.tolist(), totals.tolist()))
+    for user in get_all_users():
+        assert user.overall_rank == expected.get(user.id, 0)
+    assert get_user_at_position(1).overall_rank == max(totals)
+
+    with pytest.raises(ValueError):
+        rebuild_overall_rankings('unknown')
+
+
+def test_decayed_scores(empty_db):
+    app = empty_db.application
+    half_life = app.config['RANKING_HALF_LIFE_DAYS'] * 86400
+    epoch = get_ranking_epoch()
+    assert decay_weight(epoch + half_life, epoch) == pytest.approx(2)
+
+    create_user("decay_old", "pass")
+    create_user("decay_new", "pass")
+    old = get_user_by_username("decay_old")
+    new = get_user_by_username("decay_new")
+    last_year = Competition("Decay Last Year", "Arima")
+    last_year.date = datetime.utcfromtimestamp(epoch - 365 * 86400)
+    this_year = Competition("Decay This Year", "Arima")
+    this_year.date = datetime.utcfromtimestamp(epoch)
+    db.session.add_all([last_year, this_year])
+    db.session.commit()
+    # the same points a year apart, the recent ones count for more
+    update_user_overall_rank(old.id, 20, comp=last_year)
+    update_user_overall_rank(new.id, 15, comp=this_year)
+    assert get_user(old.id).overall_rank > get_user(new.id).overall_rank
+    assert get_user(new.id).decayed_score > get_user(old.id).decayed_score
+
+    before = current_decayed_score(get_user(new.id).decayed_score, epoch, now=epoch + half_life)
+    assert before == pytest.approx(7.5)
+    renormalize_decayed_scores(now=epoch + half_life)
+    assert get_ranking_epoch() == epoch + half_life
+    assert get_user(new.id).decayed_score == pytest.approx(before)
+
+    app.config['RANKING_MODE'] = 'decayed'
+    try:
+        top = [user_id for user_id, position in get_top_20_users_overall_rank()]
+        assert top.index(new.id) < top.index(old.id)
+    finally:
+        app.config['RANKING_MODE'] = 'total'
+    top = [user_id for user_id, position in get_top_20_users_overall_rank()]
+    assert top.index(old.id) < top.index(new.id)
+
+
+def test_logout_revokes_token(empty_db):
+    create_user("logout_user", "logoutpass")
+    token = empty_db.post("/api/login", json={"username": "logout_user", "password": "logoutpass"}).get_json()["access_token"]
+    other = empty_db.post("/api/login", json={"username": "logout_user", "password": "logoutpass"}).get_json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    exact_checks = metrics.snapshot()["counters"].get("revocation_exact_checks", 0)
+    assert empty_db.get("/api/identify", headers=headers).status_code == 200
+    # a token that was never revoked is cleared by the filter alone
+    assert metrics.snapshot()["counters"].get("revocation_exact_checks", 0) == exact_checks
+
+    assert empty_db.post("/api/logout", headers=headers).status_code == 200
+    assert empty_db.get("/api/identify", headers=headers).status_code == 401
+    assert empty_db.get("/api/identify", headers={"Authorization": f"Bearer {other}"}).status_code == 200
+
+
+def test_revocation_filter_sync_and_gc(empty_db):
+    app = empty_db.application
+    revoke_token("revoked-elsewhere", datetime(2000, 1, 1))
+    # a revocation written by another worker reaches this one on the next sync
+    db.session.add(RevokedToken(jti="other-worker", expires_at=datetime(2999, 1, 1)))
+    db.session.commit()
+    assert "other-worker" in sync_revocation_filter(force=True)
+    assert is_token_revoked("other-worker")
+
+    # the collection commits on its own, whatever the request has staged stays uncommitted
+    db.session.add(Competition(name="GC Staged", location="Arima"))
+    app.extensions["token_revocation"].collected_at = -app.config["REVOCATION_GC_INTERVAL"]
+    sync_revocation_filter(force=True)
+    db.session.rollback()
+    assert Competition.query.filter_by(name="GC Staged").first() is None
+    assert not is_token_revoked("revoked-elsewhere")
+    assert RevokedToken.query.filter_by(jti="revoked-elsewhere").first() is None
+
+    bloom = BloomFilter(1000)
+    for i in range(1000):
+        bloom.add(f"token-{i}")
+    assert all(f"token-{i}" in bloom for i in range(1000))
+    assert sum(f"other-{i}" in bloom for i in range(10000)) < 100
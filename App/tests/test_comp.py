@@ -1,9 +1,12 @@
-import os, tempfile, pytest, logging, unittest
+import os, gzip, json, queue, tempfile, pytest, logging, logging.handlers, unittest, threading, time
+from datetime import datetime
+from sqlalchemy import event
 from werkzeug.security import check_password_hash, generate_password_hash
 
+from flask_jwt_extended import verify_jwt_in_request
 from App.main import create_app
 from App.database import db, create_db
-from App.models import User, Competition
+from App.models import User, Competition, UserCompetition, UserStats
 from App.controllers import (
     create_user,
     get_all_users_json,
@@ -16,12 +19,52 @@ from App.controllers import (
     get_all_competitions,
     get_all_competitions_json,
     get_competition_by_id,
+    get_competition_json,
 
     add_results,
-    get_competition_users
-
-
+    get_competition_users,
+    delete_result,
+
+    create_host,
+    add_host_to_competition,
+    verify_counters,
+    get_user_summary,
+    backfill_user_stats,
+
+    search_competitions_json,
+    suggest_competitions,
+    suggest_cache,
+    SUGGEST_CHECK_SECONDS,
+    update_user_competition_rank,
+    update_overall_rankings,
+    score_competition,
+    rebuild_overall_rankings,
+    get_top_20_users_in_competition,
+    replay_events,
+    get_log_head,
+    get_checkpoints,
+    backfill_result_events,
+    import_results,
+    rebuild_results_snapshot,
+    get_results_snapshot,
+    get_competition_standings,
+    publish_competition_standings,
+    flush_buffered_ranks,
+    get_user_rankings,
+    jwt_token_for
 )
+from App import ratelimit
+from App.ratelimit import MemoryBucketStore, SQLiteBucketStore, client_key
+from App.snapshot import ResultsSnapshot
+from App import writebehind
+from App.writebehind import ScoreBuffer
+from App.pubsub import Broker, SQLiteChannel
+from App import logs
+from App.profiling import setup_profiling, aggregate_profiles, top_functions
+from App.traffic import setup_traffic_capture, read_trace, replay_trace, latency_summary, compare_to_baseline
+from App.slowqueries import SlowQueryLog, read_slow_queries, summarize_slow_queries, full_scans, explain
+from App.metrics import metrics
+from App.controllers.competition_stats import stats_cache
 
 
 LOGGER = logging.getLogger(__name__)
@@ -55,8 +98,12 @@ class CompUnitTests(unittest.TestCase):
 
 
 @pytest.fixture(autouse=True, scope="module")
-def empty_db():
-    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db'})
+def empty_db(tmp_path_factory):
+    # the database and everything the app writes at runtime stay out of the tree
+    output = tmp_path_factory.mktemp('instance')
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{output / "test.db"}',
+                      'SLOW_QUERY_LOG': str(output / 'slow_queries.log'),
+                      'RESULTS_SNAPSHOT_PATH': str(output / 'results.snapshot')})
     create_db()
     yield app.test_client()
     db.drop_all()
@@ -91,6 +138,845 @@ class CompIntegrationTests(unittest.TestCase):
     def test_get_competition_by_id(self):
         Competition_json = get_competition_by_id(1).get_json()
         self.assertDictEqual(Competition_json, {"id":1, "name":"Walktime", "location": "Port of Spain"})
-        
 
 
+def test_competition_counters():
+    create_user("counted", "countedpass")
+    assert create_competition("Counted Comp", "Arima")
+    comp_id = Competition.query.filter_by(name="Counted Comp").first().id
+    user_id = get_user_by_username("counted").id
+
+    assert add_results(1, comp_id, 30)
+    assert add_results(user_id, comp_id, 45)
+    host = create_host("Counting Host")
+    assert add_host_to_competition(host.id, comp_id)
+
+    comp = get_competition_by_id(comp_id)
+    assert comp.participant_count == 2
+    assert comp.top_score == 45
+    assert comp.last_result_at is not None
+    assert host.get_counts_json() == {"id": host.id, "competition_count": 1, "total_entrants": 2}
+
+    assert delete_result(user_id, comp_id)
+    comp = get_competition_by_id(comp_id)
+    assert comp.participant_count == 1
+    assert comp.top_score == 30
+    assert host.total_entrants == 1
+
+
+def test_verify_counters_repairs_drift():
+    comp = Competition.query.filter_by(name="Counted Comp").first()
+    comp.participant_count = 99
+    db.session.commit()
+
+    drift = verify_counters(repair=False)
+    assert ("competition", comp.id, "participant_count", 99, 1) in drift
+    assert verify_counters(repair=False) == drift
+
+    verify_counters()
+    assert verify_counters(repair=False) == []
+    assert get_competition_by_id(comp.id).participant_count == 1
+
+
+def test_stats_rows_for_existing_users(empty_db):
+    create_competition("Legacy Stats Comp", "Penal")
+    comp_id = Competition.query.filter_by(name="Legacy Stats Comp").first().id
+    for name in ("legacy_a", "legacy_b"):
+        create_user(name, "legacypass")
+    user_a, user_b = get_user_by_username("legacy_a").id, get_user_by_username("legacy_b").id
+    add_results(user_a, comp_id, 10)
+    add_results(user_a, comp_id, 20)
+    add_results(user_b, comp_id, 30)
+    # users from before the summary existed have no row
+    UserStats.query.filter(UserStats.user_id.in_([user_a, user_b])).delete()
+    db.session.commit()
+    assert empty_db.get(f'/users/{user_b}/summary').status_code == 404
+
+    # the first write creates the row from the results left, never a negative count
+    delete_result(user_a, comp_id)
+    assert get_user_summary(user_a).competitions_entered == 0
+
+    assert backfill_user_stats() == 1
+    db.session.commit()
+    assert empty_db.get(f'/users/{user_b}/summary').get_json()['competitions_entered'] == 1
+    assert backfill_user_stats() == 0
+
+
+def test_counters_follow_cascade_deletes():
+    create_competition("Cascade Comp", "Arima")
+    comp_id = Competition.query.filter_by(name="Cascade Comp").first().id
+    create_user("cascaded", "cascadedpass")
+    user_id = get_user_by_username("cascaded").id
+    host = create_host("Cascade Host")
+    add_results(user_id, comp_id, 10)
+    add_results(1, comp_id, 20)
+    add_host_to_competition(host.id, comp_id)
+    entered = get_user_summary(user_id).competitions_entered
+
+    # rows removed through the ORM instead of delete_result
+    db.session.delete(UserCompetition.query.filter_by(user_id=1, comp_id=comp_id).first())
+    db.session.commit()
+    assert get_competition_by_id(comp_id).participant_count == 1
+    assert get_competition_by_id(comp_id).top_score == 10
+    assert host.total_entrants == 1
+
+    db.session.delete(get_competition_by_id(comp_id))
+    db.session.commit()
+    assert host.get_counts_json() == {"id": host.id, "competition_count": 0, "total_entrants": 0}
+    assert get_user_summary(user_id).competitions_entered == entered - 1
+    assert verify_counters(repair=False) == []
+
+
+def test_search_competitions():
+    for name, location, date in [("Coding Sprint", "San Fernando", datetime(2023, 3, 1)),
+                                 ("Coding Marathon", "Arima", datetime(2023, 6, 1)),
+                                 ("Chess Open", "San Fernando", datetime(2023, 9, 1))]:
+        assert create_competition(name, location)
+        Competition.query.filter_by(name=name).first().date = date
+    db.session.commit()
+
+    names = lambda results: sorted(comp["name"] for comp in results)
+    assert names(search_competitions_json(q="ding")) == ["Coding Marathon", "Coding Sprint"]
+    assert names(search_competitions_json(q="MARATHON")) == ["Coding Marathon"]
+    assert names(search_competitions_json(q="Ch")) == ["Chess Open"]
+    assert names(search_competitions_json(location="San Fernando")) == ["Chess Open", "Coding Sprint"]
+    assert names(search_competitions_json(location="fernando")) == ["Chess Open", "Coding Sprint"]
+    assert names(search_competitions_json(q="Ch", location="fern")) == ["Chess Open"]
+    assert names(search_competitions_json(q="Coding", date_from=datetime(2023, 5, 1), date_to=datetime(2023, 12, 31))) == ["Coding Marathon"]
+
+
+def test_suggest_competitions():
+    assert [comp["name"] for comp in suggest_competitions("cod")] == ["Coding Marathon", "Coding Sprint"]
+    assert suggest_competitions("zzz") == []
+
+    create_competition("Codeathon", "Chaguanas")
+    assert [comp["name"] for comp in suggest_competitions("cod", limit=2)] == ["Codeathon", "Coding Marathon"]
+
+    # Another worker's insert never reaches this process's invalidation, only the database.
+    db.session.execute(Competition.__table__.insert().values(name="Code Golf", location="Arima"))
+    db.session.commit()
+    suggest_cache['checked_at'] -= SUGGEST_CHECK_SECONDS + 1
+    assert [comp["name"] for comp in suggest_competitions("code")] == ["Code Golf", "Codeathon"]
+
+
+def test_results_route_rate_limited(empty_db):
+    app = empty_db.application
+    app.config['RATE_LIMITS'] = {'competition_results': (0.01, 2)}
+    try:
+        statuses = [empty_db.post('/competitions/results', json={}).status_code for _ in range(3)]
+        assert statuses == [400, 400, 429]
+
+        response = empty_db.post('/competitions/results', json={})
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) > 0
+
+        counters = empty_db.get('/metrics').get_json()['counters']
+        assert counters['ratelimit_rejected{route=competition_results}'] >= 2
+    finally:
+        app.config['RATE_LIMITS'] = {}
+
+
+def test_rate_limit_follows_forwarded_client(empty_db):
+    app = empty_db.application
+    app.config['RATE_LIMITS'] = {'competition_results': (0.01, 1)}
+    try:
+        post = lambda client: empty_db.post('/competitions/results', json={}, headers={'X-Forwarded-For': client}).status_code
+        assert [post('203.0.113.5'), post('203.0.113.5')] == [400, 429]
+        # another client behind the same proxy has its own bucket
+        assert post('203.0.113.6') == 400
+    finally:
+        app.config['RATE_LIMITS'] = {}
+
+
+def test_rate_limit_reuses_verified_identity(empty_db, monkeypatch):
+    app = empty_db.application
+    create_user("limit_user", "limitpass")
+    user = get_user_by_username("limit_user")
+    headers = {'Authorization': f'Bearer {jwt_token_for(user)}'}
+    with app.test_request_context('/competitions/user', headers=headers):
+        verify_jwt_in_request()
+        decoded = []
+        monkeypatch.setattr(ratelimit, 'verify_jwt_in_request', lambda **kwargs: decoded.append(kwargs))
+        assert client_key() == f'user:{user.id}'
+        assert decoded == []
+        monkeypatch.undo()
+    with app.test_request_context('/competitions/user', headers=headers):
+        assert client_key() == f'user:{user.id}'
+
+
+def test_sqlite_bucket_store_is_shared(tmp_path):
+    path = str(tmp_path / 'buckets.db')
+    worker_a, worker_b = SQLiteBucketStore(path), SQLiteBucketStore(path)
+
+    assert worker_a.take('login:ip:1', 1, 2, 100.0)[0]
+    assert worker_b.take('login:ip:1', 1, 2, 100.0)[0]
+    allowed, retry_after = worker_a.take('login:ip:1', 1, 2, 100.5)
+    assert not allowed and retry_after == 0.5
+    assert worker_b.take('login:ip:1', 1, 2, 101.0)[0]
+
+    # full buckets expire and are deleted by the next prune
+    worker_a.take('login:ip:2', 1, 2, 100.0)
+    assert worker_a.prune(100.5) == 0
+    assert worker_a.prune(101.5) == 1
+    assert worker_a.prune(105.0) == 1
+    assert worker_a.size() == 0
+
+
+def test_memory_bucket_store_evicts_least_recently_used():
+    store = MemoryBucketStore()
+    store.max_buckets = 10
+    for i in range(10):
+        store.take(f'search:ip:{i}', 0.001, 5, 100.0)
+    # a slow route's bucket stays, used again it is no longer the oldest
+    assert store.take('search:ip:0', 0.001, 5, 101.0)[0]
+    store.take('search:ip:10', 100, 5, 102.0)
+    assert store.size() == 9
+    assert 'search:ip:0' in store.buckets and 'search:ip:1' not in store.buckets
+    tokens, updated, expires = store.buckets['search:ip:0']
+    assert tokens == pytest.approx(3.001) and expires > 2000
+
+
+def test_single_flight_coalesces_concurrent_queries(empty_db):
+    app = empty_db.application
+    release = threading.Event()
+    statements = []
+
+    # counts every statement sent to the database and holds the leader's query open
+    def hold_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+        release.wait(5)
+
+    event.listen(db.engine, 'before_cursor_execute', hold_statement)
+    try:
+        release.set()
+        expected = get_competition_json(1)
+        single_call = len(statements)
+        statements.clear()
+        release.clear()
+
+        def fetch():
+            with app.app_context():
+                results.append(get_competition_json(1))
+
+        key = 'singleflight_coalesced{function=get_competition_json}'
+        coalesced = metrics.snapshot()['counters'].get(key, 0)
+        results = []
+        threads = [threading.Thread(target=fetch) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+
+        # release the leader once every other caller is waiting on it
+        deadline = time.monotonic() + 5
+        while metrics.snapshot()['counters'].get(key, 0) < coalesced + 19 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', hold_statement)
+
+    assert single_call > 0
+    assert len(statements) == single_call
+    assert results == [expected] * 20
+
+
+def test_get_competition_route(empty_db):
+    response = empty_db.get('/competitions/1')
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Walktime'
+    assert empty_db.get('/competitions/9999').status_code == 404
+
+
+def test_live_competition_stream(empty_db):
+    broker = empty_db.application.extensions['pubsub']
+    create_competition("Live Comp", "Couva")
+    comp_id = Competition.query.filter_by(name="Live Comp").first().id
+    create_user("live_a", "livepass")
+    create_user("live_b", "livepass")
+    user_a, user_b = get_user_by_username("live_a").id, get_user_by_username("live_b").id
+
+    response = empty_db.get(f'/competitions/{comp_id}/live', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    stream = iter(response.response)
+    assert next(stream).startswith(b'event: snapshot')
+
+    add_results(user_a, comp_id, 10)
+    add_results(user_b, comp_id, 20)
+    assert f'"user_id": {user_a}, "position": 1'.encode() in next(stream)
+    changes = next(stream)
+    assert f'"user_id": {user_b}, "position": 1, "previous_position": null'.encode() in changes
+    assert f'"user_id": {user_a}, "position": 2, "previous_position": 1'.encode() in changes
+
+    # a new score that keeps everyone in place is not pushed
+    assert update_user_competition_rank(user_b, comp_id, 25) is None
+    assert broker.publish_standings(f'competition:{comp_id}', [{'user_id': user_b, 'score': 25}, {'user_id': user_a, 'score': 10}]) == []
+
+    response.close()
+    assert broker.subscriber_count() == 0
+    # nobody is listening any more, so nothing is queried or kept for the channel
+    assert f'competition:{comp_id}' not in broker.standings
+    statements = []
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        assert publish_competition_standings(comp_id) == []
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+    assert statements == []
+
+
+def test_shared_broker_follows_other_workers(tmp_path):
+    path = str(tmp_path / 'pubsub.db')
+    first, second = Broker(SQLiteChannel(path, poll_interval=0.01)), Broker(SQLiteChannel(path, poll_interval=0.01))
+    # a worker without subscribers still publishes, so it keeps its standings current too
+    assert second.subscriber_count() == 0 and second.has_subscribers('competition:1')
+
+    standings = [{'user_id': 1, 'score': 10}, {'user_id': 2, 'score': 5}]
+    assert len(first.publish_standings('competition:1', standings)) == 2
+    deadline = time.monotonic() + 5
+    while second.standings.get('competition:1') != {1: 1, 2: 2} and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert second.standings['competition:1'] == {1: 1, 2: 2}
+    # the same standings computed in the other worker are not pushed a second time
+    assert second.publish_standings('competition:1', standings) == []
+
+
+def test_segmented_rankings_route(empty_db):
+    create_competition("Segment Comp", "Chaguanas")
+    comp = Competition.query.filter_by(name="Segment Comp").first()
+    create_user("segment_a", "segpass")
+    create_user("segment_b", "segpass")
+    user_a, user_b = get_user_by_username("segment_a").id, get_user_by_username("segment_b").id
+    add_results(user_a, comp.id, 10)
+    add_results(user_b, comp.id, 30)
+    update_overall_rankings(get_top_20_users_in_competition(comp.id))
+
+    response = empty_db.get('/rankings?location=Chaguanas&window=month')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['bucket'] == comp.date.strftime('%Y-%m')
+    assert [(entry['user_id'], entry['points']) for entry in body['standings']] == [(user_b, 20), (user_a, 19)]
+
+    everywhere = empty_db.get('/rankings?window=week').get_json()['standings']
+    assert {user_a, user_b} <= {entry['user_id'] for entry in everywhere}
+    assert empty_db.get('/rankings?location=Chaguanas&window=season&bucket=1999').get_json()['standings'] == []
+    assert empty_db.get('/rankings?window=decade').status_code == 400
+
+
+def test_live_scoring_matches_rebuild(empty_db):
+    create_competition("Scoring Comp", "Arima")
+    comp = Competition.query.filter_by(name="Scoring Comp").first()
+    for name, score in (("scoring_a", 40), ("scoring_b", 20), ("scoring_c", 30)):
+        create_user(name, "scorepass")
+        add_results(get_user_by_username(name).id, comp.id, score)
+    ids = [get_user_by_username(name).id for name in ("scoring_a", "scoring_b", "scoring_c")]
+
+    # results only earn points once their competition is scored
+    rebuild_overall_rankings('linear')
+    assert [User.query.get(user_id).overall_rank for user_id in ids] == [0, 0, 0]
+
+    assert score_competition(comp.id, 'linear') == 3
+    assert score_competition(comp.id, 'linear') == 0
+    live = [User.query.get(user_id).overall_rank for user_id in ids]
+    assert live == [20, 18, 19]
+
+    # a later change only moves the difference, and the rebuild lands on the same totals
+    update_user_competition_rank(ids[1], comp.id, 50)
+    assert score_competition(comp.id, 'linear') == 3
+    live = [User.query.get(user_id).overall_rank for user_id in ids]
+    assert live == [19, 20, 18]
+    segment = empty_db.get('/rankings?location=Arima&window=month').get_json()['standings']
+    assert set(ids) <= {entry['user_id'] for entry in segment}
+    rebuild_overall_rankings('linear')
+    assert [User.query.get(user_id).overall_rank for user_id in ids] == live
+    assert empty_db.get('/rankings?location=Arima&window=month').get_json()['standings'] == segment
+
+
+def test_replay_result_events(empty_db):
+    create_competition("Replay Comp", "Tunapuna")
+    comp = Competition.query.filter_by(name="Replay Comp").first()
+    create_user("replay_a", "replaypass")
+    create_user("replay_b", "replaypass")
+    user_a, user_b = get_user_by_username("replay_a").id, get_user_by_username("replay_b").id
+    add_results(user_a, comp.id, 10)
+    add_results(user_b, comp.id, 20)
+    update_user_competition_rank(user_a, comp.id, 30)
+    assert replay_events() != {}
+    head = get_log_head()
+
+    # derived state drifts, replaying the events after the checkpoint puts it back
+    UserCompetition.query.filter_by(user_id=user_a, comp_id=comp.id).update({UserCompetition.rank: 1})
+    UserCompetition.query.filter_by(user_id=user_b, comp_id=comp.id).delete()
+    Competition.query.filter_by(id=comp.id).update({Competition.participant_count: 7})
+    db.session.commit()
+    assert replay_events() == {}
+    replayed = replay_events(from_offset=head - 3)
+    assert replayed['standings'] == (head - 3, head, 3)
+
+    ranks = {result.user_id: result.rank for result in UserCompetition.query.filter_by(comp_id=comp.id)}
+    assert ranks == {user_a: 30, user_b: 20}
+    assert get_competition_by_id(comp.id).participant_count == 2
+    assert get_checkpoints() == {'standings': head, 'stats': head, 'overall': head}
+
+    # live writes keep standings and stats current themselves, they are always at the head
+    delete_result(user_b, comp.id)
+    assert replay_events(projections=['standings']) == {}
+    assert get_checkpoints() == {'standings': head + 1, 'stats': head + 1, 'overall': head}
+    assert replay_events(projections=['overall']) == {'overall': (head, head + 1, 1)}
+
+    # results from before the log are backfilled once and never deleted by a replay
+    create_user("replay_c", "replaypass")
+    legacy = UserCompetition(user_id=get_user_by_username("replay_c").id, comp_id=comp.id, rank=5)
+    db.session.add(legacy)
+    db.session.commit()
+    replay_events(from_offset=0)
+    assert UserCompetition.query.get(legacy.id) is not None
+    assert backfill_result_events() >= 1
+    assert backfill_result_events() == 0
+    with pytest.raises(ValueError):
+        replay_events(projections=['unknown'])
+
+
+def test_import_results_resumes(empty_db, tmp_path):
+    create_competition("Import Comp", "Sangre Grande")
+    comp_id = Competition.query.filter_by(name="Import Comp").first().id
+    user_ids = []
+    for i in range(10):
+        create_user(f"import_{i}", "importpass")
+        user_ids.append(get_user_by_username(f"import_{i}").id)
+    user_id = user_ids[0]
+
+    path = tmp_path / "results.csv"
+    lines = [f"{user},{comp_id},{rank}" for rank, user in enumerate(user_ids, start=1)] + [f"{user_id},99999,5", "not,a,row"]
+    path.write_text("user_id,comp_id,rank\n" + "\n".join(lines) + "\n")
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt(checkpoint, total_bytes):
+        raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        import_results(str(path), chunk_size=4, progress=interrupt)
+    assert get_competition_by_id(comp_id).participant_count == 4
+
+    checkpoint = import_results(str(path), chunk_size=4)
+    assert checkpoint.finished
+    assert (checkpoint.rows_imported, checkpoint.rows_skipped) == (10, 2)
+    assert get_competition_by_id(comp_id).participant_count == 10
+    assert get_competition_by_id(comp_id).top_score == 10
+    assert verify_counters(repair=False) == []
+
+    # importing the file again leaves one result per user
+    import_results(str(path), chunk_size=4, restart=True)
+    assert get_competition_by_id(comp_id).participant_count == 10
+    assert UserCompetition.query.filter_by(comp_id=comp_id).count() == 10
+
+    # an existing result is updated instead of duplicated
+    jsonl = tmp_path / "results.jsonl"
+    jsonl.write_text(json.dumps({'user_id': user_id, 'comp_id': comp_id, 'rank': 50}) + "\n")
+    assert import_results(str(jsonl)).rows_imported == 1
+    assert get_competition_by_id(comp_id).top_score == 50
+    assert get_competition_by_id(comp_id).participant_count == 10
+    assert verify_counters(repair=False) == []
+
+    array = tmp_path / "results.json"
+    array.write_text(json.dumps([{'user_id': user_id, 'comp_id': comp_id, 'rank': 60}]))
+    with pytest.raises(ValueError):
+        import_results(str(array))
+
+
+def test_results_snapshot(empty_db):
+    app = empty_db.application
+    app.config['RESULTS_SNAPSHOT_CHECK_INTERVAL'] = 0
+    create_competition("Snapshot Comp", "Point Fortin")
+    comp_id = Competition.query.filter_by(name="Snapshot Comp").first().id
+    create_user("snapshot_a", "snappass")
+    create_user("snapshot_b", "snappass")
+    user_a, user_b = get_user_by_username("snapshot_a").id, get_user_by_username("snapshot_b").id
+    add_results(user_a, comp_id, 40)
+    rebuild_results_snapshot()
+
+    snapshot = get_results_snapshot()
+    assert snapshot.competition_scores(comp_id).tolist() == [40]
+    response = empty_db.get(f'/competitions/{comp_id}/rankings/{user_a}')
+    assert response.get_json()['position'] == 1
+
+    # a new result moves the generation, reads keep the old snapshot while it is rebuilt in the background
+    add_results(user_b, comp_id, 60)
+    assert empty_db.get(f'/competitions/{comp_id}/rankings/{user_a}').get_json()['position'] == 1
+    app.extensions['results_snapshot'].rebuilding.join(5)
+    assert empty_db.get(f'/competitions/{comp_id}/rankings/{user_a}').get_json()['position'] == 2
+    assert empty_db.get(f'/competitions/{comp_id}/rankings/{user_a + user_b}').status_code == 404
+    assert not snapshot.is_current()
+
+    other_worker = ResultsSnapshot(app.extensions['results_snapshot'].path)
+    assert other_worker.competition_scores(comp_id).tolist() == [60, 40]
+    comp_ids, scores = other_worker.user_results(user_b)
+    assert (comp_ids.tolist(), scores.tolist()) == ([comp_id], [60])
+    assert other_worker.scores.dtype == '<i8'
+
+    # a replay that changes results appends no event but still moves the generation
+    generation = get_results_snapshot().generation
+    UserCompetition.query.filter_by(user_id=user_b, comp_id=comp_id).update({UserCompetition.rank: 1})
+    db.session.commit()
+    replay_events(from_offset=0, projections=['standings'])
+    get_results_snapshot()
+    app.extensions['results_snapshot'].rebuilding.join(5)
+    assert get_results_snapshot().generation > generation
+    assert get_results_snapshot().competition_scores(comp_id).tolist() == [60, 40]
+
+
+def test_competition_stats_route(empty_db):
+    create_competition("Stats Comp", "Siparia")
+    comp_id = Competition.query.filter_by(name="Stats Comp").first().id
+    user_ids = []
+    for i in range(1, 11):
+        create_user(f"stats_{i}", "statspass")
+        user_ids.append(get_user_by_username(f"stats_{i}").id)
+        add_results(user_ids[-1], comp_id, i * 10)
+
+    stats = empty_db.get(f'/competitions/{comp_id}/stats?bins=0,50,100&user_id={user_ids[2]}').get_json()
+    assert (stats['count'], stats['mean'], stats['median'], stats['max']) == (10, 55, 55, 100)
+    assert stats['p90'] == pytest.approx(91)
+    assert stats['histogram'] == {'edges': [0, 50, 100], 'counts': [4, 6]}
+    assert stats['user'] == {'user_id': user_ids[2], 'score': 30, 'percentile': 20}
+
+    # a result write bumps the revision, so the cached distribution is not served again
+    update_user_competition_rank(user_ids[0], comp_id, 1000)
+    stats = empty_db.get(f'/competitions/{comp_id}/stats?bins=2').get_json()
+    assert stats['max'] == 1000
+    assert stats['histogram']['counts'] == [9, 1]
+
+    # custom edges are not kept, a client cycling through them can not grow the cache
+    revision = get_competition_by_id(comp_id).revision
+    for high in range(101, 111):
+        assert empty_db.get(f'/competitions/{comp_id}/stats?bins=0,{high}').status_code == 200
+    assert list(stats_cache[(comp_id, revision)]['histograms']) == [2]
+
+    assert empty_db.get(f'/competitions/{comp_id}/stats?bins=5,1').status_code == 400
+    assert empty_db.get('/competitions/9999/stats').status_code == 404
+
+
+def test_response_compression(empty_db):
+    plain = empty_db.get('/api/users', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in plain.headers
+
+    app = empty_db.application
+    app.config['COMPRESS_MIN_SIZE'] = 100
+    try:
+        hits = metrics.snapshot()['counters'].get('compression_cache_hits{encoding=gzip}', 0)
+        first = empty_db.get('/api/users', headers={'Accept-Encoding': 'gzip;q=1, br;q=0'})
+        second = empty_db.get('/api/users', headers={'Accept-Encoding': 'gzip'})
+        assert first.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(first.data) == plain.data
+        assert second.data == first.data
+        assert metrics.snapshot()['counters']['compression_cache_hits{encoding=gzip}'] == hits + 1
+        assert 'Accept-Encoding' in first.headers['Vary']
+
+        etag = first.headers['ETag']
+        assert etag != plain.headers['ETag']
+        assert empty_db.get('/api/users', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+        app.config['COMPRESS_MIN_SIZE'] = len(plain.data) + 1
+        assert 'Content-Encoding' not in empty_db.get('/api/users', headers={'Accept-Encoding': 'gzip'}).headers
+    finally:
+        app.config['COMPRESS_MIN_SIZE'] = 1024
+
+
+def test_batch_requests(empty_db):
+    comp_id = Competition.query.filter_by(name="Stats Comp").first().id
+    user_id = get_user_by_username("stats_1").id
+    paths = [f'/competitions/{comp_id}', f'/rankings/{user_id}', f'/users/competitions/{user_id}', f'/competitions/{comp_id}', '/competitions/9999']
+
+    executed = metrics.snapshot()['counters'].get('batch_subrequests', 0)
+    response = empty_db.post('/batch', json={'requests': paths})
+    assert response.status_code == 200
+    responses = response.get_json()['responses']
+    assert [entry['path'] for entry in responses] == paths
+    assert responses[0]['body'] == empty_db.get(paths[0]).get_json()
+    assert responses[1]['body'] == empty_db.get(paths[1]).get_json()
+    assert responses[3] == responses[0]
+    assert responses[4]['status'] == 404
+    assert metrics.snapshot()['counters']['batch_subrequests'] == executed + 4
+
+    # only reads of the competition and user routes can be batched
+    live = empty_db.post('/batch', json={'requests': [f'/competitions/{comp_id}/live', '/metrics', '/nowhere']}).get_json()['responses']
+    assert [entry['status'] for entry in live] == [400, 400, 404]
+    assert empty_db.post('/batch', json={'requests': 'not a list'}).status_code == 400
+
+
+def test_sparse_fieldsets_and_expand(empty_db):
+    comp = Competition.query.filter_by(name="Stats Comp").first()
+    user = get_user_by_username("stats_2")
+
+    statements = []
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        listing = empty_db.get('/competitions?fields=name,location').get_json()
+        listing_statements = list(statements)
+        statements.clear()
+        expanded = empty_db.get(f'/competitions/{comp.id}?fields=participants&expand=participants.user').get_json()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+    assert all(set(entry) == {'id', 'name', 'location'} for entry in listing)
+    # trimmed listings never touch the result and host tables
+    assert not [statement for statement in listing_statements if 'user_competition' in statement or 'competition_host' in statement]
+    assert set(expanded) == {'id', 'participants'}
+    participant = next(entry for entry in expanded['participants'] if entry['user_id'] == user.id)
+    assert participant['user'] == {'id': user.id, 'username': 'stats_2'}
+    # the competition, its participants and their users are one query each, whatever the number of participants
+    assert len(statements) == 3
+
+    ranks = empty_db.get(f'/rankings/{user.id}?fields=rank&expand=competition').get_json()
+    assert ranks == [{'id': ranks[0]['id'], 'rank': 20, 'competition': comp.get_listing_json() | {'date': ranks[0]['competition']['date']}}]
+    assert empty_db.get(f'/users/competitions/{user.id}?fields=name').get_json() == [{'id': comp.id, 'name': 'Stats Comp'}]
+    assert empty_db.get('/competitions?fields=secret').status_code == 400
+    assert empty_db.get('/competitions').status_code == 200
+
+
+def test_write_behind_rank_updates(empty_db, tmp_path):
+    app = empty_db.application
+    comp = Competition.query.filter_by(name="Stats Comp").first()
+    second, third = get_user_by_username("stats_2"), get_user_by_username("stats_3")
+    app.extensions['score_buffer'] = ScoreBuffer(str(tmp_path))
+    try:
+        for rank in (1800, 1900, 2000):
+            update_user_competition_rank(second.id, comp.id, rank)
+        update_user_competition_rank(third.id, comp.id, 1500)
+
+        # nothing reached the database, but reads see the buffered ranks
+        assert db.session.query(UserCompetition.rank).filter_by(user_id=second.id, comp_id=comp.id).scalar() == 20
+        assert empty_db.get(f'/rankings/{second.id}?fields=rank').get_json()[0]['rank'] == 2000
+        assert [entry['user_id'] for entry in get_competition_standings(comp.id)[:3]] == [second.id, third.id, get_user_by_username("stats_1").id]
+
+        statements = []
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            assert flush_buffered_ranks() == 2
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        # the latest rank per user, written with a single batched UPDATE
+        assert len([statement for statement in statements if statement.startswith('UPDATE user_competition')]) == 1
+        assert db.session.query(UserCompetition.rank).filter_by(user_id=second.id, comp_id=comp.id).scalar() == 2000
+        assert flush_buffered_ranks() == 0
+
+        # a worker that dies before flushing leaves its journal behind for the next one
+        crashed = ScoreBuffer(str(tmp_path))
+        crashed.put(comp.id, third.id, 1600)
+        crashed.journal.close()
+        assert app.extensions['score_buffer'].recover() == 1
+        assert flush_buffered_ranks() == 1
+        assert db.session.query(UserCompetition.rank).filter_by(user_id=third.id, comp_id=comp.id).scalar() == 1600
+        assert [path.name for path in tmp_path.iterdir()] == [os.path.basename(app.extensions['score_buffer'].journal_path)]
+
+        # a crash mid-flush leaves a .flushing journal too, the newer live journal wins
+        crashed = ScoreBuffer(str(tmp_path), sync=True)
+        crashed.put(comp.id, third.id, 1650)
+        crashed.take()
+        crashed.put(comp.id, third.id, 1700)
+        crashed.journal.close()
+        crashed.flushing_journal[1].close()
+        assert app.extensions['score_buffer'].recover() == 2
+        assert app.extensions['score_buffer'].buffered(comp.id) == {third.id: 1700}
+        assert flush_buffered_ranks() == 1
+    finally:
+        app.extensions.pop('score_buffer')
+
+
+def test_concurrent_journal_recovery(tmp_path, monkeypatch):
+    crashed = ScoreBuffer(str(tmp_path))
+    crashed.put(1, 1, 1600)
+    crashed.put(1, 2, 1700)
+    crashed.journal.close()
+    first, second = ScoreBuffer(str(tmp_path)), ScoreBuffer(str(tmp_path))
+
+    # the second worker opens the journal, then the first recovers and removes it before the lock
+    opened = []
+    def open_then_lose_race(path, *args):
+        journal = open(path, *args)
+        if path == crashed.journal_path and not opened:
+            opened.append(path)
+            assert first.recover() == 2
+        return journal
+    monkeypatch.setattr(writebehind, 'open', open_then_lose_race, raising=False)
+    assert second.recover() == 0
+    assert opened == [crashed.journal_path]
+    monkeypatch.undo()
+
+    # a journal that is gone by the time a worker opens it is skipped
+    monkeypatch.setattr(writebehind.glob, 'glob', lambda pattern: [crashed.journal_path])
+    assert second.recover() == 0
+    assert first.buffered(1) == {1: 1600, 2: 1700} and second.buffered(1) == {}
+    first.take(), first.done(True), first.close(), second.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_structured_request_logs(empty_db):
+    create_competition("Log Comp", "Arima")
+    comp = Competition.query.filter_by(name="Log Comp").first()
+    create_user("log_user", "logpass")
+    user = get_user_by_username("log_user")
+
+    lines = []
+    capture = logging.Handler()
+    capture.setFormatter(logs.JSONFormatter())
+    capture.emit = lambda record: lines.append(json.loads(capture.format(record)))
+    handlers = logs.listener.handlers
+    logs.listener.handlers = handlers + (capture,)
+    try:
+        response = empty_db.post('/competitions/results', json={'user_id': user.id, 'comp_id': comp.id, 'rank': 7},
+                                 headers={'X-Request-ID': 'req-log-1'})
+        assert response.headers['X-Request-ID'] == 'req-log-1'
+        # records are written by the listener thread, after the response went out
+        deadline = time.time() + 2
+        while not lines and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        logs.listener.handlers = handlers
+
+    assert lines[0]['event'] == 'result_added'
+    assert lines[0]['logger'] == 'App.controllers.competition'
+    assert (lines[0]['request_id'], lines[0]['user_id'], lines[0]['comp_id'], lines[0]['rank']) == ('req-log-1', user.id, comp.id, 7)
+
+    sampler = logs.SamplingFilter({'result_added': 0.0})
+    assert not sampler.filter(logging.makeLogRecord({'msg': 'result_added', 'levelno': logging.INFO}))
+    assert sampler.filter(logging.makeLogRecord({'msg': 'result_added', 'levelno': logging.ERROR}))
+
+    # stopping twice, as an explicit stop followed by the exit hook does, is harmless
+    running = logs.listener
+    logs.listener = logging.handlers.QueueListener(queue.Queue())
+    logs.listener.start()
+    try:
+        logs.stop_listener()
+        logs.stop_listener()
+        assert logs.listener is None
+    finally:
+        logs.listener = running
+
+
+def test_request_profiling(tmp_path):
+    from flask import Flask
+    app = Flask(__name__)
+    app.config.update(PROFILE_ENABLED=True, PROFILE_TOKEN='profile-secret', PROFILE_DIR=str(tmp_path), PROFILE_KEEP=2)
+
+    def busy():
+        return {'total': sum(i * i for i in range(20000))}
+    app.add_url_rule('/busy', 'busy', busy)
+    setup_profiling(app)
+    client = app.test_client()
+
+    assert 'X-Profile-Id' not in client.get('/busy').headers
+    assert 'X-Profile-Id' not in client.get('/busy', headers={'X-Profile': 'wrong'}).headers
+    names = [client.get('/busy', headers={'X-Profile': 'profile-secret'}).headers['X-Profile-Id'] for _ in range(3)]
+    # only the newest PROFILE_KEEP profiles are kept
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(names[1:])
+
+    assert client.get(f'/profiles/{names[-1]}').status_code == 403
+    download = client.get(f'/profiles/{names[-1]}', headers={'X-Profile': 'profile-secret'})
+    assert download.status_code == 200 and download.data == (tmp_path / names[-1]).read_bytes()
+
+    count, stats = aggregate_profiles(str(tmp_path))['busy']
+    assert count == 2
+    assert any('busy' in function for function, calls, own, cumulative in top_functions(stats, limit=5))
+
+    # disabled, not even the hooks are installed
+    plain = Flask(__name__)
+    setup_profiling(plain)
+    assert not plain.before_request_funcs and not plain.after_request_funcs
+
+
+def test_slow_query_log(empty_db, tmp_path):
+    user = get_user_by_username("stats_2")
+    path = str(tmp_path / 'slow.log')
+    # every statement counts as slow with a zero threshold
+    log = SlowQueryLog(path, threshold_ms=0)
+    log.install(db.engine)
+    try:
+        get_user_rankings(user.id)
+        get_user_rankings(user.id)
+    finally:
+        log.remove(db.engine)
+
+    entries = [entry for entry in read_slow_queries(path) if entry['statement'].startswith('SELECT user_competition.')]
+    assert len(entries) == 2
+    assert entries[0]['origin'] == 'user.get_user_rankings'
+    assert entries[0]['parameters'] == [repr(user.id)]
+    # the plan is captured once per statement shape
+    assert 'plan' in entries[0] and 'plan' not in entries[1]
+
+    summary = next(summary for summary in summarize_slow_queries(read_slow_queries(path)) if summary['shape_id'] == entries[0]['shape_id'])
+    assert summary['count'] == 2 and summary['origins'] == {'user.get_user_rankings'}
+    assert full_scans('SCAN user\nSEARCH competition USING INDEX ix_name (name=?)\nSCAN result USING INDEX ix_comp') == ['user']
+
+    # entries are written by the background writer, closing again is harmless
+    assert isinstance(log.logger.handlers[0], logs.NonBlockingQueueHandler)
+    log.close()
+
+    # PostgreSQL plans only run the statement again with ANALYZE switched on
+    class PlanCursor:
+        executed = []
+        connection = property(lambda self: self)
+        def cursor(self):
+            return self
+        def execute(self, statement, parameters):
+            self.executed.append(statement)
+        def fetchall(self):
+            return [('Seq Scan on user',)]
+        def close(self):
+            pass
+    explain(PlanCursor(), 'postgresql', 'SELECT * FROM user', ())
+    explain(PlanCursor(), 'postgresql', 'SELECT * FROM user', (), analyze=True)
+    assert PlanCursor.executed == ['EXPLAIN SELECT * FROM user', 'EXPLAIN ANALYZE SELECT * FROM user']
+
+
+def test_replay_authenticated_entry(empty_db):
+    create_user("replay_auth", "replaypass")
+    user = get_user_by_username("replay_auth")
+    entry = {'time': 0, 'method': 'GET', 'path': '/api/identify', 'query': {}, 'endpoint': 'identify_user_action',
+             'content': None, 'body': None, 'authenticated': True, 'status': 200, 'streamed': False}
+    with empty_db.application.test_request_context():
+        auth_header = f'Bearer {jwt_token_for(user)}'
+    assert replay_trace(empty_db, [entry], speed=0, auth_header=auth_header)[0][1] == 200
+    assert replay_trace(empty_db, [entry], speed=0)[0][1] == 401
+
+
+def test_traffic_capture_and_replay(tmp_path):
+    from flask import Flask, request as flask_request
+    app = Flask(__name__)
+    app.config.update(TRAFFIC_CAPTURE_ENABLED=True, TRAFFIC_CAPTURE_RATE=1.0, TRAFFIC_CAPTURE_FILE=str(tmp_path / 'trace.jsonl'))
+    app.add_url_rule('/login', 'login', lambda: ('ok' if flask_request.form.get('username') else 'missing', 200), methods=['POST'])
+    app.add_url_rule('/results', 'results', lambda: ({'rank': flask_request.json['rank']}, 201), methods=['POST'])
+    app.add_url_rule('/search', 'search', lambda: {'q': flask_request.args.get('q')})
+    listener = setup_traffic_capture(app)
+    client = app.test_client()
+
+    client.post('/login', data={'username': 'bob', 'password': 'bobpass'})
+    client.post('/results', json={'user_id': 4, 'rank': 12, 'comment': 'fast', 'token': 'abc'}, headers={'Authorization': 'Bearer secret'})
+    client.get('/search?q=cod&api_key=k')
+    listener.stop()
+
+    trace = read_trace(str(tmp_path / 'trace.jsonl'))
+    assert [entry['endpoint'] for entry in trace] == ['login', 'results', 'search']
+    # credentials never reach the trace
+    raw = (tmp_path / 'trace.jsonl').read_text()
+    assert 'bobpass' not in raw and 'secret' not in raw and 'abc' not in raw
+    assert trace[0]['body'] == {'username': '<str:3>'}
+    assert trace[1]['body'] == {'user_id': 4, 'rank': 12, 'comment': '<str:4>'} and trace[1]['authenticated']
+    assert trace[2]['query'] == {'q': 'cod'}
+
+    samples = replay_trace(client, trace * 3, speed=0)
+    assert [status for endpoint, status, recorded, ms in samples[:3]] == [200, 201, 200]
+    summary = latency_summary(samples)
+    assert summary['results']['count'] == 3 and summary['results']['status_changes'] == 0
+
+    baseline = {name: dict(stats, p50=stats['p50'] / 10) for name, stats in summary.items()}
+    baseline['search']['p50'] = summary['search']['p50'] * 10
+    regressed = {endpoint: flag for endpoint, p50, base, delta, flag in compare_to_baseline(summary, baseline)}
+    assert regressed == {'login': True, 'results': True, 'search': False}
@@ -0,0 +1,141 @@
+import json, logging, logging.handlers, os, queue, random, re, time
+import numpy as np
+from flask import g, request
+
+from App.logs import NonBlockingQueueHandler
+
+# Traffic capture for replay. With TRAFFIC_CAPTURE_ENABLED on, a TRAFFIC_CAPTURE_RATE
+# fraction of requests is appended to TRAFFIC_CAPTURE_FILE as JSON lines by a background
+# writer. Credentials never reach the file: authorization headers are reduced to a flag,
+# secret-looking fields are dropped and other strings are kept as <str:length> only.
+
+SECRET_FIELDS = re.compile(r'pass|token|secret|auth|jwt|key', re.IGNORECASE)
+STRING_PLACEHOLDER = re.compile(r'^<str:(\d+)>$')
+
+def body_shape(value):
+    """A request body with secrets dropped and strings replaced by their length, numbers and ids are kept."""
+    if isinstance(value, dict):
+        return {key: body_shape(item) for key, item in value.items() if not SECRET_FIELDS.search(str(key))}
+    if isinstance(value, list):
+        return [body_shape(item) for item in value]
+    if isinstance(value, str):
+        return f'<str:{len(value)}>'
+    return value
+
+def build_body(shape):
+    """A deterministic body of the recorded shape, placeholders become strings of the same length."""
+    if isinstance(shape, dict):
+        return {key: build_body(item) for key, item in shape.items()}
+    if isinstance(shape, list):
+        return [build_body(item) for item in shape]
+    if isinstance(shape, str):
+        match = STRING_PLACEHOLDER.match(shape)
+        return 'x' * int(match.group(1)) if match else shape
+    return shape
+
+def capture_entry(response, started):
+    if request.is_json:
+        content, body = 'json', body_shape(request.get_json(silent=True))
+    elif request.form:
+        content, body = 'form', body_shape(request.form.to_dict())
+    else:
+        content, body = None, None
+    return {
+        'time': started,
+        'method': request.method,
+        'path': request.path,
+        'query': {key: value for key, value in request.args.items() if not SECRET_FIELDS.search(key)},
+        'endpoint': request.endpoint,
+        'content': content,
+        'body': body,
+        'authenticated': 'Authorization' in request.headers,
+        'status': response.status_code,
+        'streamed': response.is_streamed,
+        'duration_ms': round((time.time() - started) * 1000, 2),
+    }
+
+def setup_traffic_capture(app):
+    if not app.config.get('TRAFFIC_CAPTURE_ENABLED', False):
+        return None
+    rate = app.config.get('TRAFFIC_CAPTURE_RATE', 0.1)
+    path = app.config.get('TRAFFIC_CAPTURE_FILE') or os.path.join(app.instance_path, 'traffic.jsonl')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    output = logging.FileHandler(path, delay=True)
+    output.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.Queue(10000)
+    # a standalone logger, the lines go to the trace file only
+    writer = logging.Logger('traffic')
+    writer.addHandler(NonBlockingQueueHandler(records))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    app.extensions['traffic_capture'] = listener
+
+    @app.before_request
+    def start_capture():
+        if random.random() < rate:
+            g.capture_started = time.time()
+
+    @app.after_request
+    def capture_request(response):
+        started = g.pop('capture_started', None)
+        if started is not None:
+            writer.info(json.dumps(capture_entry(response, started), default=str))
+        return response
+
+    return listener
+
+def read_trace(path):
+    with open(path) as trace:
+        return [json.loads(line) for line in trace if line.strip()]
+
+def replay_trace(client, entries, speed=1.0, auth_header=None):
+    """
+    Send the requests of a trace through client, spaced as they were recorded divided by
+    speed (0 sends them back to back). Streamed responses are skipped.
+    Returns (endpoint, status, recorded_status, milliseconds) per request.
+    """
+    samples = []
+    entries = [entry for entry in entries if not entry.get('streamed')]
+    if not entries:
+        return samples
+    first, start = entries[0]['time'], time.perf_counter()
+    for entry in entries:
+        if speed:
+            wait = (entry['time'] - first) / speed - (time.perf_counter() - start)
+            if wait > 0:
+                time.sleep(wait)
+        headers = {'Authorization': auth_header} if entry['authenticated'] and auth_header else {}
+        body = build_body(entry['body'])
+        sent = time.perf_counter()
+        response = client.open(entry['path'], method=entry['method'], query_string=entry['query'], headers=headers,
+                               json=body if entry['content'] == 'json' else None,
+                               data=body if entry['content'] == 'form' else None)
+        samples.append((entry['endpoint'] or entry['path'], response.status_code, entry['status'], (time.perf_counter() - sent) * 1000))
+    return samples
+
+def latency_summary(samples):
+    """Per endpoint {count, p50, p95, status_changes} in milliseconds."""
+    by_endpoint = {}
+    for endpoint, status, recorded_status, milliseconds in samples:
+        by_endpoint.setdefault(endpoint, []).append((milliseconds, status != recorded_status))
+    return {
+        endpoint: {
+            'count': len(timings),
+            'p50': round(float(np.percentile([ms for ms, changed in timings], 50)), 3),
+            'p95': round(float(np.percentile([ms for ms, changed in timings], 95)), 3),
+            'status_changes': sum(changed for ms, changed in timings),
+        }
+        for endpoint, timings in by_endpoint.items()
+    }
+
+def compare_to_baseline(summary, baseline, tolerance=0.2):
+    """
+    (endpoint, p50, baseline_p50, delta, regressed) per endpoint, slowest delta first.
+    An endpoint regressed when its median grew by more than tolerance over the baseline.
+    """
+    rows = []
+    for endpoint, stats in summary.items():
+        previous = baseline.get(endpoint, {}).get('p50')
+        delta = (stats['p50'] - previous) / previous if previous else None
+        rows.append((endpoint, stats['p50'], previous, delta, delta is not None and delta > tolerance))
+    return sorted(rows, key=lambda row: row[3] if row[3] is not None else float('-inf'), reverse=True)
@@ -4,7 +4,8 @@ from .user import user_views
 from .index import index_views
 from .auth import auth_views
 from .competition import comp_views
+from .batch import batch_views
 
 
-views = [user_views, index_views, auth_views, comp_views] 
+views = [user_views, index_views, auth_views, comp_views, batch_views] 
 # blueprints must be added to this list
\ No newline at end of file
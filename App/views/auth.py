@@ -1,13 +1,17 @@
 from flask import Blueprint, render_template, jsonify, request, send_from_directory, flash, redirect, url_for
-from flask_jwt_extended import jwt_required, current_user as jwt_current_user
+from datetime import datetime
+from flask_jwt_extended import jwt_required, get_jwt, current_user as jwt_current_user
 from flask_login import login_required, login_user, current_user, logout_user
 
 from.index import index_views
+from App.ratelimit import rate_limit
 
 from App.controllers import (
     create_user,
     jwt_authenticate,
     get_all_users,
+    get_users_page,
+    revoke_token,
     login 
 )
 
@@ -22,7 +26,8 @@ Page/Action Routes
 
 @auth_views.route('/users', methods=['GET'])
 def get_user_page():
-    users = get_all_users()
+    page = request.args.get('page', 1, type=int)
+    users = get_users_page(page)
     return render_template('users.html', users=users)
 
 
@@ -43,8 +48,7 @@ def login_action():
 
 @auth_views.route('/logout', methods=['GET'])
 def logout_action():
-    data = request.form
-    user = login(data['username'], data['password'])
+    logout_user()
     return 'logged out!'
 
 '''
@@ -57,6 +61,7 @@ def get_users_action():
     return jsonify(users)
 
 @auth_views.route('/api/users', methods=['POST'])
+@rate_limit('create_user', rate=0.2, burst=5)
 def create_user_endpoint():
     data = request.json
     response = create_user(data['username'], data['password'])
@@ -65,6 +70,7 @@ def create_user_endpoint():
     return jsonify(error='error creating user'), 500
 
 @auth_views.route('/api/login', methods=['POST'])
+@rate_limit('login', rate=0.5, burst=10)
 def user_login_api():
   data = request.json
   token = jwt_authenticate(data['username'], data['password'])
@@ -72,6 +78,14 @@ def user_login_api():
     return jsonify(error='bad username or password given'), 401
   return jsonify(access_token=token)
 
+@auth_views.route('/api/logout', methods=['POST'])
+@jwt_required()
+def user_logout_api():
+    token = get_jwt()
+    expires_at = datetime.utcfromtimestamp(token['exp']) if 'exp' in token else None
+    revoke_token(token['jti'], expires_at)
+    return jsonify(message='logged out')
+
 @auth_views.route('/api/identify', methods=['GET'])
 @jwt_required()
 def identify_user_action():
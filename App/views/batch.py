@@ -0,0 +1,59 @@
+from flask import Blueprint, current_app, jsonify, request
+from werkzeug.exceptions import HTTPException
+
+from App.metrics import metrics
+
+batch_views = Blueprint('batch_views', __name__, template_folder='../templates')
+
+BATCH_BLUEPRINTS = ('comp_views', 'user_views')
+# server-sent event streams never finish, so they can not be part of a batch
+BATCH_EXCLUDED = ('comp_views.live_competition', 'comp_views.live_overall_rankings')
+
+def run_subrequest(path):
+    """
+    Dispatch a GET sub-request to its view inside the current app context (and so the
+    same DB session), forwarding the caller's credentials. Returns (status, body).
+    """
+    with current_app.test_request_context(path, method='GET', headers={'Authorization': request.headers.get('Authorization', '')}):
+        try:
+            adapter = current_app.url_map.bind_to_environ(request.environ)
+            endpoint, args = adapter.match(method='GET')
+            if endpoint.split('.')[0] not in BATCH_BLUEPRINTS or endpoint in BATCH_EXCLUDED:
+                return 400, {'error': f'{path} can not be batched'}
+            response = current_app.make_response(current_app.view_functions[endpoint](**args))
+        except HTTPException as e:
+            return e.code, {'error': e.description}
+        except Exception as e:
+            # errors with an app error handler (e.g. a missing JWT) get the usual response
+            try:
+                response = current_app.make_response(current_app.handle_user_exception(e))
+            except Exception:
+                current_app.logger.exception('batched request %s failed', path)
+                return 500, {'error': 'internal error'}
+    return response.status_code, response.get_json() if response.is_json else response.get_data(as_text=True)
+
+##run several read requests in one round trip, e.g. {"requests": ["/competitions/1", "/rankings/3"]}
+@batch_views.route('/batch', methods=['POST'])
+def batch_action():
+    data = request.get_json(silent=True) or {}
+    paths = data.get('requests')
+    if not isinstance(paths, list) or not all(isinstance(path, (str, dict)) for path in paths):
+        return jsonify({'error': 'requests must be a list of paths'}), 400
+    paths = [path if isinstance(path, str) else path.get('path') for path in paths]
+    if not all(isinstance(path, str) and path.startswith('/') for path in paths):
+        return jsonify({'error': 'every request needs a path starting with /'}), 400
+    if len(paths) > current_app.config.get('BATCH_MAX_REQUESTS', 50):
+        return jsonify({'error': f"at most {current_app.config.get('BATCH_MAX_REQUESTS', 50)} requests per batch"}), 400
+
+    # identical lookups run once and share their result
+    results = {}
+    for path in paths:
+        if path not in results:
+            results[path] = run_subrequest(path)
+    metrics.increment('batch_subrequests', len(results))
+    metrics.increment('batch_deduplicated', len(paths) - len(results))
+
+    return jsonify({'responses': [
+        {'path': path, 'status': results[path][0], 'body': results[path][1]}
+        for path in paths
+    ]}), 200
@@ -1,8 +1,11 @@
-from flask import Blueprint, render_template, jsonify, request, send_from_directory, flash, redirect, url_for
+import json, queue
+from datetime import datetime
+from flask import Blueprint, Response, current_app, render_template, jsonify, request, send_from_directory, flash, redirect, url_for
 from flask_jwt_extended import jwt_required, current_user as jwt_current_user
 from flask_login import current_user, login_required
 
 from.index import index_views
+from App.ratelimit import rate_limit
 
 from App.controllers import (
     # create_user,
@@ -13,22 +16,67 @@ from App.controllers import (
     create_competition,
     get_all_competitions_json,
     get_competition_by_id,
+    get_competition_json,
+    search_competitions_json,
+    suggest_competitions,
     add_results,
+    delete_result,
     get_user_rankings,
     add_user_to_comp,
+    get_competition_standings,
+    get_overall_standings,
+    get_leaderboard,
+    get_snapshot_position,
+    get_competition_stats,
+    parse_fieldset,
+    COMPETITION_FIELDS,
+    COMPETITION_EXPANSIONS,
+    RESULT_FIELDS,
+    RESULT_EXPANSIONS,
+    parse_bins,
     create_user, register_user_for_competition, update_user_competition_rank, manage_top_20_and_notify, update_top20_overall, notify_rank_changes, get_top_20_users_api
 )
 
 
 comp_views = Blueprint('comp_views', __name__, template_folder='../templates')
 
+def fieldset_args(fields, expansions):
+    # ?fields=name,location and ?expand=participants.user, raises ValueError for unknown names
+    return parse_fieldset(request.args.get('fields'), fields), parse_fieldset(request.args.get('expand'), expansions) or frozenset()
+
 
 ##return the json list of competitions fetched from the db
 @comp_views.route('/competitions', methods=['GET'])
 def get_competitons():
-    competitions = get_all_competitions_json()
+    try:
+        fields, expand = fieldset_args(COMPETITION_FIELDS, COMPETITION_EXPANSIONS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    competitions = get_all_competitions_json(fields, expand)
     return (jsonify(competitions),200) 
 
+##search competitions by name, location and date range
+@comp_views.route('/competitions/search', methods=['GET'])
+def search_comps():
+    try:
+        date_from = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        date_to = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates'}), 400
+
+    competitions = search_competitions_json(
+        q=request.args.get('q'),
+        location=request.args.get('location'),
+        date_from=date_from,
+        date_to=date_to
+    )
+    return (jsonify(competitions),200)
+
+##typeahead suggestions for competition names
+@comp_views.route('/competitions/suggest', methods=['GET'])
+def suggest_comps():
+    return (jsonify(suggest_competitions(request.args.get('q', ''))),200)
+
 ##add new competition to the db
 @comp_views.route('/competitions', methods=['POST'])
 @jwt_required()
@@ -42,6 +90,7 @@ def add_new_comp():
 
 @comp_views.route('/competitions/user', methods=['POST'])
 @jwt_required()
+@rate_limit('competition_user', rate=5, burst=20)
 def add_comp_user():
     data = request.json
 
@@ -61,20 +110,62 @@ def add_comp_user():
 
 @comp_views.route('/competitions/<int:id>', methods=['GET'])
 def get_competition(id):
-    print(id)
-    competition = get_competition_by_id(id)
+    try:
+        fields, expand = fieldset_args(COMPETITION_FIELDS, COMPETITION_EXPANSIONS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    competition = get_competition_json(id, fields, expand)
     if not competition:
         return jsonify({'error': 'competition not found'}), 404 
-    return (jsonify(competition.toDict()),200)
-
+    return (jsonify(competition),200)
+
+
+##top users per location and time window, e.g. /rankings?location=Arima&window=month
+@comp_views.route('/rankings', methods=['GET'])
+def get_segmented_rankings():
+    try:
+        leaderboard = get_leaderboard(
+            location=request.args.get('location'),
+            window=request.args.get('window', 'all'),
+            bucket=request.args.get('bucket'),
+            limit=max(1, min(request.args.get('limit', 20, type=int), 100))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return (jsonify(leaderboard),200)
+
+##score distribution of a competition, e.g. /competitions/1/stats?bins=0,10,50,100&user_id=3
+@comp_views.route('/competitions/<int:id>/stats', methods=['GET'])
+def get_competition_statistics(id):
+    try:
+        bins = parse_bins(request.args.get('bins'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    stats = get_competition_stats(id, bins, request.args.get('user_id', type=int))
+    if not stats:
+        return jsonify({'error': 'competition not found'}), 404
+    return (jsonify(stats),200)
+
+##a user's position in a competition, served from the shared results snapshot
+@comp_views.route('/competitions/<int:id>/rankings/<int:user_id>', methods=['GET'])
+def get_competition_position(id, user_id):
+    position = get_snapshot_position(id, user_id)
+    if not position:
+        return jsonify({'error': 'no result for this user in the competition'}), 404
+    return (jsonify(position),200)
 
 @comp_views.route('/rankings/<int:id>', methods =['GET'])
 def get_rankings(id):
-    ranks = get_user_rankings(id)
+    try:
+        fields, expand = fieldset_args(RESULT_FIELDS, RESULT_EXPANSIONS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    ranks = get_user_rankings(id, fields, expand)
     return (jsonify(ranks),200)
 
 #route to add result
 @comp_views.route('/competitions/results', methods=['POST'])
+@rate_limit('competition_results', rate=5, burst=20)
 def add_competition_results():
     data = request.json
 
@@ -93,6 +184,24 @@ def add_competition_results():
         return jsonify({'error': 'Error adding results'}), 500
 
 
+#route to delete a result
+@comp_views.route('/competitions/results', methods=['DELETE'])
+@jwt_required()
+def delete_competition_results():
+    data = request.json
+
+    user_id = data.get('user_id')
+    comp_id = data.get('comp_id')
+
+    if user_id is None or comp_id is None:
+        return jsonify({'error': 'Missing required parameters'}), 400
+
+    if delete_result(user_id, comp_id):
+        return jsonify({'message': 'results deleted successfully'}), 200
+    else:
+        return jsonify({'error': 'results not found'}), 404
+
+
 @comp_views.route('/top_20_users', methods=['GET'])
 def get_top_20_users_route():
     user_details = get_top_20_users_api()
@@ -101,3 +210,45 @@ def get_top_20_users_route():
         return jsonify({'top_20_users': user_details}), 200
     else:
         return jsonify({'error': 'Error retrieving top 20 users'}), 500
+
+
+'''
+Live leaderboards (Server-Sent Events)
+'''
+
+def sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def live_standings_response(channel, standings):
+    broker = current_app.extensions['pubsub']
+    # subscribe before sending the snapshot so no change in between is missed
+    subscription = broker.subscribe(channel)
+    broker.seed(channel, standings)
+
+    def stream():
+        try:
+            snapshot = [dict(entry, position=position) for position, entry in enumerate(standings, start=1)]
+            yield sse_message('snapshot', {'channel': channel, 'standings': snapshot})
+            while True:
+                try:
+                    message = subscription.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield sse_message('positions', message)
+        finally:
+            broker.unsubscribe(channel, subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@comp_views.route('/competitions/<int:id>/live', methods=['GET'])
+def live_competition(id):
+    if not get_competition_by_id(id):
+        return jsonify({'error': 'competition not found'}), 404
+    return live_standings_response(f'competition:{id}', get_competition_standings(id))
+
+@comp_views.route('/rankings/overall/live', methods=['GET'])
+def live_overall_rankings():
+    return live_standings_response('overall', get_overall_standings())
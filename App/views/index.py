@@ -1,6 +1,7 @@
 from flask import Blueprint, redirect, render_template, request, send_from_directory, jsonify
 from App.models import db
 from App.controllers import create_user
+from App.metrics import metrics
 
 index_views = Blueprint('index_views', __name__, template_folder='../templates')
 
@@ -21,4 +22,8 @@ def health_check():
 
 @index_views.route('/healthcheck', methods=['GET'])
 def health():
-    return jsonify({'status':'healthy'})
\ No newline at end of file
+    return jsonify({'status':'healthy'})
+
+@index_views.route('/metrics', methods=['GET'])
+def metrics_action():
+    return jsonify(metrics.snapshot())
@@ -6,16 +6,23 @@ from flask_login import login_required, login_user, current_user, logout_user
 
 
 from.index import index_views
+from .competition import fieldset_args
+from App.ratelimit import rate_limit
 
 from App.controllers import (
     create_user,
     jwt_authenticate, 
     get_all_users,
     get_all_users_json,
+    get_users_after_json,
+    get_users_count,
     jwt_required, 
     get_ranked_users,
     get_user_competitions,
-    login
+    get_user_summary,
+    login,
+    COMPETITION_FIELDS,
+    COMPETITION_EXPANSIONS
 
 )
 
@@ -28,10 +35,23 @@ user_views = Blueprint('user_views', __name__, template_folder='../templates')
 
 @user_views.route('/api/users', methods=['GET'])
 def get_users_action():
-    users = get_all_users_json()
-    return jsonify(users)
+    # ?limit=&after_id= returns one page, the total is sent with the first page only
+    if 'limit' not in request.args:
+        return jsonify(get_all_users_json())
+
+    # clamped to 1..1000, a zero or negative limit must not mean "everything"
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    after_id = request.args.get('after_id', 0, type=int)
+    users = get_users_after_json(after_id, limit)
+    response = jsonify(users)
+    if after_id == 0:
+        response.headers['X-Total-Count'] = str(get_users_count())
+    if users and len(users) == limit:
+        response.headers['X-Next-After-Id'] = str(users[-1]['id'])
+    return response
 
 @user_views.route('/api/users', methods=['POST'])
+@rate_limit('create_user', rate=0.2, burst=5)
 def create_user_endpoint():
     data = request.json
     response = create_user(data['username'], data['password'])
@@ -45,7 +65,7 @@ def create_user_action():
     data = request.form
     flash(f"User {data['username']} created!")
     create_user(data['username'], data['password'])
-    return redirect(url_for('user_views.get_user_page'))
+    return redirect(url_for('auth_views.get_user_page'))
 
 @user_views.route('/static/users', methods=['GET'])
 def static_user_page():
@@ -66,9 +86,17 @@ def get_user_rankings():
 
 @user_views.route('/users/competitions/<int:id>', methods = ['GET'])
 def get_user_comps(id):
-    data = request.form
-    # comps = get_user_competitions(data['id'])
-    comps = get_user_competitions(id)
+    try:
+        fields, expand = fieldset_args(COMPETITION_FIELDS, COMPETITION_EXPANSIONS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    comps = get_user_competitions(id, fields, expand)
     # userCompetitions =  [c.toDict() for c in comps]
     return jsonify(comps)
-    
\ No newline at end of file
+
+@user_views.route('/users/<int:id>/summary', methods = ['GET'])
+def get_user_summary_action(id):
+    summary = get_user_summary(id)
+    if not summary:
+        return jsonify({'error': 'user not found'}), 404
+    return jsonify(summary.get_json())
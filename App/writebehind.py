@@ -0,0 +1,192 @@
+import atexit, fcntl, glob, os, threading, uuid
+
+from App.metrics import metrics
+
+# Write-behind buffer for live score updates. The latest rank of every (comp_id, user_id)
+# is kept in memory and a flusher thread writes the buffer out in one batch every
+# SCORE_FLUSH_INTERVAL_MS, or sooner once SCORE_FLUSH_MAX_ENTRIES scores are waiting.
+# Every update is appended to a per-worker journal first, so the scores of a worker that
+# dies before flushing are picked up by the next worker that starts. A worker holds an
+# exclusive lock on its journals while it lives, which is how the others know to leave them.
+# The journal is flushed to the OS on every update, which survives the worker crashing but
+# not the machine. With sync on (SCORE_JOURNAL_FSYNC) an update only returns once it is on
+# disk, concurrent updates share one fsync (group commit).
+
+class ScoreBuffer:
+
+    def __init__(self, directory, max_entries=500, sync=False):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.sync = sync
+        self.lock = threading.Lock()
+        # taken before self.lock, held while an fsync is running
+        self.sync_lock = threading.Lock()
+        self.written = self.synced = 0
+        self.full = threading.Event()
+        self.pending = {}
+        self.flushing = {}
+        self.count = 0
+        self.journal_path = os.path.join(directory, f'scores-{os.getpid()}-{uuid.uuid4().hex[:8]}.journal')
+        self.journal = open_journal(self.journal_path)
+        self.flushing_journal = None
+
+    def put(self, comp_id, user_id, rank):
+        with self.lock:
+            self.journal.write(f'{comp_id},{user_id},{rank}\n')
+            self.journal.flush()
+            self.written += 1
+            written = self.written
+            scores = self.pending.setdefault(comp_id, {})
+            if user_id not in scores:
+                self.count += 1
+            scores[user_id] = rank
+            if self.count >= self.max_entries:
+                self.full.set()
+        if self.sync:
+            self.sync_journal(written)
+
+    def sync_journal(self, written):
+        """Wait until the first written journal lines are on disk, one fsync covers everyone waiting."""
+        with self.sync_lock:
+            if self.synced >= written:
+                return
+            with self.lock:
+                target, fd = self.written, self.journal.fileno()
+            os.fsync(fd)
+            self.synced = target
+
+    def size(self):
+        with self.lock:
+            return self.count
+
+    def buffered(self, comp_id):
+        """{user_id: rank} of the scores of a competition that are not in the database yet."""
+        with self.lock:
+            return {**self.flushing.get(comp_id, {}), **self.pending.get(comp_id, {})}
+
+    def take(self):
+        """
+        Hand the pending scores to the flusher as {comp_id: {user_id: rank}}. The journal
+        is rotated so the lines of this batch can be dropped once it is committed.
+        """
+        with self.sync_lock, self.lock:
+            if not self.pending or self.flushing_journal:
+                return {}
+            if self.sync:
+                # the lines still waiting for an fsync are in the journal rotated out here
+                os.fsync(self.journal.fileno())
+                self.synced = self.written
+            batch, self.pending, self.count = self.pending, {}, 0
+            self.flushing = batch
+            flushing_path = f'{self.journal_path}.flushing'
+            os.rename(self.journal_path, flushing_path)
+            self.flushing_journal = (flushing_path, self.journal)
+            self.journal = open_journal(self.journal_path)
+            self.full.clear()
+            return batch
+
+    def done(self, committed):
+        with self.lock:
+            path, journal = self.flushing_journal
+            if not committed:
+                # keep the batch for the next flush, newer scores win
+                for comp_id, scores in self.flushing.items():
+                    for user_id, rank in scores.items():
+                        if user_id not in self.pending.get(comp_id, {}):
+                            self.journal.write(f'{comp_id},{user_id},{rank}\n')
+                            self.pending.setdefault(comp_id, {})[user_id] = rank
+                            self.count += 1
+                self.journal.flush()
+                if self.sync:
+                    os.fsync(self.journal.fileno())
+            os.remove(path)
+            journal.close()
+            self.flushing, self.flushing_journal = {}, None
+
+    def close(self):
+        # an empty journal has nothing to recover, anything else is left for the next worker
+        with self.lock:
+            if not self.pending and not self.flushing_journal:
+                self.journal.close()
+                os.remove(self.journal_path)
+
+    def recover(self):
+        """
+        Take over the journals of dead workers. Returns the number of scores recovered.
+        """
+        recovered = 0
+        # a worker's .flushing journal holds older scores than its live journal, so it goes first
+        paths = glob.glob(os.path.join(self.directory, 'scores-*.journal*'))
+        for path in sorted(paths, key=lambda path: (path.removesuffix('.flushing'), not path.endswith('.flushing'))):
+            if path.startswith(self.journal_path):
+                continue
+            try:
+                journal = open(path)
+            except FileNotFoundError:
+                # another worker starting at the same time recovered it first
+                continue
+            with journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # its worker is still running
+                    continue
+                if not still_linked(journal, path):
+                    # recovered and removed by another worker between our open and lock
+                    continue
+                for line in journal:
+                    try:
+                        comp_id, user_id, rank = (int(value) for value in line.split(','))
+                    except ValueError:
+                        # a line cut short by the crash
+                        continue
+                    self.put(comp_id, user_id, rank)
+                    recovered += 1
+                os.remove(path)
+        return recovered
+
+def still_linked(journal, path):
+    try:
+        return os.fstat(journal.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+def open_journal(path):
+    journal = open(path, 'a')
+    fcntl.flock(journal, fcntl.LOCK_EX)
+    return journal
+
+def setup_write_behind(app, flush):
+    """
+    With SCORE_WRITE_BEHIND on, buffer score updates and start the flusher thread,
+    flush(batch) writes one batch to the database.
+    """
+    if not app.config.get('SCORE_WRITE_BEHIND', False):
+        return None
+    directory = app.config.get('SCORE_JOURNAL_DIR') or app.instance_path
+    os.makedirs(directory, exist_ok=True)
+    buffer = ScoreBuffer(directory, app.config.get('SCORE_FLUSH_MAX_ENTRIES', 500), app.config.get('SCORE_JOURNAL_FSYNC', False))
+    app.extensions['score_buffer'] = buffer
+    metrics.register_gauge('score_buffer_pending', buffer.size)
+    buffer.recover()
+
+    interval = app.config.get('SCORE_FLUSH_INTERVAL_MS', 200) / 1000
+
+    def flush_forever():
+        while True:
+            buffer.full.wait(interval)
+            with app.app_context():
+                try:
+                    flush(buffer)
+                except Exception:
+                    app.logger.exception('flushing buffered scores failed')
+
+    threading.Thread(target=flush_forever, name='score-flusher', daemon=True).start()
+
+    def flush_on_exit():
+        with app.app_context():
+            flush(buffer)
+        buffer.close()
+
+    atexit.register(flush_on_exit)
+    return buffer
@@ -47,14 +47,9 @@ function checkElements(a) {
 context('The /static/users page', ()=>{
 
   it('Test 1: Should send a http request to /api/users', async ()=>{
-    let reqs = [`${host}/api/users`];
-    let count = 0;
+    let count = requests.filter(req => req.startsWith(`${host}/api/users?limit=`)).length;
 
-    reqs.forEach(req => {
-      if(requests.includes(req))count++
-    })
-
-    expect(count).to.equal(1);
+    expect(count).to.be.at.least(1);
 
   }).timeout(2000);
 
@@ -102,6 +97,44 @@ context('The /static/users page', ()=>{
 
 });
 
+// Run against a large dataset, seed it first with: flask user seed 20000
+context('The /static/users page with a large user list', ()=>{
+
+  const RENDER_BUDGET_MS = 1500;
+
+  it('Test 4: Should draw the first rows within the time budget', async ()=>{
+    const start = Date.now();
+    await page.goto(`${host}/static/users`);
+    await page.waitForFunction(() => {
+      const cell = document.querySelector('#result tr td');
+      return cell && cell.textContent !== '…';
+    });
+
+    expect(Date.now() - start).to.be.below(RENDER_BUDGET_MS);
+  }).timeout(10000);
+
+  it('Test 5: Should only keep the visible rows in the DOM', async ()=>{
+    const rows = await page.$$eval('#result tr', rows => rows.length);
+
+    expect(rows).to.be.below(100);
+  });
+
+  it('Test 6: Should jump to the end of the list within the time budget', async ()=>{
+    const start = Date.now();
+    await page.evaluate(() => {
+      const viewport = document.querySelector('#viewport');
+      viewport.scrollTop = viewport.scrollHeight;
+    });
+    await page.waitForFunction(() => {
+      const cells = document.querySelectorAll('#result tr td');
+      return cells.length && cells[cells.length - 1].textContent !== '…';
+    }, { timeout: 10000 });
+
+    expect(Date.now() - start).to.be.below(RENDER_BUDGET_MS * 4);
+  }).timeout(15000);
+
+});
+
 after(async () => {
   await browser.close();
 });
\ No newline at end of file
@@ -1,10 +1,11 @@
-import click, pytest, sys
+import click, os, pytest, sys, time
 from flask import Flask
 from datetime import datetime
 
 from flask.cli import with_appcontext, AppGroup
 
 from App.database import db, get_migrate
+from App.models import create_search_index
 from App.main import create_app
 from App.controllers import (register_user_for_competition,add_results, get_user_rankings, get_competition_users, findCompUser, get_user_competitions, add_user_to_comp, create_competition, get_all_competitions, get_all_competitions_json, create_user, get_all_users_json, get_all_users )
 from App.controllers import *
@@ -126,6 +127,19 @@ def list_user_command(format):
     else:
         print(get_all_users_json())
 
+@user_cli.command("seed", help="Bulk inserts placeholder users, e.g. for the large dataset e2e tests")
+@click.argument("count", default=20000)
+@click.option("--batch-size", default=1000)
+def seed_users_command(count, batch_size):
+    password = User("seed", "seedpass").password
+    start = db.session.query(db.func.count(User.id)).scalar()
+    for offset in range(0, count, batch_size):
+        rows = [{'username': f'seed_user_{start + i}', 'password': password, 'overall_rank': 0, 'message': '', 'version': 1}
+                for i in range(offset, min(offset + batch_size, count))]
+        db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+    print(f'{count} users seeded!')
+
 app.cli.add_command(user_cli) # add the group to the cli
 
 '''
@@ -193,6 +207,37 @@ def get_comps():
     print(get_all_competitions_json())
 
 
+@comps.command("reindex", help = "create and rebuild the competition name search index")
+def reindex_comps():
+    with db.engine.begin() as connection:
+        create_search_index(connection, rebuild=True)
+    print("Search index rebuilt")
+
+
+@comps.command("import-results", help="Import results from a CSV or JSONL file, resuming an interrupted import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--chunk-size", default=1000, help="Rows committed per transaction")
+@click.option("--restart", is_flag=True, help="Ignore the saved progress and import the whole file again")
+def import_results_command(path, chunk_size, restart):
+    start = time.perf_counter()
+    checkpoint = get_import_checkpoint(path)
+    resumed_from, rows_before = (0, 0) if restart else (checkpoint.byte_offset, checkpoint.rows_imported + checkpoint.rows_skipped)
+    if resumed_from:
+        print(f"Resuming {path} at byte {resumed_from} after {rows_before} rows")
+
+    def report(checkpoint, total_bytes):
+        elapsed = time.perf_counter() - start or 1e-9
+        rows_per_second = (checkpoint.rows_imported + checkpoint.rows_skipped - rows_before) / elapsed
+        bytes_per_second = (checkpoint.byte_offset - resumed_from) / elapsed
+        eta = (total_bytes - checkpoint.byte_offset) / bytes_per_second if bytes_per_second else 0
+        percent = 100 * checkpoint.byte_offset / total_bytes if total_bytes else 100
+        click.echo(f"\r{checkpoint.rows_imported} rows imported, {checkpoint.rows_skipped} skipped, "
+                   f"{percent:.1f}%, {rows_per_second:.0f} rows/s, ETA {eta:.0f}s  ", nl=False)
+
+    checkpoint = import_results(path, chunk_size, restart=restart, progress=report)
+    click.echo()
+    print(f"Imported {checkpoint.rows_imported} results ({checkpoint.rows_skipped} skipped) in {time.perf_counter() - start:.2f}s")
+
 @comps.command("add_user")
 @click.argument("user_id")
 @click.argument("comp_id")
@@ -275,7 +320,47 @@ def get_user_overall_rank_and_position_command(user_id):
     if overall_rank is None:
         print(f"User {user_id} does not exist.")
     else:
-        print(f"User {user_id} has an overall rank of {overall_rank} and is positioned at {overall_rank}.")
+        print(f"User {user_id} has an overall rank of {overall_rank} and is positioned at {user_position}.")
+
+@rank_cli.command("recompute_positions", help="Recompute every user's leaderboard position from their points")
+@click.option("--batch-size", default=500, help="Rows written per UPDATE batch")
+def recompute_positions_command(batch_size):
+    changed = recompute_overall_positions(batch_size)
+    print(f"Recomputed leaderboard positions, {changed} users moved")
+
+# Older versions of arrange_top_20_overall overwrote the points in overall_rank with
+# positions 1..20, so the points are rebuilt from the competition results before the
+# positions are filled in. Run after `flask db upgrade` has added the overall_position column.
+@rank_cli.command("convert_positions", help="Convert existing data to separate points and position columns")
+def convert_positions_command():
+    # every result earned points back then
+    mark_competitions_scored()
+    users = rebuild_overall_rankings('linear')
+    print(f"Rebuilt overall points and positions from competition results for {users} users")
+
+@rank_cli.command("rebuild", help="Rescore every competition and rebuild all overall points in one pass")
+@click.option("--scoring", default=None, help="Scoring rule: linear, f1 or percentile (defaults to RANKING_SCORING)")
+@click.option("--mark-scored", is_flag=True, help="First mark every competition with results as scored (data from before scored_at)")
+def rebuild_rankings_command(scoring, mark_scored):
+    start = time.perf_counter()
+    if mark_scored:
+        print(f"Marked {mark_competitions_scored()} competitions as scored")
+    users = rebuild_overall_rankings(scoring)
+    print(f"Rebuilt overall rankings for {users} users in {time.perf_counter() - start:.2f}s")
+
+# Run periodically (e.g. daily from cron) so the stored decayed scores stay bounded
+@rank_cli.command("renormalize", help="Move the decayed ranking epoch to now and rescale the stored scores")
+def renormalize_command():
+    factor = renormalize_decayed_scores()
+    print(f"Renormalized decayed scores by a factor of {factor:.6f}")
+
+# With SCORE_WRITE_BEHIND on, starting the app already takes over the journals of dead workers
+@rank_cli.command("flush-scores", help="Write buffered rank updates, including those journaled by crashed workers")
+def flush_scores_command():
+    if not get_score_buffer():
+        print("SCORE_WRITE_BEHIND is off, nothing is buffered")
+        return
+    print(f"Flushed {flush_buffered_ranks()} buffered rank updates")
 
 @click.argument('user_id', type=int)
 def get_notificationsforuser(user_id):
@@ -296,4 +381,189 @@ def get_user_rank(user_id):
     else:
         click.echo(f"User {user_id} not found or has no overall rank.")
 
-app.cli.add_command(rank_cli)
\ No newline at end of file
+app.cli.add_command(rank_cli)
+
+
+'''
+Stats commands
+'''
+
+stats_cli = AppGroup('stats', help='Counter cache commands')
+
+# Run once for users that signed up before the profile summary existed, their summary is 404 until then
+@stats_cli.command("backfill", help="Create the profile summary of every user that has none")
+def backfill_stats_command():
+    created = backfill_user_stats()
+    db.session.commit()
+    print(f"Created {created} user summaries")
+
+@stats_cli.command("verify", help="Check competition and host counters against the real tables and repair drift")
+@click.option("--dry-run", is_flag=True, help="Only report drift, do not repair it")
+def verify_stats_command(dry_run):
+    drift = verify_counters(repair=not dry_run)
+    for table, id, column, cached, actual in drift:
+        print(f"{table} {id} {column}: cached {cached}, actual {actual}")
+    if not drift:
+        print("All counters match")
+    elif dry_run:
+        print(f"{len(drift)} counters drifted")
+    else:
+        print(f"Repaired {len(drift)} counters")
+
+app.cli.add_command(stats_cli)
+
+
+'''
+Event log commands
+'''
+
+events_cli = AppGroup('events', help='Result event log commands')
+
+# Run after `flask db upgrade` has added the result_event table, so the results written
+# before the log existed are part of it. Running it again only adds what is still missing
+@events_cli.command("backfill", help="Add events for the existing results the event log does not cover")
+def backfill_events_command():
+    events = backfill_result_events()
+    print(f"Wrote {events} events" if events else "Every result is already covered by the event log")
+
+@events_cli.command("replay", help="Rebuild projections from the events after an offset")
+@click.option("--from", "from_offset", type=int, default=None, help="Event offset to replay after (defaults to each projection's checkpoint)")
+@click.option("--projection", multiple=True, help="Projection to rebuild: standings, stats or overall (defaults to all)")
+def replay_events_command(from_offset, projection):
+    start = time.perf_counter()
+    replayed = replay_events(from_offset, list(projection) or None)
+    for name, (first, last, events) in replayed.items():
+        print(f"{name}: replayed {events} events ({first + 1}..{last})")
+    if not replayed:
+        print("All projections are up to date")
+    print(f"Done in {time.perf_counter() - start:.2f}s")
+
+@events_cli.command("status", help="Show the head of the event log and each projection's checkpoint")
+def events_status_command():
+    print(f"log head: {get_log_head()}")
+    for name, offset in get_checkpoints().items():
+        print(f"{name}: {offset}")
+
+app.cli.add_command(events_cli)
+
+
+'''
+Performance commands
+'''
+
+perf_cli = AppGroup('perf', help='Benchmarks and profiling tools')
+
+@perf_cli.command("bench-compression", help="Measure response sizes and time per request with and without compression")
+@click.option("--path", "paths", multiple=True, help="Endpoint to measure (defaults to the large JSON endpoints)")
+@click.option("--requests", "count", default=50, help="Requests per endpoint and encoding")
+def bench_compression_command(paths, count):
+    from App.compression import brotli, compress
+    client = app.test_client()
+    cache = app.extensions['compression']
+    encodings = ['identity', 'gzip'] + (['br'] if brotli else [])
+    print(f"{'endpoint':<28}{'encoding':<10}{'bytes':>10}{'ratio':>8}{'cold ms':>10}{'cached ms':>11}")
+    for path in paths or ['/competitions', '/api/users', '/top_20_users', '/rankings']:
+        plain = client.get(path, headers={'Accept-Encoding': 'identity'})
+        if plain.status_code != 200:
+            print(f"{path:<28}skipped, status {plain.status_code}")
+            continue
+        for encoding in encodings:
+            # cold: compress on every request, cached: served from the ETag cache
+            start = time.perf_counter()
+            for _ in range(count):
+                cache.entries.clear()
+                cache.size = 0
+                response = client.get(path, headers={'Accept-Encoding': encoding})
+            cold = (time.perf_counter() - start) / count * 1000
+            start = time.perf_counter()
+            for _ in range(count):
+                response = client.get(path, headers={'Accept-Encoding': encoding})
+            cached = (time.perf_counter() - start) / count * 1000
+            size = len(response.data)
+            print(f"{path:<28}{encoding:<10}{size:>10}{len(plain.data) / size:>8.1f}{cold:>10.2f}{cached:>11.2f}")
+        for encoding in encodings[1:]:
+            start = time.perf_counter()
+            for _ in range(count):
+                compress(plain.data, encoding, app.config['COMPRESS_LEVEL'])
+            print(f"{'':<28}{encoding} alone: {(time.perf_counter() - start) / count * 1000:.2f} ms CPU per {len(plain.data)} bytes")
+
+@perf_cli.command("top", help="Aggregate the saved request profiles by endpoint")
+@click.option("--endpoint", default=None, help="Only this endpoint, e.g. comp_views.get_competition")
+@click.option("--limit", default=10, help="Functions shown per endpoint")
+@click.option("--sort", type=click.Choice(['cumulative', 'tottime']), default='cumulative')
+@click.option("--dir", "directory", default=None, help="Profile directory (defaults to PROFILE_DIR)")
+def perf_top_command(endpoint, limit, sort, directory):
+    from App.profiling import aggregate_profiles, top_functions
+    directory = directory or app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+    profiles = aggregate_profiles(directory, endpoint) if os.path.isdir(directory) else {}
+    if not profiles:
+        print(f"No profiles in {directory}")
+        return
+    for name, (count, stats) in sorted(profiles.items(), key=lambda item: item[1][1].total_tt, reverse=True):
+        print(f"{name}: {count} profiles, {stats.total_tt / count * 1000:.2f} ms per request")
+        print(f"  {'calls':>9}{'own ms':>10}{'cum ms':>10}  function (per request)")
+        for function, calls, own, cumulative in top_functions(stats, limit, sort):
+            print(f"  {calls / count:>9.1f}{own / count * 1000:>10.2f}{cumulative / count * 1000:>10.2f}  {function}")
+
+@perf_cli.command("slow-queries", help="Summarize the slow-query log by statement")
+@click.option("--limit", default=10, help="Statements shown")
+@click.option("--log", "path", default=None, help="Slow-query log (defaults to SLOW_QUERY_LOG)")
+def slow_queries_command(limit, path):
+    from App.slowqueries import read_slow_queries, summarize_slow_queries, full_scans
+    path = path or app.config['SLOW_QUERY_LOG'] or os.path.join(app.instance_path, 'slow_queries.log')
+    summaries = summarize_slow_queries(read_slow_queries(path)) if os.path.exists(path) else []
+    if not summaries:
+        print(f"No slow queries logged in {path}")
+        return
+    for summary in summaries[:limit]:
+        print(f"[{summary['shape_id']}] {summary['count']} times, {summary['total_ms']:.1f} ms total, "
+              f"{summary['total_ms'] / summary['count']:.1f} ms avg, {summary['max_ms']:.1f} ms max")
+        print(f"  {summary['statement'][:300]}")
+        for origin in sorted(summary['origins']):
+            print(f"  from {origin}")
+        for table in full_scans(summary['plan']):
+            print(f"  full scan of {table}, missing index?")
+        if summary['plan']:
+            print('  plan: ' + summary['plan'].replace('\n', '\n        '))
+
+# Replay a captured trace against a build seeded like production (e.g. flask user seed),
+# save a baseline from a known good build and compare every later build against it
+@perf_cli.command("replay", help="Replay a captured traffic trace and compare per-endpoint latency with a baseline")
+@click.argument("trace", type=click.Path(exists=True))
+@click.option("--speed", default=1.0, help="Pace relative to the recording, 0 replays back to back")
+@click.option("--as-user", "username", default=None, help="Username the authenticated requests are sent as")
+@click.option("--baseline", type=click.Path(), default=None, help="Baseline JSON file to compare with")
+@click.option("--save-baseline", is_flag=True, help="Write this run's latencies to the baseline file")
+@click.option("--tolerance", default=0.2, help="Median slowdown that counts as a regression")
+def replay_command(trace, speed, username, baseline, save_baseline, tolerance):
+    import json
+    from App.traffic import read_trace, replay_trace, latency_summary, compare_to_baseline
+    auth_header = None
+    if username:
+        user = get_user_by_username(username)
+        if not user:
+            sys.exit(f"No user named {username}")
+        auth_header = f'Bearer {jwt_token_for(user)}'
+    summary = latency_summary(replay_trace(app.test_client(), read_trace(trace), speed, auth_header))
+    previous = {}
+    if baseline and os.path.exists(baseline) and not save_baseline:
+        with open(baseline) as f:
+            previous = json.load(f)
+
+    print(f"{'endpoint':<40}{'requests':>9}{'p50 ms':>10}{'p95 ms':>10}{'base p50':>10}{'delta':>9}  status changes")
+    regressions = 0
+    for endpoint, p50, base, delta, regressed in compare_to_baseline(summary, previous, tolerance):
+        stats = summary[endpoint]
+        regressions += regressed
+        print(f"{endpoint:<40}{stats['count']:>9}{p50:>10.2f}{stats['p95']:>10.2f}"
+              f"{f'{base:.2f}' if base is not None else '-':>10}{f'{delta:+.0%}' if delta is not None else '-':>9}"
+              f"  {stats['status_changes']}{'  REGRESSION' if regressed else ''}")
+
+    if baseline and save_baseline:
+        with open(baseline, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved baseline to {baseline}")
+    if regressions:
+        sys.exit(f"{regressions} endpoints regressed by more than {tolerance:.0%}")
+
+app.cli.add_command(perf_cli)